@@ -268,9 +268,61 @@ class evalExpr(object):
         self.operators = {ast.Add: op.add, ast.Sub: op.sub, ast.Mult: op.mul, ast.Div: op.truediv, ast.Pow: op.pow,
                           ast.BitXor: op.xor, ast.USub: op.neg}
 
+        # supported functions (compiled expressions only)
+        self.functions = {'abs': abs, 'max': max, 'min': min, 'round': round}
+
+        # compiled expressions by (expression text, allowed names)
+        self.compiled = {}
+
     def eval_expr(self, expr):
         return self.eval_(ast.parse(expr, mode='eval').body)
 
+    def compile_expr(self, expr, names=()):
+        """
+        The compile_expr method turns an expression that may use variables
+        (e.g., '(thing1 - 32) * 5/9') into a function that evaluates it. The
+        expression is parsed once and compiled into nested closures, and the
+        result is cached by expression text, so evaluating it again costs a
+        few function calls rather than a parse and a tree walk.
+
+        Returns (function, names used); call function(values) with a dict of
+        the variable values. Raises SyntaxError for an expression that can't
+        be parsed and TypeError for one that uses anything other than
+        numbers, the operators above, the functions above and `names`.
+        """
+
+        key = (expr, tuple(names))
+
+        if key not in self.compiled:
+            used = set()
+            function = self.compile_(ast.parse(expr.strip(), mode='eval').body, frozenset(names), used)
+            self.compiled[key] = (function, frozenset(used))
+
+        return self.compiled[key]
+
+    def compile_(self, node, names, used):
+        if isinstance(node, ast.Num):  # <number>
+            value = node.n
+            return lambda values: value
+        elif isinstance(node, ast.Name) and node.id in names:  # <variable>
+            name = node.id
+            used.add(name)
+            return lambda values: values[name]
+        elif isinstance(node, ast.BinOp) and type(node.op) in self.operators:  # <left> <operator> <right>
+            operator, left, right = self.operators[type(node.op)], \
+                self.compile_(node.left, names, used), self.compile_(node.right, names, used)
+            return lambda values: operator(left(values), right(values))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in self.operators:  # <operator> <operand> e.g., -1
+            operator, operand = self.operators[type(node.op)], self.compile_(node.operand, names, used)
+            return lambda values: operator(operand(values))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self.functions \
+                and not node.keywords and not getattr(node, 'starargs', None) \
+                and not getattr(node, 'kwargs', None):  # <function>(<args>) e.g., max(thing1, thing2)
+            function, args = self.functions[node.func.id], [self.compile_(arg, names, used) for arg in node.args]
+            return lambda values: function(*[arg(values) for arg in args])
+        else:
+            raise TypeError(node)
+
     def eval_(self, node):
         if isinstance(node, ast.Num):  # <number>
             return node.n
@@ -0,0 +1,251 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: accounts.py
+:author: DaveL17
+
+Thingspeak account profiles for the Thingspeak Plugin
+
+Each Thingspeak account has its own API key, host (the public service or a
+local server) and license, and so its own channels, write keys and message
+budget. The Accounts class holds one Account for each profile: the default
+profile comes from the plugin's own settings (apiKey, devicePort, deviceIP,
+licenseTier and licenseUnits) and any others are kept as JSON in the
+accountProfiles plugin pref, using the same setting names. Each Account has
+its own channel cache and rate limiter, so spreading channels across several
+accounts spreads uploads across several message budgets.
+
+Plugin devices and channel tools name their profile in the accountProfile
+prop. A device without one (including every device made before profiles
+existed) uses the default profile, as does one whose profile has been
+removed.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import collections
+import json
+import threading
+
+# My modules
+import channel_cache
+import rate_limit
+import transport
+
+# =============================================================================
+
+DEFAULT      = u'default'  # Id of the profile held in the plugin's own settings.
+DEFAULT_NAME = u'Default'
+PREF         = u'accountProfiles'
+SETTINGS     = (u'apiKey', u'devicePort', u'deviceIP', u'licenseTier', u'licenseUnits')
+DEFAULT_IP   = u"XXX.XXX.XXX.XXX:3000"
+
+
+def load_profiles(prefs):
+    """
+    Return the extra profiles stored in the plugin prefs
+
+    -----
+
+    :param prefs: plugin prefs
+    :return collections.OrderedDict: profile id -> {'name': ..., 'apiKey': ..., ...}
+    """
+
+    try:
+        profiles = json.loads(prefs.get(PREF) or u"{}")
+    except ValueError:
+        profiles = {}
+
+    return collections.OrderedDict(sorted(profiles.items(), key=lambda item: item[1].get('name', u"").lower()))
+
+
+def dump_profiles(profiles):
+    """
+    Return profiles in the form stored in the plugin prefs
+
+    -----
+
+    :param dict profiles: profile id -> settings
+    :return str:
+    """
+
+    return json.dumps(profiles, sort_keys=True)
+
+
+def new_profile_id(profiles):
+    """
+    Return an unused profile id
+
+    Ids never change once given out, so a renamed profile keeps its devices.
+
+    -----
+
+    :param dict profiles:
+    :return str:
+    """
+
+    used = [int(profile_id) for profile_id in profiles if profile_id.isdigit()]
+    return u"{0}".format(max(used or [0]) + 1)
+
+
+class Account(object):
+    """
+    One Thingspeak account and the channel cache and rate limiter that go with it
+    """
+
+    def __init__(self, plugin, profile_id, settings, ttl=channel_cache.DEFAULT_TTL):
+        self.profile_id    = profile_id
+        self.name          = u""
+        self.api_key       = u""
+        self.local         = False
+        self.device_ip     = DEFAULT_IP
+        self.tier          = rate_limit.DEFAULT_TIER
+        self.units         = 1
+        self.rate_limiter  = rate_limit.RateLimiter()
+        self.channel_cache = channel_cache.ChannelCache(plugin, lambda: plugin.getChannelList(cached=False,
+                                                                                              account=self), ttl=ttl)
+        self.configure(settings)
+
+    # =============================================================================
+    @property
+    def host(self):
+        """
+        The Thingspeak host the account's API calls go to
+
+        -----
+
+        :return str:
+        """
+
+        if self.local:
+            return self.device_ip
+
+        return transport.REMOTE_HOST
+
+    # =============================================================================
+    def configure(self, settings):
+        """
+        Apply the profile's settings
+
+        A new key or host means a different set of channels, so the channel
+        cache is emptied when either changes.
+
+        -----
+
+        :param dict settings: name, apiKey, devicePort, deviceIP, licenseTier and licenseUnits
+        """
+
+        old = (self.host, self.api_key)
+
+        self.name      = settings.get('name', self.name) or self.profile_id
+        self.api_key   = settings.get('apiKey', u"")
+        self.local     = bool(settings.get('devicePort', False))
+        self.device_ip = settings.get('deviceIP', DEFAULT_IP)
+        self.tier      = settings.get('licenseTier', rate_limit.DEFAULT_TIER)
+
+        try:
+            self.units = int(settings.get('licenseUnits', 1))
+        except ValueError:
+            self.units = 1
+
+        if old != (self.host, self.api_key):
+            self.channel_cache.invalidate()
+
+        self.rate_limiter.configure(*self.limits())
+
+    # =============================================================================
+    def limits(self):
+        """
+        Return the (update interval, messages per day) limits for the account
+
+        A local Thingspeak server isn't subject to license limits.
+
+        -----
+
+        :return tuple:
+        """
+
+        if self.local:
+            return 0, 0
+
+        return rate_limit.license_limits(self.tier, self.units)
+
+
+class Accounts(object):
+    """
+    The default account and any extra profiles, by profile id
+    """
+
+    def __init__(self, plugin, prefs):
+        self.plugin   = plugin
+        self.accounts = collections.OrderedDict()
+        self.lock     = threading.Lock()
+        self.load(prefs)
+
+    # =============================================================================
+    def load(self, prefs):
+        """
+        Build or update the accounts from the plugin prefs
+
+        Accounts that are still configured keep their channel cache and rate
+        limiter (and so the budget they've already spent); removed profiles
+        are dropped.
+
+        -----
+
+        :param prefs: plugin prefs
+        """
+
+        ttl      = int(prefs.get('channelCacheTtl', channel_cache.DEFAULT_TTL))
+        profiles = [(DEFAULT, dict([(u'name', DEFAULT_NAME)] + [(key, prefs.get(key)) for key in SETTINGS
+                                                                if key in prefs]))]
+        profiles.extend(load_profiles(prefs).items())
+
+        with self.lock:
+            accounts = collections.OrderedDict()
+
+            for profile_id, settings in profiles:
+                account = self.accounts.get(profile_id)
+
+                if account is None:
+                    account = Account(self.plugin, profile_id, settings, ttl=ttl)
+                else:
+                    account.configure(settings)
+                    account.channel_cache.ttl = ttl
+
+                accounts[profile_id] = account
+
+            self.accounts = accounts
+
+    # =============================================================================
+    def get(self, profile_id=None):
+        """
+        Return the account for a profile id, or the default account
+
+        -----
+
+        :param str profile_id:
+        :return Account:
+        """
+
+        accounts = self.accounts
+        return accounts.get(profile_id or DEFAULT) or accounts[DEFAULT]
+
+    # =============================================================================
+    def hosts(self):
+        """
+        Return the hosts in use by any account
+
+        -----
+
+        :return set:
+        """
+
+        return set(account.host for account in self.accounts.values())
+
+    # =============================================================================
+    def values(self):
+
+        return list(self.accounts.values())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: aggregate.py
+:author: DaveL17
+
+Per-field interval aggregation for the Thingspeak Plugin
+
+An Accumulator summarizes every value a thing takes on between two samples
+(last, mean, min, max, sum, count or time-weighted mean) in a handful of
+running totals, so memory use doesn't depend on how often the source
+changes. Each window starts with the value carried over from the previous
+one; a source that didn't change during the window reports that value.
+"""
+
+# =============================================================================
+
+LAST    = u'last'
+MEAN    = u'mean'
+MIN     = u'min'
+MAX     = u'max'
+SUM     = u'sum'
+COUNT   = u'count'
+TW_MEAN = u'twmean'
+
+MODES = (LAST, MEAN, MIN, MAX, SUM, COUNT, TW_MEAN)
+
+
+class Accumulator(object):
+    """
+    Streaming aggregate of one field over the current sample window
+    """
+
+    __slots__ = ('mode', 'start', 'last', 'changed', 'count', 'total', 'low', 'high', 'area')
+
+    def __init__(self, mode, now, value=None):
+        self.mode = mode if mode in MODES else LAST
+        self.last = value
+        self.reset(now)
+
+    # =============================================================================
+    def add(self, value, now):
+        """
+        Fold a new value into the window
+
+        -----
+
+        :param float value:
+        :param float now: epoch seconds
+        """
+
+        # Nothing was known before this value, so the window effectively starts now.
+        if self.last is None:
+            self.start = now
+
+        self._advance(now)
+
+        self.count += 1
+        self.total += value
+        self.low    = value if self.low is None else min(self.low, value)
+        self.high   = value if self.high is None else max(self.high, value)
+        self.last   = value
+
+    # =============================================================================
+    def result(self, now):
+        """
+        Return the aggregate for the window so far (None if nothing is known)
+
+        -----
+
+        :param float now: epoch seconds
+        :return float:
+        """
+
+        if self.mode == COUNT:
+            return self.count
+
+        if self.mode == SUM:
+            return self.total
+
+        if self.last is None:
+            return None
+
+        if self.mode == MIN:
+            return self.low
+
+        if self.mode == MAX:
+            return self.high
+
+        if self.mode == MEAN:
+            return self.total / self.count if self.count else self.last
+
+        if self.mode == TW_MEAN:
+            self._advance(now)
+            elapsed = now - self.start
+            return self.area / elapsed if elapsed > 0 else self.last
+
+        return self.last
+
+    # =============================================================================
+    def reset(self, now):
+        """
+        Start a new window, carrying the current value forward
+
+        -----
+
+        :param float now: epoch seconds
+        """
+
+        self.start   = now
+        self.changed = now
+        self.count   = 0
+        self.total   = 0.0
+        self.low     = self.last
+        self.high    = self.last
+        self.area    = 0.0
+
+        # The carried value counts toward the mean so that a quiet window reports it.
+        if self.last is not None and self.mode == MEAN:
+            self.count = 1
+            self.total = self.last
+
+    # =============================================================================
+    def _advance(self, now):
+
+        # Time-weighting: the previous value held from the last change until now.
+        if self.last is not None and now > self.changed:
+            self.area += self.last * (now - self.changed)
+
+        self.changed = max(self.changed, now)
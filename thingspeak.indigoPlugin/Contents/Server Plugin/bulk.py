@@ -0,0 +1,77 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: bulk.py
+:author: DaveL17
+
+Bulk update batching for the Thingspeak Plugin
+
+Samples for a channel are collected in the upload queue and sent to
+Thingspeak in a single POST to /channels/<id>/bulk_update.json instead of one
+/update.json call per sample. The helpers here shape queued samples into
+bulk update entries and split them so that no request exceeds the endpoint's
+entry count or payload size limits.
+
+Thingspeak API - https://www.mathworks.com/help/thingspeak/bulkwritejsondata.html
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import json
+
+# =============================================================================
+
+MAX_ENTRIES       = 960     # Thingspeak limit on updates per bulk request (free license).
+MAX_PAYLOAD_BYTES = 131072  # Conservative cap on the size of a single bulk request body.
+ENVELOPE_BYTES    = 64      # Allowance for the write key and JSON wrapper around the updates.
+
+BULK_KEYS = ('created_at', 'field1', 'field2', 'field3', 'field4', 'field5', 'field6', 'field7', 'field8',
+             'latitude', 'longitude', 'elevation', 'status')  # Keys accepted for each bulk update entry.
+
+
+def bulk_entry(entry):
+    """
+    Return the subset of a queued sample that bulk_update.json accepts
+
+    -----
+
+    :param dict entry: queued sample
+    :return dict:
+    """
+
+    return dict((key, entry[key]) for key in BULK_KEYS if key in entry)
+
+
+def split(rows, max_entries=MAX_ENTRIES, max_bytes=MAX_PAYLOAD_BYTES):
+    """
+    Split queued samples into chunks that respect the bulk update limits
+
+    -----
+
+    :param list rows: [(row_id, entry), ...] as returned by UploadQueue.peek()
+    :param int max_entries: maximum entries per request
+    :param int max_bytes: maximum request body size
+    :return list: [[(row_id, entry), ...], ...]
+    """
+
+    chunks = []
+    chunk  = []
+    size   = ENVELOPE_BYTES
+
+    for row in rows:
+        entry_size = len(json.dumps(bulk_entry(row[1]))) + 1  # Plus the separating comma.
+
+        if chunk and (len(chunk) >= max_entries or size + entry_size > max_bytes):
+            chunks.append(chunk)
+            chunk = []
+            size  = ENVELOPE_BYTES
+
+        chunk.append(row)
+        size += entry_size
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
@@ -0,0 +1,229 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: channel_cache.py
+:author: DaveL17
+
+Channel metadata cache for the Thingspeak Plugin
+
+The ChannelCache class holds an index of the account's channels keyed by
+channel id (write key, name and field labels) so that uploads don't need to
+request the full /channels.json listing for every device. The index is
+rebuilt when it is older than its time to live, when a channel is created,
+updated or deleted, or when Thingspeak rejects a cached write key.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+import time as t
+
+# =============================================================================
+
+DEFAULT_TTL  = 900  # Seconds before the channel index is considered stale.
+MISS_BACKOFF = 15   # Minimum seconds between listings caused by an unknown channel.
+
+
+def field_labels(channel):
+    """
+    Return the non-empty field1..field8 labels of a channel dict
+
+    -----
+
+    :param dict channel:
+    :return dict:
+    """
+
+    labels = {}
+
+    for _ in range(1, 9):
+        field = 'field{0}'.format(_)
+        if channel.get(field):
+            labels[field] = channel[field]
+
+    return labels
+
+
+class ChannelCache(object):
+    """
+    Index of channel metadata keyed by channel id
+
+    The cache is populated by a fetch callable which must return a
+    (response_code, channel_list) tuple in the same form as
+    Plugin.sendToThingspeak('get', '/channels.json', ...).
+    """
+
+    def __init__(self, plugin, fetch, ttl=DEFAULT_TTL):
+        self.plugin     = plugin
+        self.logger     = plugin.logger
+        self.fetch      = fetch
+        self.ttl        = ttl
+        self.channels   = {}
+        self.fetched_at = 0
+        self.lock       = threading.RLock()
+
+    # =============================================================================
+    def load(self, channel_list):
+        """
+        Rebuild the index from a /channels.json listing
+
+        Callers that have already fetched the channel listing for another
+        reason (menu tools, dialogs) hand it here so the next upload cycle
+        doesn't need to fetch it again.
+
+        -----
+
+        :param list channel_list: decoded /channels.json response
+        """
+
+        channels = {}
+
+        for thing in channel_list or []:
+            write_key = ""
+            read_key  = ""
+            for key in thing.get('api_keys', []):
+                if key.get('write_flag'):
+                    write_key = key['api_key']
+                elif not read_key:
+                    read_key = key['api_key']
+
+            channels[str(thing['id'])] = {'write_key': write_key,
+                                          'read_key':  read_key,
+                                          'name':      thing.get('name', u""),
+                                          'fields':    field_labels(thing),
+                                          }
+
+        with self.lock:
+            self.channels   = channels
+            self.fetched_at = t.time()
+
+    # =============================================================================
+    def refresh(self):
+        """
+        Fetch the channel listing and rebuild the index
+
+        -----
+
+        :return bool: True if the listing was fetched successfully
+        """
+
+        response, response_dict = self.fetch()
+
+        if response == 200:
+            self.load(response_dict)
+            self.logger.debug(u"Channel cache refreshed ({0} channels).".format(len(self.channels)))
+            return True
+
+        # Don't hammer the service after a failure; wait for the next miss window.
+        with self.lock:
+            self.fetched_at = t.time() - self.ttl + MISS_BACKOFF
+
+        return False
+
+    # =============================================================================
+    def invalidate(self):
+        """
+        Mark the index stale so that the next lookup refetches it
+
+        -----
+
+        """
+
+        with self.lock:
+            self.fetched_at = 0
+
+    # =============================================================================
+    def is_stale(self):
+        """
+        Return True if the index is older than its time to live
+
+        -----
+
+        :return bool:
+        """
+
+        return t.time() - self.fetched_at > self.ttl
+
+    # =============================================================================
+    def get(self, channel_id):
+        """
+        Return the cached metadata for channel_id
+
+        The index is refreshed first if it has expired. A channel that isn't in
+        the index (i.e., one created outside the plugin) causes at most one
+        refresh per MISS_BACKOFF seconds.
+
+        -----
+
+        :param channel_id:
+        :return dict: {'write_key': str, 'read_key': str, 'name': str, 'fields': dict} or None
+        """
+
+        channel_id = str(channel_id)
+
+        with self.lock:
+            refresh = self.is_stale() or (channel_id not in self.channels and
+                                          t.time() - self.fetched_at > MISS_BACKOFF)
+
+        # Refresh without holding the lock: the fetch may be shared with another caller
+        # that loads its result here when it's done. Concurrent fetches are coalesced
+        # by the fetch itself.
+        if refresh:
+            self.refresh()
+
+        with self.lock:
+            return self.channels.get(channel_id)
+
+    # =============================================================================
+    def write_key(self, channel_id):
+        """
+        Return the write API key for channel_id (or None)
+
+        -----
+
+        :param channel_id:
+        :return str:
+        """
+
+        channel = self.get(channel_id)
+
+        if channel:
+            return channel['write_key'] or None
+
+        return None
+
+    # =============================================================================
+    def read_key(self, channel_id):
+        """
+        Return a read API key for channel_id (or None)
+
+        -----
+
+        :param channel_id:
+        :return str:
+        """
+
+        channel = self.get(channel_id)
+
+        if channel:
+            return channel['read_key'] or None
+
+        return None
+
+    # =============================================================================
+    def set_fields(self, channel_id, channel):
+        """
+        Record field labels for channel_id from a feed response
+
+        -----
+
+        :param channel_id:
+        :param dict channel: the 'channel' element of a feeds.json response
+        """
+
+        with self.lock:
+            entry = self.channels.get(str(channel_id))
+            if entry is not None:
+                entry['fields'] = field_labels(channel)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: circuit_breaker.py
+:author: DaveL17
+
+Per-host circuit breaker for the Thingspeak Plugin
+
+The CircuitBreaker class tracks the health of a single Thingspeak host. After
+FAILURE_THRESHOLD consecutive connection failures, timeouts or server errors
+the circuit opens and callers fail fast (instead of waiting on a dead host)
+until a jittered, exponentially growing back-off delay has passed. The next
+caller is then allowed to send one cheap probe request (half-open); if the
+probe succeeds the circuit closes again, otherwise it reopens with a longer
+delay.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import random
+import threading
+import time as t
+
+# Third-party modules
+import requests
+
+# =============================================================================
+
+CLOSED    = u"closed"
+OPEN      = u"open"
+HALF_OPEN = u"half-open"
+
+FAILURE_THRESHOLD = 3    # Consecutive failures before the circuit opens.
+BASE_DELAY        = 5    # Seconds to wait after the circuit first opens.
+MAX_DELAY         = 600  # Upper bound on the back-off delay.
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a host whose circuit is open
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Closed / open / half-open state machine for a single host
+
+    on_change, if given, is called as on_change(breaker) whenever the state
+    changes. It is called after the lock is released, so it may take its time
+    (or use the breaker) without holding up requests to the host.
+    """
+
+    def __init__(self, host, on_change=None, threshold=FAILURE_THRESHOLD, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY):
+        self.host       = host
+        self.on_change  = on_change
+        self.threshold  = threshold
+        self.base_delay = base_delay
+        self.max_delay  = max_delay
+        self.state      = CLOSED
+        self.failures   = 0  # Consecutive failures.
+        self.opened     = 0  # Number of times the circuit has opened without an intervening success.
+        self.retry_at   = 0
+        self.lock       = threading.Lock()
+
+    # =============================================================================
+    def backoff(self):
+        """
+        Return the next back-off delay in seconds
+
+        The delay doubles each time the circuit reopens and is jittered
+        between half and all of its nominal value so that hosts (and plugin
+        restarts) don't retry in lockstep.
+
+        -----
+
+        :return float:
+        """
+
+        delay = min(self.max_delay, self.base_delay * (2 ** min(self.opened, 16)))
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+    # =============================================================================
+    def before_request(self):
+        """
+        Decide whether a request may be sent
+
+        -----
+
+        :return str: CLOSED to send normally or HALF_OPEN if the caller must probe first
+        :raises CircuitOpenError: if the circuit is open (or a probe is already in flight)
+        """
+
+        with self.lock:
+            if self.state == CLOSED:
+                return CLOSED
+
+            probe = self.state == OPEN and t.time() >= self.retry_at
+
+            if probe:
+                self._set_state(HALF_OPEN)
+
+        if probe:
+            # Only the caller given HALF_OPEN can settle the probe, so don't leave the
+            # circuit half-open if on_change fails before it gets there.
+            try:
+                self._notify(True)
+            except Exception:
+                self.record_failure()
+                raise
+
+            return HALF_OPEN
+
+        raise CircuitOpenError(u"Circuit for {0} is {1}; retry in {2:.0f} seconds.".format(
+            self.host, self.state, max(0, self.retry_at - t.time())))
+
+    # =============================================================================
+    def record_success(self):
+        """
+        Note a successful exchange with the host and close the circuit
+
+        -----
+
+        """
+
+        with self.lock:
+            self.failures = 0
+            self.opened   = 0
+            changed       = self._set_state(CLOSED)
+
+        self._notify(changed)
+
+    # =============================================================================
+    def record_failure(self):
+        """
+        Note a failed exchange with the host, opening the circuit if needed
+
+        -----
+
+        """
+
+        changed = False
+
+        with self.lock:
+            self.failures += 1
+
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                self.retry_at = t.time() + self.backoff()
+                self.opened  += 1
+                changed       = self._set_state(OPEN)
+
+        self._notify(changed)
+
+    # =============================================================================
+    def _set_state(self, state):
+
+        # Called with the lock held; the caller reports the change once it's released.
+        changed    = state != self.state
+        self.state = state
+
+        return changed
+
+    # =============================================================================
+    def _notify(self, changed):
+
+        if changed and self.on_change:
+            self.on_change(self)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: clock.py
+:author: DaveL17
+
+Epoch and local time helpers for the Thingspeak Plugin
+
+The plugin schedules uploads from epoch seconds on the local clock and only
+formats times for display. The LocalTime class turns an epoch into a local
+time string using a cached UTC offset. The offset is worked out again only
+when a time falls outside the span it is valid for, which ends at the next
+daylight saving time transition.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import _strptime  # strptime() imports this on first use, which fails on a thread while another holds the import lock.
+import calendar
+import time as t
+
+# =============================================================================
+
+DISPLAY_FORMAT = '%Y-%m-%d %H:%M:%S'
+HORIZON        = 86400 * 366  # How far ahead to look for the next transition.
+PROBE          = 86400        # Step used to find a transition before narrowing it down.
+
+
+def utc_offset(epoch):
+    """
+    Return the local UTC offset in seconds (east positive) at epoch
+
+    -----
+
+    :param float epoch:
+    :return int:
+    """
+
+    epoch = int(epoch)
+    return calendar.timegm(t.localtime(epoch)) - epoch
+
+
+def parse_utc(value):
+    """
+    Convert a UTC timestamp string to epoch seconds
+
+    Accepts Thingspeak's '2018-04-01T12:00:00Z' and the plugin's own
+    '2018-04-01 12:00:00 +0000' (anything after the seconds is ignored).
+
+    -----
+
+    :param str value:
+    :return int:
+    """
+
+    return calendar.timegm(t.strptime(value[:19].replace('T', ' '), DISPLAY_FORMAT))
+
+
+class LocalTime(object):
+    """
+    Epoch to local time conversion with a cached UTC offset
+    """
+
+    def __init__(self):
+        self.span = (0, -1, 0)  # (valid from, valid until, offset); one tuple so threads never see half an update
+
+    # =============================================================================
+    def refresh(self, epoch):
+        """
+        Work out the offset at epoch and how long it holds
+
+        The span runs until the next change in the offset within HORIZON,
+        found by stepping ahead a day at a time and then bisecting to the
+        second.
+
+        -----
+
+        :param float epoch:
+        """
+
+        epoch  = int(epoch)
+        offset = utc_offset(epoch)
+        low    = epoch
+        high   = epoch + HORIZON
+
+        for probe in range(epoch + PROBE, epoch + HORIZON, PROBE):
+            if utc_offset(probe) != offset:
+                high = probe
+                break
+            low = probe
+
+        # The offset changes somewhere in (low, high]; narrow it down.
+        if utc_offset(high) != offset:
+            while high - low > 1:
+                middle = (low + high) // 2
+
+                if utc_offset(middle) == offset:
+                    low = middle
+                else:
+                    high = middle
+
+        self.span = (epoch, high, offset)
+
+    # =============================================================================
+    def utc_offset(self, epoch):
+        """
+        Return the local UTC offset at epoch, refreshing the cache when needed
+
+        -----
+
+        :param float epoch:
+        :return int:
+        """
+
+        valid_from, valid_until, offset = self.span
+
+        if not valid_from <= epoch < valid_until:
+            self.refresh(epoch)
+            offset = self.span[2]
+
+        return offset
+
+    # =============================================================================
+    def display(self, epoch):
+        """
+        Format epoch as a local time string
+
+        -----
+
+        :param float epoch:
+        :return str: e.g., '2018-04-01 07:00:00'
+        """
+
+        return t.strftime(DISPLAY_FORMAT, t.gmtime(int(epoch) + self.utc_offset(epoch)))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: coercion.py
+:author: DaveL17
+
+Numeric coercion for the Thingspeak Plugin
+
+Thingspeak only charts numbers, so every thing value is coerced to a float
+before it is uploaded. Indigo hands us a mix of types: numbers and booleans
+are converted directly; strings such as "72.5 °F", "-3,5" or "1.2e3 lux" have
+the first number pulled out with a precompiled regex (signs, exponents, and
+either '.' or ',' as the decimal separator are understood), and "on"/"off"
+style strings become 1.0/0.0. A comma followed by exactly three digits groups
+thousands ("1,234 W" is 1234), as it did before values were parsed this way;
+other single commas are decimal commas. String results are memoized because the same
+handful of values tends to come around again and again.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import math
+import re
+
+# =============================================================================
+
+NUMBER      = re.compile(r'[-+]?(?:\d+(?:[.,]\d+)*[.,]?|[.,]\d+)(?:[eE][-+]?\d+)?')
+FIRST       = re.compile(r'[-+]?\d*[.,]?\d*')  # A number up to the end of its first decimal part.
+TRUE_WORDS  = frozenset((u'TRUE', u'ON'))
+FALSE_WORDS = frozenset((u'FALSE', u'OFF'))
+MEMO_SIZE   = 1024  # Distinct strings remembered before the memo starts over.
+
+_memo = {}
+
+
+def coerce(val):
+    """
+    Return val as a float (booleans as 1.0 or 0.0), or None if it has no number in it
+
+    -----
+
+    :param val: value of an Indigo device state or variable
+    :return float:
+    """
+
+    # bool is a subclass of int, so it has to be checked first.
+    if isinstance(val, bool):
+        return float(val)
+
+    if isinstance(val, (int, float)):
+        return float(val)
+
+    try:
+        return _memo[val]
+    except (KeyError, TypeError):
+        pass
+
+    result = _coerce_string(val)
+
+    try:
+        if len(_memo) >= MEMO_SIZE:
+            _memo.clear()
+        _memo[val] = result
+    except TypeError:
+        pass
+
+    return result
+
+
+def coerce_many(values):
+    """
+    Coerce a sequence of values in one pass
+
+    -----
+
+    :param values:
+    :return list: floats (or None for values with no number in them)
+    """
+
+    memo   = _memo
+    result = []
+
+    for val in values:
+        if isinstance(val, bool):
+            result.append(float(val))
+        elif isinstance(val, (int, float)):
+            result.append(float(val))
+        else:
+            try:
+                result.append(memo[val])
+            except (KeyError, TypeError):
+                result.append(coerce(val))
+
+    return result
+
+
+def _coerce_string(val):
+
+    try:
+        text = val if isinstance(val, type(u'')) else str(val).decode('utf-8', 'replace')
+    except AttributeError:
+        text = str(val)  # Python 3
+
+    text = text.strip()
+
+    try:
+        number = float(text)
+    except ValueError:
+        word = text.upper()
+
+        if word in TRUE_WORDS:
+            return 1.0
+
+        if word in FALSE_WORDS:
+            return 0.0
+
+        match = NUMBER.search(text)
+
+        if not match:
+            return None
+
+        number = float(_normalize(match.group(0)))
+
+    # "nan" and "inf" parse (and "1e400" overflows to inf), but they're not something
+    # Thingspeak can chart.
+    return None if math.isnan(number) or math.isinf(number) else number
+
+
+def _grouped(integer, separator):
+
+    # True if separator groups thousands in integer: 1-3 digits (not starting with 0),
+    # then groups of three.
+    groups = integer.lstrip(u'+-').split(separator)
+    return 1 <= len(groups[0]) <= 3 and not groups[0].startswith(u'0') and \
+        all(group.isdigit() for group in groups) and all(len(group) == 3 for group in groups[1:])
+
+
+def _normalize(number):
+
+    # With both separators present, the last one is the decimal point and the other
+    # groups thousands. A lone ',' groups thousands when three digits follow it
+    # ("1,234") and is a decimal comma otherwise ("3,5"); repeated separators group.
+    # Separators that don't group thousands (e.g., "10.0.1") end the number at the
+    # first one's decimal part.
+    mantissa, _, exponent = number.replace(u'E', u'e').partition(u'e')
+    mantissa = mantissa.rstrip(u'.,')
+
+    if u',' in mantissa and u'.' in mantissa:
+        decimal   = u'.' if mantissa.rfind(u'.') > mantissa.rfind(u',') else u','
+        thousands = u',' if decimal == u'.' else u'.'
+        integer, _, fraction = mantissa.rpartition(decimal)
+
+        if _grouped(integer, thousands):
+            mantissa = integer.replace(thousands, u'') + u'.' + fraction
+        else:
+            mantissa = FIRST.match(mantissa).group(0).replace(u',', u'.')
+
+    elif mantissa.count(u',') == 1:
+        mantissa = mantissa.replace(u',', u'' if _grouped(mantissa, u',') else u'.')
+
+    elif mantissa.count(u',') > 1 or mantissa.count(u'.') > 1:
+        separator = u',' if u',' in mantissa else u'.'
+
+        if _grouped(mantissa, separator):
+            mantissa = mantissa.replace(separator, u'')
+        else:
+            mantissa = FIRST.match(mantissa).group(0).replace(u',', u'.')
+
+    return mantissa + (u'e' + exponent if exponent else u'')
@@ -0,0 +1,75 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: deadband.py
+:author: DaveL17
+
+Change-only uploads for the Thingspeak Plugin
+
+A device in change-only mode only queues a sample when at least one field has
+moved beyond its deadband since the last sample that was queued, or when the
+channel has been quiet for longer than its heartbeat. Each field may have an
+absolute deadband, a percent deadband (relative to the last queued value), or
+both (in which case it has to clear both); a field with neither moves on any
+change.
+"""
+
+# =============================================================================
+
+DEFAULT_HEARTBEAT = 3600  # Longest a channel goes without an upload, in seconds.
+
+
+def moved(old, new, absolute=0.0, percent=0.0):
+    """
+    Return True if a field has moved beyond its deadband
+
+    Values that can't be compared numerically have moved if they differ.
+
+    -----
+
+    :param old: value in the last queued sample
+    :param new: current value
+    :param float absolute: absolute deadband
+    :param float percent: percent deadband
+    :return bool:
+    """
+
+    try:
+        change = abs(float(new) - float(old))
+    except (TypeError, ValueError):
+        return new != old
+
+    if absolute and change <= absolute:
+        return False
+
+    if percent and old and change <= abs(float(old)) * percent / 100.0:
+        return False
+
+    return change > 0
+
+
+def any_moved(previous, current, bands):
+    """
+    Return True if any field has moved beyond its deadband
+
+    A field that appears in (or disappears from) the sample counts as moved.
+
+    -----
+
+    :param dict previous: {'field1': val, ...} from the last queued sample
+    :param dict current: {'field1': val, ...}
+    :param dict bands: {'field1': (absolute, percent), ...}
+    :return bool:
+    """
+
+    for key in set(previous) | set(current):
+        if key not in previous or key not in current:
+            return True
+
+        absolute, percent = bands.get(key, (0.0, 0.0))
+
+        if moved(previous[key], current[key], absolute, percent):
+            return True
+
+    return False
@@ -0,0 +1,198 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: device_index.py
+:author: DaveL17
+
+Device and variable index for the Thingspeak Plugin's config dialogs
+
+The DeviceIndex class keeps the name, kind and selectable state keys of every
+Indigo device and variable so that the device config dialog's menus can be
+served without walking the Indigo database each time a dialog opens. The
+index is built the first time it's needed and then kept current from
+Indigo's created / updated / deleted callbacks. The combined device and
+variable menu is cached and only rebuilt after something in it changes.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+
+# =============================================================================
+
+DEVICE   = u'device'
+VARIABLE = u'variable'
+
+NO_STATES       = [('None', 'None')]
+VARIABLE_STATES = [('value', 'value')]
+
+
+def state_menu(dev):
+    """
+    Return the state menu for a device (.ui states are skipped)
+
+    -----
+
+    :param dev: indigo.Device
+    :return list: [(key, key), ...]
+    """
+
+    return [(key, key) for key in sorted(dev.states.keys()) if ".ui" not in key]
+
+
+class DeviceIndex(object):
+    """
+    id -> (name, kind, state menu, number of states) for every Indigo device and variable
+    """
+
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.entries = None  # Not built yet.
+        self.menu    = None  # Cached menu list; None when it needs rebuilding.
+
+    # =============================================================================
+    def build(self, devices, variables):
+        """
+        (Re)build the index from scratch
+
+        -----
+
+        :param devices: iterable of indigo.Device
+        :param variables: iterable of indigo.Variable
+        """
+
+        entries = {}
+
+        for dev in devices:
+            entries[dev.id] = (dev.name, DEVICE, state_menu(dev), len(dev.states))
+
+        for var in variables:
+            entries[var.id] = (var.name, VARIABLE, VARIABLE_STATES, 0)
+
+        with self.lock:
+            self.entries = entries
+            self.menu    = None
+
+    # =============================================================================
+    def is_built(self):
+        """
+        Return True once build() has been called
+
+        -----
+
+        :return bool:
+        """
+
+        return self.entries is not None
+
+    # =============================================================================
+    def device_changed(self, dev):
+        """
+        Add or refresh a device
+
+        Devices update constantly, so this is a no-op unless the device's name
+        or its number of states has changed.
+
+        -----
+
+        :param dev: indigo.Device
+        """
+
+        if self.entries is None:
+            return
+
+        entry = self.entries.get(dev.id)
+
+        if entry is not None and entry[0] == dev.name and entry[3] == len(dev.states):
+            return
+
+        with self.lock:
+            if entry is None or entry[0] != dev.name:
+                self.menu = None
+            self.entries[dev.id] = (dev.name, DEVICE, state_menu(dev), len(dev.states))
+
+    # =============================================================================
+    def variable_changed(self, var):
+        """
+        Add or rename a variable
+
+        -----
+
+        :param var: indigo.Variable
+        """
+
+        if self.entries is None:
+            return
+
+        entry = self.entries.get(var.id)
+
+        if entry is not None and entry[0] == var.name:
+            return
+
+        with self.lock:
+            self.entries[var.id] = (var.name, VARIABLE, VARIABLE_STATES, 0)
+            self.menu = None
+
+    # =============================================================================
+    def removed(self, item_id):
+        """
+        Drop a deleted device or variable
+
+        -----
+
+        :param int item_id:
+        """
+
+        if self.entries is None:
+            return
+
+        with self.lock:
+            if self.entries.pop(item_id, None) is not None:
+                self.menu = None
+
+    # =============================================================================
+    def menu_items(self):
+        """
+        Return the device and variable menu: devices, then variables, by name
+
+        -----
+
+        :return list: [(id, "(D) Name"), ..., (id, "(V) Name"), ..., separator, ('None', 'None')]
+        """
+
+        with self.lock:
+            if self.menu is None:
+                items = sorted(self.entries.items(), key=lambda item: (item[1][1] != DEVICE, item[1][0].lower()))
+                menu  = [(item_id, u"({0}) {1}".format('D' if kind == DEVICE else 'V', name))
+                         for item_id, (name, kind, _, _) in items]
+                menu.append(('-1', '%%separator%%'))
+                menu.append(('None', 'None'))
+                self.menu = menu
+
+            return self.menu
+
+    # =============================================================================
+    def states(self, item_id):
+        """
+        Return the state menu for a device or variable
+
+        -----
+
+        :param item_id: device or variable id (int or str)
+        :return list: [(key, key), ...]
+        """
+
+        if self.entries is None:
+            return NO_STATES
+
+        try:
+            entry = self.entries.get(int(item_id))
+        except (TypeError, ValueError):
+            return NO_STATES
+
+        if entry is None:
+            return NO_STATES
+
+        return entry[2]
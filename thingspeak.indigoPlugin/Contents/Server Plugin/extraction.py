@@ -0,0 +1,133 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: extraction.py
+:author: DaveL17
+
+Per-device extraction plans for the Thingspeak Plugin
+
+An ExtractionPlan is everything the plugin needs to know about a device's
+configuration to sample and upload it: which Indigo source feeds each field,
+the aggregation and deadband settings, the
+upload settings, the expressions that derive fields from other fields and
+the payload fields that never change between samples.
+Plans are built once when a device starts (or the plugin prefs change), so the
+upload cycle doesn't re-read and re-parse plugin props and prefs for every
+field of every device.
+"""
+
+# ================================== IMPORTS ==================================
+
+# My modules
+import aggregate
+import deadband
+
+# =============================================================================
+
+DEVICE   = u'device'
+VARIABLE = u'variable'
+
+NAMES = tuple(u'thing{0}'.format(_) for _ in range(1, 9))  # The names expressions can use.
+
+
+class ExtractionPlan(object):
+    """
+    Compiled sampling and upload settings for one device
+
+    kind_of(source_id) returns DEVICE, VARIABLE or None (if the source doesn't
+    exist); compile_expr(expression, names) compiles a thing's expression
+    (see DLFramework.evalExpr.compile_expr()). Values are coerced to numbers
+    at sample time (see coercion.coerce_many()). Problems found while building
+    the plan are left in warnings for the caller to log.
+    """
+
+    def __init__(self, dev, prefs, kind_of, compile_expr=None):
+        props = dev.pluginProps
+
+        self.dev_id          = dev.id
+        self.channel_id      = props['channelList']
+        self.profile_id      = props.get('accountProfile', u"")  # Empty for the default account.
+        self.upload_interval = int(props['devUploadInterval'])
+        self.sample_interval = int(props.get('devSampleInterval', 60))
+        self.bulk_mode       = props.get('uploadMode', 'single') == 'bulk'
+        self.change_only     = bool(props.get('changeOnly', False))
+        self.heartbeat       = int(props.get('devHeartbeat', deadband.DEFAULT_HEARTBEAT))
+        self.warnings        = []
+
+        things      = []
+        aggregates  = {}
+        bands       = {}
+        expressions = []
+
+        for v in range(1, 9):
+            thing      = props.get('thing{0}'.format(v), "None")
+            expression = props.get('thing{0}Expression'.format(v), "").strip()
+            key        = 'field{0}'.format(v)
+
+            if expression and compile_expr is not None:
+                try:
+                    function, names = compile_expr(expression, NAMES)
+                    expressions.append((key, function, names, expression))
+                except (SyntaxError, TypeError):
+                    self.warnings.append(u"{0} - Thing {1} has an expression that can't be used ({2}).".format(
+                        dev.name, v, expression))
+
+            try:
+                bands[key] = (float(props.get('thing{0}Deadband'.format(v)) or 0),
+                              float(props.get('thing{0}DeadbandPct'.format(v)) or 0))
+            except ValueError:
+                bands[key] = (0.0, 0.0)
+
+            # If there is a device created, but no value assigned.
+            if not thing or thing == "None":
+                continue
+
+            try:
+                source_id = int(thing)
+            except ValueError:
+                self.warnings.append(u"{0} - Thing {1} is not a valid device or variable.".format(dev.name, v))
+                continue
+
+            kind = kind_of(source_id)
+
+            if kind is None:
+                self.warnings.append(u"{0} - Thing {1} refers to a device or variable that no longer "
+                                     u"exists.".format(dev.name, v))
+
+            mode  = props.get('thing{0}Aggregate'.format(v), aggregate.LAST)
+            state = props.get('thing{0}State'.format(v), "None")
+
+            things.append((v, key, kind, source_id, state))
+            aggregates[v] = mode
+
+        # ((field number, field key, kind, source id, state), ...)
+        self.things     = tuple(things)
+        self.sources    = tuple((v, source_id, state) for v, _, _, source_id, state in things)
+        self.keys       = dict((v, key) for v, key, _, _, _ in things)
+        self.aggregates = aggregates
+        self.bands      = bands
+
+        # ((field key, function), ...). Expressions see the fields as extracted (before any
+        # expression is applied), by thing name, so they can only use things that have a
+        # device or variable.
+        self.names       = dict((u'thing{0}'.format(v), key) for v, key in self.keys.items())
+        self.expressions = []
+
+        for key, function, names, expression in expressions:
+            missing = sorted(names.difference(self.names))
+
+            if missing:
+                self.warnings.append(u"{0} - The expression {1} uses {2}, which has no device or variable.".format(
+                    dev.name, expression, u", ".join(missing)))
+            else:
+                self.expressions.append((key, function))
+
+        self.expressions = tuple(self.expressions)
+
+        # Payload fields that are the same for every sample.
+        self.static = {'elevation': prefs['elevation'], 'latitude': prefs['latitude'], 'longitude': prefs['longitude']}
+
+        if not self.bulk_mode:
+            self.static['twitter'] = prefs['twitter']
+            self.static['tweet']   = u"{0}".format(props.get('tweet', ""))
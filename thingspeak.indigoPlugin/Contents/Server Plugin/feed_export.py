@@ -0,0 +1,451 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: feed_export.py
+:author: DaveL17
+
+Channel feed export for the Thingspeak Plugin
+
+The FeedExport class copies a channel's feed to a local file one page at a
+time. Thingspeak returns at most PAGE_SIZE entries per feeds.json request
+(the newest ones when a date window holds more), so the feed is read in
+date windows that shrink when a page comes back full and grow again when
+pages are sparse. Each page is appended to the file as soon as it arrives;
+only one page is ever held in memory.
+
+Two formats are written:
+
+    CsvFile     created_at,entry_id,field1,...,field8 (the layout of
+                Thingspeak's own CSV download)
+    ColumnFile  a compact binary file of column blocks, one block per page
+                (see read_columns())
+
+Feeds can only be read by date, so entries are written in created_at order
+(entry_id within the same second). Both formats are append-only, so an
+export picks up after the last entry in the file. A block or line left
+half-written by an interrupted export is cut off before the next one appends
+to the file.
+
+Entry ids only grow, but created_at doesn't have to: a backlog replayed
+through bulk_update.json gets new entry ids and its original timestamps. An
+entry added after an export with a timestamp before the export's last entry
+is in a window that has already been read, so continuing the export can't
+find it. The export knows how many entries it should find (the channel's
+last_entry_id less the last id in the file) and reports the ones it
+couldn't in FeedExport.missing; exporting to a new file picks them up.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import calendar
+import os
+import struct
+import time as t
+
+# =============================================================================
+
+PAGE_SIZE    = 8000            # Most entries Thingspeak returns for one feeds.json request.
+FIRST_WINDOW = 86400           # Seconds covered by the first page request.
+MAX_WINDOW   = 86400 * 366     # Longest date window requested at once.
+MIN_WINDOW   = 1               # Thingspeak timestamps have one second resolution.
+TIME_FORMAT  = '%Y-%m-%d %H:%M:%S'
+
+CSV     = 'csv'
+COLUMNS = 'columns'
+
+FIELDS = ['field{0}'.format(_) for _ in range(1, 9)]
+
+# Column file layout (little-endian). The file starts with MAGIC. Each block is
+# a row count (uint32) followed by that many entry ids (int64), created_at
+# epoch seconds (float64) and then, field by field, the field values (float64,
+# NaN where a field is empty or not a number).
+MAGIC        = b'TSCOL\x00\x01\x00'
+BLOCK_HEADER = struct.Struct('<I')
+ROW_SIZE     = 8 + 8 + 8 * len(FIELDS)
+
+
+def parse_created_at(value):
+    """
+    Convert a Thingspeak created_at timestamp to epoch seconds
+
+    Feeds are requested in UTC, so only the first 19 characters (through the
+    seconds) are read; a trailing 'Z' or '+00:00' is ignored.
+
+    -----
+
+    :param str value: e.g., '2018-04-01T12:00:00Z'
+    :return int:
+    """
+
+    return calendar.timegm(t.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+def _key(entry):
+
+    return parse_created_at(entry['created_at']), int(entry['entry_id'])
+
+
+def _number(value):
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _csv_cell(value):
+
+    if value is None:
+        return u""
+
+    value = u"{0}".format(value)
+
+    if any(c in value for c in u',"\r\n'):
+        return u'"{0}"'.format(value.replace(u'"', u'""'))
+
+    return value
+
+
+class CsvFile(object):
+    """
+    Append-only CSV export file
+    """
+
+    extension = '.csv'
+    header    = u",".join(['created_at', 'entry_id'] + FIELDS) + u"\n"
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    # =============================================================================
+    def resume(self):
+        """
+        Open the file for appending and return the last entry it holds
+
+        A trailing partial line (from an interrupted export) is removed. The
+        header is written to a new or empty file.
+
+        -----
+
+        :return tuple: (entry_id, created_at epoch) of the last row, or (0, None)
+        """
+
+        last = (0, None)
+
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                tail = b''
+
+                # Read backwards until the tail holds the last complete line.
+                while size and tail.count(b'\n') < 2 and len(tail) < size:
+                    chunk = min(4096, size - len(tail))
+                    f.seek(size - len(tail) - chunk)
+                    tail = f.read(chunk) + tail
+
+                end = tail.rfind(b'\n') + 1
+                f.truncate(size - len(tail) + end)
+
+                lines = tail[:end].splitlines()
+
+                if lines and not lines[-1].startswith(b'created_at'):
+                    created_at, entry_id = lines[-1].decode('utf-8').split(u',')[:2]
+                    last = (int(entry_id), parse_created_at(created_at))
+
+        # Where an append-mode file starts out is platform dependent; seek before asking.
+        self.file = open(self.path, 'ab')
+        self.file.seek(0, os.SEEK_END)
+
+        if self.file.tell() == 0:
+            self.file.write(self.header.encode('utf-8'))
+
+        return last
+
+    # =============================================================================
+    def append(self, entries):
+        """
+        Write a page of feed entries
+
+        -----
+
+        :param list entries: feeds.json entries, oldest first
+        """
+
+        lines = [u",".join([entry['created_at'], u"{0}".format(entry['entry_id'])] +
+                           [_csv_cell(entry.get(field)) for field in FIELDS]) for entry in entries]
+
+        self.file.write((u"\n".join(lines) + u"\n").encode('utf-8'))
+        self.file.flush()
+
+    # =============================================================================
+    def close(self):
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ColumnFile(object):
+    """
+    Append-only column block export file
+    """
+
+    extension = '.tscol'
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    # =============================================================================
+    def resume(self):
+        """
+        Open the file for appending and return the last entry it holds
+
+        The blocks are walked by their headers; a block cut short by an
+        interrupted export is removed.
+
+        -----
+
+        :return tuple: (entry_id, created_at epoch) of the last row, or (0, None)
+        :raises ValueError: if the file isn't a column export
+        """
+
+        last = (0, None)
+
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, 'rb+') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(u"{0} is not a Thingspeak column export.".format(self.path))
+
+                size = os.path.getsize(self.path)
+                good = f.tell()
+
+                while good + BLOCK_HEADER.size <= size:
+                    rows = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))[0]
+                    end  = good + BLOCK_HEADER.size + rows * ROW_SIZE
+
+                    if not rows or end > size:
+                        break
+
+                    # The last id and timestamp of the block.
+                    f.seek(good + BLOCK_HEADER.size + (rows - 1) * 8)
+                    entry_id = struct.unpack('<q', f.read(8))[0]
+                    f.seek(rows * 8 - 8, os.SEEK_CUR)
+                    created_at = struct.unpack('<d', f.read(8))[0]
+
+                    last = (entry_id, int(created_at))
+                    good = end
+                    f.seek(good)
+
+                f.truncate(good)
+
+        self.file = open(self.path, 'ab')
+        self.file.seek(0, os.SEEK_END)
+
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+        return last
+
+    # =============================================================================
+    def append(self, entries):
+        """
+        Write a page of feed entries as one column block
+
+        -----
+
+        :param list entries: feeds.json entries, oldest first
+        """
+
+        rows  = len(entries)
+        parts = [BLOCK_HEADER.pack(rows),
+                 struct.pack('<{0}q'.format(rows), *[int(entry['entry_id']) for entry in entries]),
+                 struct.pack('<{0}d'.format(rows), *[parse_created_at(entry['created_at']) for entry in entries])]
+
+        for field in FIELDS:
+            parts.append(struct.pack('<{0}d'.format(rows), *[_number(entry.get(field)) for entry in entries]))
+
+        self.file.write(b''.join(parts))
+        self.file.flush()
+
+    # =============================================================================
+    def close(self):
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+WRITERS = {CSV: CsvFile, COLUMNS: ColumnFile}
+
+
+def read_columns(path):
+    """
+    Yield the blocks of a column export file
+
+    -----
+
+    :param str path:
+    :return: generator of dicts {'entry_id': tuple, 'created_at': tuple, 'field1': tuple, ...}
+    """
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(u"{0} is not a Thingspeak column export.".format(path))
+
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+
+            if len(header) < BLOCK_HEADER.size:
+                return
+
+            rows = BLOCK_HEADER.unpack(header)[0]
+            data = f.read(rows * ROW_SIZE)
+
+            if not rows or len(data) < rows * ROW_SIZE:
+                return
+
+            block = {'entry_id':   struct.unpack_from('<{0}q'.format(rows), data, 0),
+                     'created_at': struct.unpack_from('<{0}d'.format(rows), data, rows * 8)}
+
+            for n, field in enumerate(FIELDS):
+                block[field] = struct.unpack_from('<{0}d'.format(rows), data, rows * (16 + 8 * n))
+
+            yield block
+
+
+class FeedExport(object):
+    """
+    Copy one channel's feed to a local file, page by page
+    """
+
+    def __init__(self, fetch, writer, logger, should_stop=None):
+        """
+        -----
+
+        :param fetch: callable(parms) -> (response code, feeds.json response dict) for the channel
+        :param writer: CsvFile or ColumnFile
+        :param logger:
+        :param should_stop: callable returning True when the export should stop early
+        """
+
+        self.fetch       = fetch
+        self.writer      = writer
+        self.logger      = logger
+        self.should_stop = should_stop or (lambda: False)
+        self.exported    = 0
+        self.missing     = 0  # New entries that were outside the windows read (see the module notes).
+        self.requests    = 0
+
+    # =============================================================================
+    def page(self, start, end):
+        """
+        Return the feed entries between start and end (inclusive)
+
+        -----
+
+        :param int start: epoch seconds
+        :param int end: epoch seconds
+        :return list: entries, or None if the request failed
+        """
+
+        self.requests += 1
+        response, response_dict = self.fetch({'start':   t.strftime(TIME_FORMAT, t.gmtime(start)),
+                                              'end':     t.strftime(TIME_FORMAT, t.gmtime(end)),
+                                              'results': PAGE_SIZE,
+                                              })
+
+        if response != 200:
+            return None
+
+        return response_dict.get('feeds') or []
+
+    # =============================================================================
+    def run(self, now=None):
+        """
+        Export every entry after the last one already in the file
+
+        -----
+
+        :param float now: epoch seconds to export up to (defaults to the current time)
+        :return bool: True if the export reached the end of the feed
+        """
+
+        now = int(now or t.time())
+
+        try:
+            last_id, cursor = self.writer.resume()
+
+            # Ask for the channel alone to learn where the feed starts and ends.
+            self.requests += 1
+            response, response_dict = self.fetch({'results': 0})
+
+            if response != 200:
+                return False
+
+            channel    = response_dict.get('channel', {})
+            last_entry = channel.get('last_entry_id') or 0
+            window     = FIRST_WINDOW
+            last       = (cursor, last_id) if last_id else (0, 0)  # (created_at, entry_id) of the last row.
+
+            # Entry ids are consecutive, so this is how many entries the export has to find.
+            self.missing = max(0, last_entry - last_id)
+
+            if cursor is None:
+                cursor = parse_created_at(channel['created_at']) if channel.get('created_at') else 0
+
+            if last_id:
+                self.logger.info(u"Resuming after entry {0} of {1}.".format(last_id, last_entry))
+
+            while self.missing and cursor <= now:
+
+                if self.should_stop():
+                    return False
+
+                end     = min(cursor + window, now)
+                entries = self.page(cursor, end)
+
+                if entries is None:
+                    return False
+
+                # A full page may be missing older entries in the window; ask again for less.
+                if len(entries) >= PAGE_SIZE:
+                    if window > MIN_WINDOW:
+                        window = max(MIN_WINDOW, window // 2)
+                        continue
+
+                    self.logger.warning(u"More than {0} entries share the timestamp {1}; only the newest {0} can be "
+                                        u"read.".format(PAGE_SIZE, entries[-1]['created_at']))
+
+                # Windows share their boundary second, so skip what's already written.
+                entries = sorted([entry for entry in entries if _key(entry) > last], key=_key)
+
+                if entries:
+                    self.writer.append(entries)
+                    self.exported += len(entries)
+                    self.missing  -= len([1 for entry in entries if int(entry['entry_id']) > last_id])
+                    last           = _key(entries[-1])
+                    self.logger.debug(u"Exported {0} entries through {1}.".format(len(entries),
+                                                                                  entries[-1]['created_at']))
+
+                if end >= now:
+                    break
+
+                cursor = end
+
+                if len(entries) < PAGE_SIZE // 4:
+                    window = min(MAX_WINDOW, window * 2)
+
+            if self.missing > 0:
+                self.logger.warning(u"{0} entries have timestamps outside the exported range (e.g., a backlog "
+                                    u"replayed after the last export) and weren't exported. Export to a new file "
+                                    u"to include them.".format(self.missing))
+
+            return True
+
+        finally:
+            self.writer.close()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: metrics.py
+:author: DaveL17
+
+Timers and counters for the Thingspeak Plugin
+
+The Registry class collects how long each stage of the upload cycle takes
+(fetching the channel list, extracting and coercing thing values, the HTTP
+round trip, Indigo state writes and the scheduler pass as a whole) and counts
+uploads, retries, errors and responses by status code. Timings go into a
+fixed-bucket histogram per stage, so recording one is a few additions no
+matter how long the plugin runs.
+
+While the registry is disabled, timer() hands back a shared no-op context
+manager and count() returns straight away, so the instrumented code costs
+next to nothing.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+import time as t
+from timeit import default_timer as timer
+
+# =============================================================================
+
+# Stages
+CHANNEL_LIST = u'channel_list'
+COERCE       = u'coerce'
+CYCLE        = u'cycle'
+EXTRACT      = u'extract'
+HTTP         = u'http'
+STATE_WRITE  = u'state_write'
+
+# Counters
+DEFERRED = u'deferred'  # Uploads held back by the rate limiter or an open circuit.
+ERRORS   = u'errors'    # Requests that failed without a response (connection errors, timeouts).
+RETRIES  = u'retries'   # Uploads that failed and were left queued to try again.
+UPLOADS  = u'uploads'   # Samples accepted by Thingspeak.
+
+STATUS = u'status_{0}'  # Responses by HTTP status code, e.g. status_200.
+
+BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)  # Histogram bucket upper bounds (ms).
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name     = name
+        self.started  = 0
+
+    def __enter__(self):
+        self.started = timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, timer() - self.started)
+        return False
+
+
+class Histogram(object):
+    """
+    Count, total, maximum and bucketed distribution of a stage's timings
+    """
+
+    def __init__(self):
+        self.count   = 0
+        self.total   = 0.0
+        self.max     = 0.0
+        self.buckets = [0] * (len(BOUNDS) + 1)
+
+    # =============================================================================
+    def add(self, ms):
+        """
+        Record one timing
+
+        -----
+
+        :param float ms: milliseconds
+        """
+
+        self.count += 1
+        self.total += ms
+        self.max    = max(self.max, ms)
+
+        for n, bound in enumerate(BOUNDS):
+            if ms <= bound:
+                self.buckets[n] += 1
+                return
+
+        self.buckets[-1] += 1
+
+    # =============================================================================
+    def quantile(self, q):
+        """
+        Return the upper bound of the bucket holding the q quantile
+
+        -----
+
+        :param float q: 0 to 1
+        :return float: milliseconds (the maximum for the overflow bucket)
+        """
+
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+
+        for n, count in enumerate(self.buckets):
+            seen += count
+
+            if seen >= rank and count:
+                return float(min(BOUNDS[n], self.max)) if n < len(BOUNDS) else self.max
+
+        return self.max
+
+    # =============================================================================
+    def summary(self):
+        """
+        Return the histogram as a dict
+
+        -----
+
+        :return dict:
+        """
+
+        return {'count': self.count,
+                'mean':  self.total / self.count if self.count else 0.0,
+                'p50':   self.quantile(0.50),
+                'p95':   self.quantile(0.95),
+                'p99':   self.quantile(0.99),
+                'max':   self.max,
+                }
+
+
+class Registry(object):
+    """
+    Named stage timers and counters
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled  = enabled
+        self.lock     = threading.Lock()
+        self.stages   = {}  # Stage name -> Histogram
+        self.counters = {}
+        self.started  = t.time()
+
+    # =============================================================================
+    def timer(self, name):
+        """
+        Return a context manager that times its block as stage `name`
+
+        -----
+
+        :param str name:
+        :return:
+        """
+
+        if not self.enabled:
+            return NULL_TIMER
+
+        return _Timer(self, name)
+
+    # =============================================================================
+    def observe(self, name, seconds):
+        """
+        Record a timing for stage `name`
+
+        -----
+
+        :param str name:
+        :param float seconds:
+        """
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            histogram = self.stages.get(name)
+
+            if histogram is None:
+                histogram = self.stages[name] = Histogram()
+
+            histogram.add(seconds * 1000.0)
+
+    # =============================================================================
+    def count(self, name, n=1):
+        """
+        Add n to counter `name`
+
+        -----
+
+        :param str name:
+        :param int n:
+        """
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # =============================================================================
+    def snapshot(self):
+        """
+        Return every stage summary and counter
+
+        -----
+
+        :return dict: {'since': epoch, 'stages': {name: summary}, 'counters': {name: n}}
+        """
+
+        with self.lock:
+            return {'since':    self.started,
+                    'stages':   dict((name, histogram.summary()) for name, histogram in self.stages.items()),
+                    'counters': dict(self.counters),
+                    }
+
+    # =============================================================================
+    def report(self):
+        """
+        Return a printable summary with a histogram for each stage
+
+        -----
+
+        :return list: lines of text
+        """
+
+        with self.lock:
+            stages   = sorted((name, histogram.summary(), list(histogram.buckets))
+                              for name, histogram in self.stages.items())
+            counters = sorted(self.counters.items())
+            started  = self.started
+
+        lines = [u"Metrics since {0} ({1}).".format(t.strftime('%Y-%m-%d %H:%M:%S', t.localtime(started)),
+                                                    u"collecting" if self.enabled else u"not collecting"),
+                 u"{0:<14}{1:>8}{2:>10}{3:>10}{4:>10}{5:>10}{6:>10}".format(u"Stage (ms)", u"Count", u"Mean",
+                                                                           u"p50", u"p95", u"p99", u"Max")]
+
+        for name, summary, buckets in stages:
+            lines.append(u"{0:<14}{1:>8}{2:>10.1f}{3:>10.1f}{4:>10.1f}{5:>10.1f}{6:>10.1f}".format(
+                name, summary['count'], summary['mean'], summary['p50'], summary['p95'], summary['p99'],
+                summary['max']))
+
+            # One bar per non-empty bucket, scaled to the stage's busiest bucket.
+            widest = float(max(buckets) or 1)
+
+            for n, count in enumerate(buckets):
+                if count:
+                    label = u"<= {0}".format(BOUNDS[n]) if n < len(BOUNDS) else u"> {0}".format(BOUNDS[-1])
+                    lines.append(u"    {0:>9} {1:<30} {2}".format(label, u"#" * max(1, int(30 * count / widest)),
+                                                                  count))
+
+        if counters:
+            lines.append(u"Counters: " + u", ".join(u"{0} {1}".format(name, n) for name, n in counters))
+
+        return lines
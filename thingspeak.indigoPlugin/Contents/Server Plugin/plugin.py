@@ -25,19 +25,14 @@ Credits
 Thingspeak API - https://www.mathworks.com/help/thingspeak/
 """
 
-# =================================== TO DO ===================================
-
-# TODO: Combine dynamic list method calls using filter (like Matplotlib).
-
 # ================================== IMPORTS ==================================
 
 # Built-in modules
-from dateutil.parser import parse as du_parse
 import datetime as dt
 import logging
 import os
-import pytz
 import requests
+import threading
 import time as t
 import traceback
 
@@ -53,6 +48,24 @@ except ImportError:
 
 # My modules
 import DLFramework.DLFramework as Dave
+import accounts
+import bulk
+import circuit_breaker
+import clock
+import coercion
+import deadband
+import device_index
+import extraction
+import feed_export
+import metrics
+import rate_limit
+import ring_store
+import scheduler
+import single_flight
+import transport
+import upload_queue
+import value_table
+import workers
 
 # =================================== HEADER ==================================
 
@@ -61,23 +74,35 @@ __copyright__ = Dave.__copyright__
 __license__   = Dave.__license__
 __build__     = Dave.__build__
 __title__     = 'Thingspeak Plugin for Indigo Home Control'
-__version__   = '1.2.13'
+__version__   = '1.3.00'
 
 # =============================================================================
 
 install_path = indigo.server.getInstallFolderPath()
 
+HEALTH_DEVICE   = u'pluginHealth'  # Device type id of the Plugin Health device.
+HEALTH_INTERVAL = 60               # Seconds between Plugin Health device updates.
+
 kDefaultPluginPrefs = {
+    u'accountProfiles':           "",     # Other Thingspeak accounts, as JSON (see accounts.py).
     u'apiKey':                    "",     # Thingspeak API key.
+    u'channelCacheTtl':           900,    # Seconds to reuse the channel list (write keys) before refetching.
+    u'channelListFresh':          60,     # Seconds dialogs use the channel list before refreshing it in the background.
+    u'collectMetrics':            False,  # Collect stage timings and counters (always on with a Plugin Health device).
     u'configMenuTimeoutInterval': 15,     # How long to wait on a server timeout.
     u'deviceIP':                  "XXX.XXX.XXX.XXX:3000",  # Local Thingspeak server IP.
     u'devicePort':                False,  # Use local Thingspeak server.
     u'elevation':                 0,      # Elevation of data source.
+    u'keepHistory':               True,   # Keep a local copy of uploaded values (see ring_store.py).
     u'latitude':                  0,      # Latitude of data source.
+    u'licenseTier':               "free",  # Thingspeak license (update interval and message budget).
+    u'licenseUnits':              1,      # Number of paid license units.
     u'longitude':                 0,      # Longitude of data source.
     u'showDebugInfo':             False,  # Verbose debug logging?
     u'showDebugLevel':            1,      # Low, Medium or High debug output.
     u'twitter':                   "",     # Username linked to ThingTweet
+    u'uploadMaxInFlight':         16,     # Most uploads queued or running at once.
+    u'uploadWorkers':             4,      # Number of concurrent upload threads.
     }
 
 
@@ -85,6 +110,7 @@ class Plugin(indigo.PluginBase):
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
 
+        self.startTime            = t.time()  # Used to report how long startup took.
         self.pluginIsInitializing = True
         self.pluginIsShuttingDown = False
 
@@ -101,13 +127,39 @@ class Plugin(indigo.PluginBase):
         self.plugin_file_handler.setFormatter(logging.Formatter(log_format, datefmt='%Y-%m-%d %H:%M:%S'))
         self.indigo_log_handler.setLevel(self.debugLevel)
 
-        self.uploadNow      = False  # Call to upload from menu, action in process
-        self.updating       = False  # Plugin in process of updating channels
+        self.uploadNow      = False  # Upload requested from the menu or an action; see encodeValueDicts()
+        self.lastSample     = {}     # Time of the last sample, by device id
+        self.lastUpload     = {}     # Time of the last successful upload, by device id
+        self.localTime      = clock.LocalTime()  # Formats created_at (display only)
+        self.lastQueued     = {}     # (time, fields) of the last sample queued for upload, by device id
+        self.plans          = {}     # Compiled extraction plan, by device id
+        self.scheduler      = scheduler.Scheduler()  # When each device next needs attention
+        self.retryAfter     = {}     # Earliest retry time after a failed upload, by channel id
+        self.healthDevices  = set()  # Ids of the running Plugin Health devices
+        self.exports        = {}     # Running feed exports, by channel id
+        self.metrics        = metrics.Registry(enabled=bool(self.pluginPrefs.get('collectMetrics', False)))
+        self.uploadQueue    = upload_queue.UploadQueue(
+            os.path.join(install_path, 'Preferences', 'Plugins', pluginId, 'upload_queue.sqlite'))
+        self.history        = ring_store.HistoryStore(
+            os.path.join(install_path, 'Preferences', 'Plugins', pluginId, 'History'))
 
         # =========================== Initialize DLFramework ===========================
 
         self.Fogbert = Dave.Fogbert(self)
-        self.devicesAndVariablesList = self.Fogbert.deviceAndVariableList()
+        self.evalExpr = Dave.evalExpr(self)
+        self.transport = transport.Transport(self, pool_maxsize=max(transport.POOL_MAXSIZE, self.uploadWorkerCount()),
+                                             on_breaker_change=self.circuitStateChanged)
+        self.stateWriter = workers.StateWriter(self)
+        self.uploadPool = workers.ChannelWorkerPool(self, self.uploadWorkerCount(),
+                                                    int(self.pluginPrefs.get('uploadMaxInFlight', 16)))
+        self.valueTable = value_table.ValueTable(self.thingLookup, coerce=coercion.coerce)
+        self.accounts = accounts.Accounts(self, self.pluginPrefs)  # Channel cache and rate limiter, by profile
+        self.channelLists = single_flight.StaleCache(self, fresh=int(self.pluginPrefs.get('channelListFresh', 60)),
+                                                     accept=lambda result: result[0] == 200)
+        # Walking every Indigo device and variable is slow on a large database, so
+        # the index is built the first time a config dialog asks for it and kept
+        # current from then on.
+        self.deviceIndex = device_index.DeviceIndex()
 
         # Log pluginEnvironment information when plugin is first started
         self.Fogbert.pluginEnvironment()
@@ -124,7 +176,6 @@ class Plugin(indigo.PluginBase):
         self.logger.warning(u"Due to changes in Thingspeak's pricing model, the Thingspeak Plugin has been deprecated.")
         self.logger.warning(u"You are strongly encouraged to find an alternative solution.")
         self.indigo_log_handler.setLevel(self.debugLevel)
-        t.sleep(3)
 
         self.pluginIsInitializing = False
 
@@ -142,10 +193,30 @@ class Plugin(indigo.PluginBase):
             self.logger.debug(unicode(values_dict))
             self.logger.warning(u"Warning! Debug output contains sensitive information.")
 
+            old_pool = (self.uploadWorkerCount(), int(self.pluginPrefs.get('uploadMaxInFlight', 16)))
+
             # Ensure that self.pluginPrefs includes any recent changes.
             for k in values_dict:
                 self.pluginPrefs[k] = values_dict[k]
 
+            # A new key or server empties the default account's channel cache, its
+            # license is reapplied and a server no account uses has its pool closed.
+            self.accountsReload()
+
+            # Resize the upload pool if needed. Jobs already queued on the old pool finish there,
+            # and their channels stay busy on the new one until they do.
+            if old_pool != (self.uploadWorkerCount(), int(self.pluginPrefs.get('uploadMaxInFlight', 16))):
+                old_workers     = self.uploadPool
+                self.uploadPool = old_workers.resized(self.uploadWorkerCount(),
+                                                      int(self.pluginPrefs.get('uploadMaxInFlight', 16)))
+                old_workers.stop(timeout=0)
+
+            self.channelLists.fresh = int(self.pluginPrefs.get('channelListFresh', 60))
+            self.metricsEnabled()
+
+            # Plans carry the location and Twitter settings.
+            self.plans.clear()
+
             self.logger.debug(u"User prefs saved.")
 
         else:
@@ -155,31 +226,137 @@ class Plugin(indigo.PluginBase):
         self.debugLevel = int(self.pluginPrefs.get('showDebugLevel', '30'))
         self.indigo_log_handler.setLevel(self.debugLevel)
 
+    # =============================================================================
+    def deviceCreated(self, dev):
+
+        indigo.PluginBase.deviceCreated(self, dev)
+        self.deviceIndex.device_changed(dev)
+
+    # =============================================================================
+    def deviceDeleted(self, dev):
+
+        # Samples from a deleted device have nowhere to go. Other plugins' devices
+        # are reported too (we subscribe to changes) and may be feeding a thing.
+        if dev.pluginId == self.pluginId:
+            self.uploadQueue.purge_device(dev.id)
+            self.lastUpload.pop(dev.id, None)
+        else:
+            self.valueTable.source_deleted(dev.id)
+
+        self.deviceIndex.removed(dev.id)
+        indigo.PluginBase.deviceDeleted(self, dev)
+
     # =============================================================================
     def deviceStartComm(self, dev):
 
         self.logger.debug(u"Starting device: {0}".format(dev.name))
         dev.stateListOrDisplayStateIdChanged()
-        dev.updateStateOnServer('thingState', value=False, uiValue=u"waiting")
+
+        # A Plugin Health device just needs metrics collected and a place on the schedule.
+        if dev.deviceTypeId == HEALTH_DEVICE:
+            self.healthDevices.add(dev.id)
+            self.metricsEnabled()
+            self.scheduler.schedule(dev.id, t.time())
+            return
+
+        # Indigo restarts communication when the device's props change, so this is
+        # also where edited devices are rescheduled.
+        plan = self.devPlan(dev, rebuild=True)
+        host = self.accounts.get(plan.profile_id).host
+
+        dev.updateStatesOnServer([{'key': 'thingState', 'value': False, 'uiValue': u"waiting"},
+                                  {'key': 'circuitState', 'value': self.transport.breaker(host).state},
+                                  ])
+
+        # Scheduling runs on epoch seconds; created_at is only read once, to pick up
+        # where the device left off before the plugin (re)started.
+        if dev.id not in self.lastUpload:
+            self.lastUpload[dev.id] = self.devLastUpload(dev)
+
+        self.valueTable.register(dev.id, plan.sources, plan.aggregates)
+        self.scheduler.schedule(dev.id, t.time())
         dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
 
     # =============================================================================
     def deviceStopComm(self, dev):
 
         self.logger.debug(u"Stopping device: {0}".format(dev.name))
+        self.scheduler.remove(dev.id)
+
+        if dev.deviceTypeId == HEALTH_DEVICE:
+            self.healthDevices.discard(dev.id)
+            self.metricsEnabled()
+            dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+            return
+
+        self.valueTable.unregister(dev.id)
+        self.plans.pop(dev.id, None)
+        self.lastSample.pop(dev.id, None)
+        self.lastQueued.pop(dev.id, None)
         dev.updateStateOnServer('thingState', value=False, uiValue=u"disabled")
         dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
 
+    # =============================================================================
+    def deviceUpdated(self, orig_dev, new_dev):
+
+        indigo.PluginBase.deviceUpdated(self, orig_dev, new_dev)
+
+        # Keep the value table current for any device state assigned to a thing.
+        self.valueTable.device_updated(new_dev)
+        self.deviceIndex.device_changed(new_dev)
+
     # =============================================================================
     def getDeviceConfigUiValues(self, values_dict, type_id, dev_id):
 
-        # Get latest list of Indigo devices and variables. We don't return
-        # it from here, but we want it updated any time a device config is
-        # opened.
-        self.devicesAndVariablesList = self.Fogbert.deviceAndVariableList()
+        # Make sure the device and variable index is ready before the dialog's menus
+        # ask for it. After the first time, this is free.
+        self.indexedDevices()
 
         return values_dict
 
+    # =============================================================================
+    def validateDeviceConfigUi(self, values_dict, type_id, dev_id):
+
+        error_msg_dict = indigo.Dict()
+
+        # ================================= Deadbands =================================
+        # Must be blank or a non-negative number.
+        for v in range(1, 9):
+            for key in ('thing{0}Deadband'.format(v), 'thing{0}DeadbandPct'.format(v)):
+                try:
+                    if float(values_dict.get(key) or 0) < 0:
+                        raise ValueError
+                except ValueError:
+                    error_msg_dict[key] = u"Please enter a positive number (or leave blank)."
+
+        # ================================ Expressions ================================
+        # Must be blank or use numbers, operators and things that have a device or
+        # variable.
+        for v in range(1, 9):
+            key        = 'thing{0}Expression'.format(v)
+            expression = values_dict.get(key, "").strip()
+
+            if not expression:
+                continue
+
+            try:
+                function, names = self.evalExpr.compile_expr(expression, extraction.NAMES)
+            except (SyntaxError, TypeError):
+                error_msg_dict[key] = u"Please use numbers, thing1 to thing8, + - * / ** and abs(), min(), max() " \
+                                      u"or round() (or leave blank)."
+                continue
+
+            for name in sorted(names):
+                if values_dict.get(name, "None") in ("", "None"):
+                    error_msg_dict[key] = u"{0} is used here but has no device or variable.".format(name)
+
+        if len(error_msg_dict) > 0:
+            error_msg_dict['showAlertText'] = u"Configuration Errors\n\nThere are one or more settings that need to " \
+                                              u"be corrected. Fields requiring attention will be highlighted."
+            return False, values_dict, error_msg_dict
+
+        return True, values_dict
+
     # =============================================================================
     def runConcurrentThread(self):
 
@@ -187,17 +364,25 @@ class Plugin(indigo.PluginBase):
 
         try:
             while True:
-                if not self.updating and not self.uploadNow:
-                    self.updating = True
-                    self.encodeValueDicts()
+                self.encodeValueDicts()
+
+                # Sleep until the next device is due. Device changes, manual uploads and
+                # requests to stop the plugin wake us early.
+                self.scheduler.wait()
 
-                # We check every 2 seconds to see if any devices need updating.
-                self.sleep(2)
+                if self.stopThread:
+                    raise self.StopThread
 
         except self.StopThread:
             self.logger.debug(u"Thingspeak stop thread called.")
             pass
 
+    # =============================================================================
+    def stopConcurrentThread(self):
+
+        indigo.PluginBase.stopConcurrentThread(self)
+        self.scheduler.wake()
+
     # =============================================================================
     def sendDevicePing(self, dev_id=0, suppress_logging=False):
 
@@ -210,7 +395,18 @@ class Plugin(indigo.PluginBase):
         # =========================== Audit Indigo Version ============================
         self.Fogbert.audit_server_version(min_ver=7)
 
+        # Thing values are taken from change notifications rather than looked up
+        # at upload time.
+        indigo.devices.subscribeToChanges()
+        indigo.variables.subscribeToChanges()
+
+        # Fetch the channel lists in the background so the first dialog opens from cache.
+        for account in self.accounts.values():
+            if account.api_key:
+                self.channelLists.revalidate(*self.channelListRequest(account))
+
         self.logger.warning(u"Warning! Debug output may contain sensitive information.")
+        self.logger.debug(u"Plugin started in {0:.2f} seconds.".format(t.time() - self.startTime))
 
     # =============================================================================
     def shutdown(self):
@@ -220,33 +416,20 @@ class Plugin(indigo.PluginBase):
         for dev in indigo.devices.iter('self'):
             dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
 
+        # Let in-flight uploads finish (and their states land) before closing up.
+        self.uploadPool.stop()
+        self.stateWriter.stop()
+        self.transport.close()
+        self.uploadQueue.close()
+        self.history.close()
+
     # =============================================================================
     def validatePrefsConfigUi(self, values_dict):
 
         error_msg_dict = indigo.Dict()
 
-        # ================================= API Key ===================================
-        # Key must be 16 characters in length
-        if len(values_dict['apiKey']) not in (0, 16):
-            error_msg_dict['apiKey'] = u"The API Key must be 16 characters long."
-
-        # Test key against ThingSpeak service
-        if not values_dict['devicePort']:
-            try:
-                ts_ip = "https://api.thingspeak.com/channels.json?api_key={0}".format(values_dict['apiKey'])
-                response = requests.get(ts_ip, timeout=1.50)
-
-                if response.status_code == 401:
-                    raise ValueError
-
-            except requests.exceptions.Timeout:
-                self.Fogbert.pluginErrorHandler(traceback.format_exc())
-                self.logger.warning(u"Unable to confirm accuracy of API Key with the ThingSpeak service.")
-
-            except ValueError:
-                self.Fogbert.pluginErrorHandler(traceback.format_exc())
-                error_msg_dict['apiKey'] = u"ThingSpeak rejected your API Key as invalid. Please ensure that your " \
-                                           u"key is entered correctly."
+        # ========================== API Key / License Units ==========================
+        self.validateAccountSettings(values_dict, error_msg_dict)
 
         # ============================ Latitude / Longitude ===========================
         # Must be integers or floats. Can be negative.
@@ -281,15 +464,218 @@ class Plugin(indigo.PluginBase):
 
         return True, values_dict
 
+    # =============================================================================
+    def variableCreated(self, var):
+
+        indigo.PluginBase.variableCreated(self, var)
+        self.deviceIndex.variable_changed(var)
+
+    # =============================================================================
+    def variableDeleted(self, var):
+
+        indigo.PluginBase.variableDeleted(self, var)
+        self.valueTable.source_deleted(var.id)
+        self.deviceIndex.removed(var.id)
+
+    # =============================================================================
+    def variableUpdated(self, orig_var, new_var):
+
+        indigo.PluginBase.variableUpdated(self, orig_var, new_var)
+
+        # Keep the value table current for any variable assigned to a thing.
+        self.valueTable.variable_updated(new_var)
+        self.deviceIndex.variable_changed(new_var)
+
     # =============================================================================
     # ============================== Plugin Methods ===============================
+    # =============================================================================
+    def accountProfileChanged(self, values_dict, type_id="", dev_id=0):
+        """
+        Clear the channel selection when a dialog's account profile changes
+
+        The channel menu is rebuilt from the newly selected account's channel
+        list.
+
+        -----
+
+        :param values_dict:
+        :param type_id:
+        :param dev_id:
+        :return values_dict:
+        """
+
+        values_dict['channelList'] = ""
+        return values_dict
+
+    # =============================================================================
+    def accountProfileDelete(self, values_dict, type_id=""):
+        """
+        Delete the account profile selected in the Account Profiles dialog
+
+        A profile that plugin devices still use can't be deleted.
+
+        -----
+
+        :param values_dict:
+        :param type_id:
+        :return values_dict:
+        """
+
+        profile_id = values_dict.get('profileId', "")
+        profiles   = accounts.load_profiles(self.pluginPrefs)
+
+        if profile_id not in profiles:
+            return values_dict
+
+        in_use = [dev.name for dev in indigo.devices.itervalues("self")
+                  if dev.pluginProps.get('accountProfile', "") == profile_id]
+
+        if in_use:
+            error_msg_dict = indigo.Dict()
+            error_msg_dict['profileId'] = u"This profile is in use."
+            error_msg_dict['showAlertText'] = u"Profile In Use\n\nPlease move these devices to another profile " \
+                                              u"first: {0}".format(u", ".join(sorted(in_use)))
+            return values_dict, error_msg_dict
+
+        name = profiles.pop(profile_id).get('name', profile_id)
+        self.accountProfilesSave(profiles)
+        indigo.server.log(u"Account profile {0} deleted.".format(name))
+
+        values_dict['profileId'] = u"new"
+        return self.accountProfileSelected(values_dict, type_id)
+
+    # =============================================================================
+    def accountProfileGenerator(self, filter="", values_dict=None, type_id="", target_id=0):
+        """
+        Generate a list of account profiles
+
+        With filter="new" the list offers a new profile and the profiles that
+        can be edited from the Account Profiles dialog (the default profile
+        is edited in the plugin configuration); otherwise it lists every
+        profile.
+
+        -----
+
+        :param filter:
+        :param values_dict:
+        :param type_id:
+        :param target_id:
+        :return: [(profile_id, profile_name), (profile_id, profile_name)]
+        """
+
+        if filter == "new":
+            return [(u"new", u"New Profile")] + [(profile_id, profile.get('name', profile_id)) for profile_id, profile
+                                                 in accounts.load_profiles(self.pluginPrefs).items()]
+
+        return [(account.profile_id, account.name) for account in self.accounts.values()]
+
+    # =============================================================================
+    def accountProfileSave(self, values_dict, type_id=""):
+        """
+        Save the profile shown in the Account Profiles dialog
+
+        The accountProfileSave() method is called when a user clicks Save in
+        the 'Account Profiles...' dialog. It adds a new profile or updates the
+        selected one; devices pinned to the profile pick up the change with
+        their next upload.
+
+        -----
+
+        :param values_dict:
+        :param type_id:
+        """
+
+        error_msg_dict = indigo.Dict()
+        name           = values_dict.get('profileName', "").strip()
+
+        if not name:
+            error_msg_dict['profileName'] = u"Please enter a name for the profile."
+
+        if not values_dict.get('apiKey', ""):
+            error_msg_dict['apiKey'] = u"Please enter the account's API Key."
+        else:
+            self.validateAccountSettings(values_dict, error_msg_dict)
+
+        if len(error_msg_dict) > 0:
+            error_msg_dict['showAlertText'] = u"Configuration Errors\n\nThere are one or more settings that need to " \
+                                              u"be corrected. Fields requiring attention will be highlighted."
+            return False, values_dict, error_msg_dict
+
+        profiles   = accounts.load_profiles(self.pluginPrefs)
+        profile_id = values_dict.get('profileId', "")
+
+        if profile_id not in profiles:
+            profile_id = accounts.new_profile_id(profiles)
+
+        profiles[profile_id] = dict([(u'name', name)] + [(key, values_dict.get(key)) for key in accounts.SETTINGS])
+        self.accountProfilesSave(profiles)
+
+        indigo.server.log(u"Account profile {0} saved.".format(name))
+        return True
+
+    # =============================================================================
+    def accountProfileSelected(self, values_dict, type_id=""):
+        """
+        Fill the Account Profiles dialog with the selected profile's settings
+
+        -----
+
+        :param values_dict:
+        :param type_id:
+        :return values_dict:
+        """
+
+        profile = accounts.load_profiles(self.pluginPrefs).get(values_dict.get('profileId', ""), {})
+
+        values_dict['profileName']  = profile.get('name', u"")
+        values_dict['apiKey']       = profile.get('apiKey', u"")
+        values_dict['devicePort']   = profile.get('devicePort', False)
+        values_dict['deviceIP']     = profile.get('deviceIP', kDefaultPluginPrefs['deviceIP'])
+        values_dict['licenseTier']  = profile.get('licenseTier', rate_limit.DEFAULT_TIER)
+        values_dict['licenseUnits'] = profile.get('licenseUnits', 1)
+
+        return values_dict
+
+    # =============================================================================
+    def accountProfilesSave(self, profiles):
+        """
+        Store the account profiles and bring the accounts up to date
+
+        -----
+
+        :param dict profiles: profile id -> settings
+        """
+
+        self.pluginPrefs[accounts.PREF] = accounts.dump_profiles(profiles)
+        self.savePluginPrefs()
+        self.accountsReload()
+
+    # =============================================================================
+    def accountsReload(self):
+        """
+        Rebuild the accounts from the plugin prefs
+
+        Connection pools for hosts that no account uses any more are closed.
+
+        -----
+
+        """
+
+        old_hosts = self.accounts.hosts()
+
+        self.accounts.load(self.pluginPrefs)
+
+        for host in old_hosts - self.accounts.hosts():
+            self.transport.drop(host)
+
     # =============================================================================
     def channelListGenerator(self, filter="", values_dict=None, type_id="", target_id=0):
         """
         Generate a list of channel names and IDs
 
         The channelListGenerator() method generates a list of channel names
-        and IDs which are used to identify the target channel.
+        and IDs which are used to identify the target channel. The channels
+        are those of the account profile selected in the dialog.
 
         -----
 
@@ -300,10 +686,9 @@ class Plugin(indigo.PluginBase):
         :return: [(channel_id, channel_name), (channel_id, channel_name)]
         """
 
-        url   = "/channels.json"
-        parms = {'api_key': self.pluginPrefs.get('apiKey', '')}
+        account = self.accounts.get((values_dict or {}).get('accountProfile'))
 
-        response, response_dict = self.sendToThingspeak('get', url, parms)
+        response, response_dict = self.getChannelList(account=account)
 
         return [(item['id'], item['name']) for item in response_dict]
 
@@ -322,10 +707,11 @@ class Plugin(indigo.PluginBase):
         :param type_id:
         """
 
-        url = "/channels/{0}/feeds.xml".format(values_dict['channelList'])
-        parms = {'api_key': self.pluginPrefs.get('apiKey', '')}
+        account = self.accounts.get(values_dict.get('accountProfile'))
+        url     = "/channels/{0}/feeds.xml".format(values_dict['channelList'])
+        parms   = {'api_key': account.api_key}
 
-        response, response_dict = self.sendToThingspeak('delete', url, parms)
+        response, response_dict = self.sendToThingspeak('delete', url, parms, account=account)
 
         if response == 200:
             indigo.server.log(u"Channel successfully cleared.".format(response))
@@ -350,12 +736,16 @@ class Plugin(indigo.PluginBase):
         :return bool:
         """
 
-        url = "/channels/{0}.xml".format(values_dict['channelList'])
-        parms = {'api_key': self.pluginPrefs.get('apiKey', '')}
+        account = self.accounts.get(values_dict.get('accountProfile'))
+        url     = "/channels/{0}.xml".format(values_dict['channelList'])
+        parms   = {'api_key': account.api_key}
 
-        response, response_dict = self.sendToThingspeak('delete', url, parms)
+        response, response_dict = self.sendToThingspeak('delete', url, parms, account=account)
 
         if response == 200:
+            account.channel_cache.invalidate()
+            self.channelLists.invalidate()
+            self.history.remove(values_dict['channelList'])
             indigo.server.log(u"Channel successfully deleted.".format(response))
         else:
             self.logger.warning(u"Problem deleting channel data.")
@@ -363,93 +753,286 @@ class Plugin(indigo.PluginBase):
         return True
 
     # =============================================================================
-    def getParms(self, values_dict):
+    def channelExport(self, values_dict, type_id):
         """
-        Construct the API URL for upload to Thingspeak
+        Export a channel's feed to a local file
 
-        Construct the values needed for the data upload to the Thingspeak server.
+        The channelExport() method is called when a user selects 'Export
+        Channel Data' from the plugin menu. The export runs in the background;
+        see channelExportStart().
 
         -----
 
         :param values_dict:
+        :param type_id:
         """
 
-        # Thingspeak requires a string representation of the boolean value.
-        if values_dict['public_flag']:
-            public_flag = 'true'
-        else:
-            public_flag = 'false'
+        self.channelExportStart(values_dict)
+        return True
 
-        parms = {'api_key':     self.pluginPrefs.get('apiKey', ''),  # User's API key. This is different from a channel API key, and can be found in account profile page. (required).
-                 'elevation':   self.pluginPrefs.get('elevation', 0),  # Elevation in meters (optional)
-                 'latitude':    self.pluginPrefs.get('latitude', 0),  # Latitude in degrees (optional)
-                 'longitude':   self.pluginPrefs.get('longitude', 0),  # Longitude in degrees (optional)
-                 'description': values_dict['description'],  # Description of the channel (optional)
-                 'field1':      values_dict['field1'],  # Field 1 name (optional)
-                 'field2':      values_dict['field2'],  # Field 2 name (optional)
-                 'field3':      values_dict['field3'],  # Field 3 name (optional)
-                 'field4':      values_dict['field4'],  # Field 4 name (optional)
-                 'field5':      values_dict['field5'],  # Field 5 name (optional)
-                 'field6':      values_dict['field6'],  # Field 6 name (optional)
-                 'field7':      values_dict['field7'],  # Field 7 name (optional)
-                 'field8':      values_dict['field8'],  # Field 8 name (optional)
-                 'metadata':    values_dict['metadata'],  # Metadata for the channel, which can include JSON, XML, or any other data (optional)
-                 'name':        values_dict['name'],  # Name of the channel (optional)
-                 'public_flag': public_flag,  # Whether the channel is public, default 'false' (optional, string required if present)
-                 'tags':        values_dict['tags'],  # Comma-separated list of tags (optional)
-                 'url':         values_dict['url'],  # Web page URL for the channel (optional)
-                 }
+    # =============================================================================
+    def channelExportAction(self, plugin_action):
+        """
+        Export a channel's feed to a local file based on a plugin action item call
 
-        return parms
+        -----
+
+        :param plugin_action:
+        """
+
+        self.channelExportStart(plugin_action.props)
 
     # =============================================================================
-    def channelCreate(self, values_dict, type_id):
+    def channelExportStart(self, props):
         """
-        Create Thingspeak channel using Thingspeak API
+        Start a background export of a channel's feed
 
-        The channelCreate() method is called when a user selects 'Create a
-        Channel' from the plugin menu. It is used to create a new channel on
-        Thingspeak.
+        The feed is written to channel_<id>.csv or channel_<id>.tscol in the
+        export folder. An existing export of the channel is continued from its
+        last entry unless the user asked to start over.
 
         -----
 
-        :param values_dict:
-        :param type_id:
+        :param props: accountProfile, channelList, exportFormat, exportFolder and exportRestart
         """
 
-        url = "/channels.json"
+        account    = self.accounts.get(props.get('accountProfile'))
+        channel_id = props.get('channelList', '')
+        writer     = feed_export.WRITERS.get(props.get('exportFormat', feed_export.CSV))
 
-        parms = self.getParms(values_dict)
+        if not channel_id or writer is None:
+            self.logger.warning(u"Please select a channel and an export format.")
+            return
 
-        response, response_dict = self.sendToThingspeak('post', url, parms)
+        if channel_id in self.exports:
+            self.logger.warning(u"Channel {0} is already being exported.".format(channel_id))
+            return
 
-        if response == 200:
-            indigo.server.log(u"Channel successfully created.".format(response))
-            return True
-        else:
-            self.logger.warning(u"Problem creating channel.")
-            return False
+        folder = props.get('exportFolder', '').strip() or \
+            os.path.join(install_path, 'Preferences', 'Plugins', self.pluginId, 'Exports')
+        path   = os.path.join(os.path.expanduser(folder), 'channel_{0}{1}'.format(channel_id, writer.extension))
+
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            if props.get('exportRestart', False) and os.path.exists(path):
+                os.remove(path)
+
+        except (IOError, OSError) as sub_error:
+            self.logger.warning(u"Unable to write to the export folder. {0}".format(sub_error))
+            return
+
+        url     = "/channels/{0}/feeds.json".format(channel_id)
+        api_key = account.channel_cache.read_key(channel_id) or account.api_key
+
+        def fetch(parms):
+            parms['api_key'] = api_key
+            return self.sendToThingspeak('get', url, parms, log_result=False, account=account)
+
+        exporter = feed_export.FeedExport(fetch, writer(path), self.logger,
+                                          should_stop=lambda: self.pluginIsShuttingDown)
+        self.exports[channel_id] = exporter
+
+        indigo.server.log(u"Exporting channel {0} to {1}.".format(channel_id, path))
+
+        thread = threading.Thread(target=self.channelExportRun, args=(channel_id, exporter, path),
+                                  name="ThingspeakExport")
+        thread.daemon = True
+        thread.start()
 
     # =============================================================================
-    def channelList(self):
+    def channelExportRun(self, channel_id, exporter, path):
         """
-        List current Thingspeak channels
+        Run a feed export and report how it went
 
-        The channelList() method is called when a user selects 'List
-        Channels' from the plugin menu. It is used to print a table of select
-        channel information to the Indigo Events log.
+        -----
+
+        :param str channel_id:
+        :param feed_export.FeedExport exporter:
+        :param str path:
+        """
+
+        try:
+            if exporter.run():
+                indigo.server.log(u"Exported {0} entries from channel {1} to {2} ({3} requests).".format(
+                    exporter.exported, channel_id, path, exporter.requests))
+            else:
+                self.logger.warning(u"Export of channel {0} stopped after {1} entries. Run the export again to "
+                                    u"continue where it left off.".format(channel_id, exporter.exported))
+
+        except Exception:
+            self.Fogbert.pluginErrorHandler(traceback.format_exc())
+            self.logger.warning(u"Export of channel {0} failed.".format(channel_id))
+
+        finally:
+            self.exports.pop(channel_id, None)
+
+    # =============================================================================
+    def channelListRequest(self, account=None):
+        """
+        Return the cache key and fetch callable for an account's channel list
+
+        The key is the host and account API key, so a different server or
+        account never shares a listing. A successful fetch also rebuilds the
+        account's channel cache.
 
         -----
 
+        :param accounts.Account account: defaults to the default account
+        :return (key, fetch):
         """
 
-        url = "/channels.json"
-        parms = {'api_key': self.pluginPrefs.get('apiKey', '')}
+        account = account or self.accounts.get()
+        parms   = {'api_key': account.api_key}
 
-        response, response_dict = self.sendToThingspeak('get', url, parms)
+        def fetch():
+            with self.metrics.timer(metrics.CHANNEL_LIST):
+                response, response_dict = self.sendToThingspeak('get', "/channels.json", parms, account=account)
 
-        if response == 200:
-            write_key = ""
+            if response == 200:
+                account.channel_cache.load(response_dict)
+
+            return response, response_dict
+
+        return (account.host, parms['api_key']), fetch
+
+    # =============================================================================
+    def getChannelList(self, cached=True, account=None):
+        """
+        Fetch the list of channels for an account
+
+        The getChannelList() method requests /channels.json using the
+        account's API key. Concurrent callers share one request. Dialogs and
+        tools get the cached listing (a stale one is refreshed in the
+        background for next time) so that they don't wait on Thingspeak; the
+        channel cache asks for a fresh one with cached=False.
+
+        -----
+
+        :param bool cached:
+        :param accounts.Account account: defaults to the default account
+        :return response.code, response_dict:
+        """
+
+        key, fetch = self.channelListRequest(account)
+
+        if cached:
+            return self.channelLists.get(key, fetch)
+
+        return self.channelLists.refresh(key, fetch)
+
+    # =============================================================================
+    def getParms(self, values_dict, account):
+        """
+        Construct the API URL for upload to Thingspeak
+
+        Construct the values needed for the data upload to the Thingspeak server.
+
+        -----
+
+        :param values_dict:
+        :param accounts.Account account:
+        """
+
+        # Thingspeak requires a string representation of the boolean value.
+        if values_dict['public_flag']:
+            public_flag = 'true'
+        else:
+            public_flag = 'false'
+
+        parms = {'api_key':     account.api_key,  # User's API key. This is different from a channel API key, and can be found in account profile page. (required).
+                 'elevation':   self.pluginPrefs.get('elevation', 0),  # Elevation in meters (optional)
+                 'latitude':    self.pluginPrefs.get('latitude', 0),  # Latitude in degrees (optional)
+                 'longitude':   self.pluginPrefs.get('longitude', 0),  # Longitude in degrees (optional)
+                 'description': values_dict['description'],  # Description of the channel (optional)
+                 'field1':      values_dict['field1'],  # Field 1 name (optional)
+                 'field2':      values_dict['field2'],  # Field 2 name (optional)
+                 'field3':      values_dict['field3'],  # Field 3 name (optional)
+                 'field4':      values_dict['field4'],  # Field 4 name (optional)
+                 'field5':      values_dict['field5'],  # Field 5 name (optional)
+                 'field6':      values_dict['field6'],  # Field 6 name (optional)
+                 'field7':      values_dict['field7'],  # Field 7 name (optional)
+                 'field8':      values_dict['field8'],  # Field 8 name (optional)
+                 'metadata':    values_dict['metadata'],  # Metadata for the channel, which can include JSON, XML, or any other data (optional)
+                 'name':        values_dict['name'],  # Name of the channel (optional)
+                 'public_flag': public_flag,  # Whether the channel is public, default 'false' (optional, string required if present)
+                 'tags':        values_dict['tags'],  # Comma-separated list of tags (optional)
+                 'url':         values_dict['url'],  # Web page URL for the channel (optional)
+                 }
+
+        return parms
+
+    # =============================================================================
+    def channelCreate(self, values_dict, type_id):
+        """
+        Create Thingspeak channel using Thingspeak API
+
+        The channelCreate() method is called when a user selects 'Create a
+        Channel' from the plugin menu. It is used to create a new channel on
+        Thingspeak.
+
+        -----
+
+        :param values_dict:
+        :param type_id:
+        """
+
+        account = self.accounts.get(values_dict.get('accountProfile'))
+        url     = "/channels.json"
+
+        parms = self.getParms(values_dict, account)
+
+        response, response_dict = self.sendToThingspeak('post', url, parms, account=account)
+
+        if response == 200:
+            account.channel_cache.invalidate()
+            self.channelLists.invalidate()
+            indigo.server.log(u"Channel successfully created.".format(response))
+            return True
+        else:
+            self.logger.warning(u"Problem creating channel.")
+            return False
+
+    # =============================================================================
+    def channelList(self):
+        """
+        List current Thingspeak channels
+
+        The channelList() method is called when a user selects 'List
+        Channels' from the plugin menu. It is used to print a table of select
+        channel information to the Indigo Events log, one table for each
+        account profile.
+
+        -----
+
+        """
+
+        listed = False
+
+        for account in self.accounts.values():
+            if account.profile_id != accounts.DEFAULT or len(self.accounts.values()) > 1:
+                indigo.server.log(u"Account Profile: {0}".format(account.name))
+
+            listed = self.channelListAccount(account) or listed
+
+        return listed
+
+    # =============================================================================
+    def channelListAccount(self, account):
+        """
+        Print a table of an account's channels to the Indigo Events log
+
+        -----
+
+        :param accounts.Account account:
+        :return bool: True if the channel list was fetched
+        """
+
+        response, response_dict = self.getChannelList(account=account)
+
+        if response == 200:
+            write_key = ""
             indigo.server.log(u"{0:<8}{1:<25}{2:^9}{3:<21}{4:^10}{5:<18}".format('ID',
                                                                                  'Name',
                                                                                  'Public',
@@ -501,22 +1084,50 @@ class Plugin(indigo.PluginBase):
             error_msg_dict['showAlertText'] = u"Update Channel Info Error:\n\nYou must select a channel to update."
             return False, values_dict, error_msg_dict
 
-        parms = self.getParms(values_dict)
+        account = self.accounts.get(values_dict.get('accountProfile'))
+        parms   = self.getParms(values_dict, account)
 
         # Get rid of empty key/value pairs so we don't overwrite existing information.
         for key in parms.keys():
             if parms[key] == "":
                 del parms[key]
 
-        response, response_dict = self.sendToThingspeak('put', url, parms)
+        response, response_dict = self.sendToThingspeak('put', url, parms, account=account)
 
         if response == 200:
+            account.channel_cache.invalidate()
+            self.channelLists.invalidate()
             indigo.server.log(u"Channel successfully updated.".format(response))
             return True
         else:
             self.logger.warning(u"Problem updating channel settings.")
             return False, values_dict
 
+    # =============================================================================
+    def circuitStateChanged(self, breaker):
+        """
+        Report a change in a host's circuit breaker state
+
+        The circuitStateChanged() method is called by the transport whenever a
+        host's circuit opens, closes or goes half-open. It logs the change and
+        updates the circuitState of the plugin devices that use the host.
+
+        -----
+
+        :param circuit_breaker.CircuitBreaker breaker:
+        """
+
+        if breaker.state == circuit_breaker.OPEN:
+            self.logger.warning(u"{0} is not responding. Uploads will be queued and retried in about {1:.0f} "
+                                u"seconds.".format(breaker.host, breaker.retry_at - t.time()))
+        else:
+            self.logger.debug(u"Circuit for {0} is {1}.".format(breaker.host, breaker.state))
+
+        for dev in indigo.devices.itervalues("self"):
+            if dev.enabled and dev.deviceTypeId != HEALTH_DEVICE and \
+                    self.accounts.get(self.devPlan(dev).profile_id).host == breaker.host:
+                self.stateWriter.submit(dev.updateStateOnServer, 'circuitState', value=breaker.state)
+
     # =============================================================================
     def commsKillAll(self):
         """
@@ -547,6 +1158,309 @@ class Plugin(indigo.PluginBase):
         for dev in indigo.devices.itervalues("self"):
             indigo.device.enable(dev, value=True)
 
+    # =============================================================================
+    def devChanged(self, dev, fields):
+        """
+        Decide whether a change-only device's sample is worth uploading
+
+        The devChanged() method returns True if any field has moved beyond its
+        deadband since the device's last queued sample, or if the device's
+        heartbeat interval has passed without an upload.
+
+        -----
+
+        :param dev:
+        :param dict fields: {'field1': val, ...}
+        :return bool:
+        """
+
+        if dev.id not in self.lastQueued:
+            return True
+
+        plan                = self.devPlan(dev)
+        queued_at, previous = self.lastQueued[dev.id]
+
+        if t.time() - queued_at >= plan.heartbeat:
+            return True
+
+        return deadband.any_moved(previous, fields, plan.bands)
+
+    # =============================================================================
+    def devDrainQueue(self, dev):
+        """
+        Send a channel's queued samples to Thingspeak
+
+        The devDrainQueue() method sends the samples waiting in the upload queue
+        for the device's channel. A single sample from a Single Update device is
+        posted to update.json; anything else (Bulk Update devices, or a backlog
+        left behind by an outage) is replayed through bulk_update.json in as
+        many requests as needed to stay within the endpoint's limits. Samples
+        keep their original created_at and are only removed from the queue
+        once Thingspeak has accepted them.
+
+        -----
+
+        :param dev:
+        :return bool: True if everything that was attempted was accepted
+        """
+
+        plan       = self.devPlan(dev)
+        account    = self.accounts.get(plan.profile_id)
+        channel_id = plan.channel_id
+        rows       = self.uploadQueue.peek(channel_id, limit=upload_queue.DRAIN_LIMIT)
+
+        if not rows:
+            return False
+
+        # Find the write api key for this channel. The account's channel cache refetches
+        # the channel list when it's stale or when Thingspeak rejects a cached key.
+        api_key = account.channel_cache.write_key(channel_id)
+
+        if not api_key:
+            self.logger.warning(u"{0}: Unable to find a write key for channel {1}.".format(dev.name, channel_id))
+            self.retryAfter[channel_id] = t.time() + upload_queue.RETRY_INTERVAL
+            return False
+
+        single = len(rows) == 1 and not plan.bulk_mode
+        chunks = [] if single else bulk.split(rows)
+
+        # Thingspeak drops requests that break the license limits, so hold the
+        # samples back (they'll go out together later) rather than waste a request.
+        if self.devRateLimited(dev, channel_id, 1 if single else len(chunks[0])):
+            return False
+
+        self.stateWriter.submit(dev.updateStateOnServer, 'thingState', value=False, uiValue="processing")
+
+        if single:
+            row_id, thing_dict = rows[0]
+            thing_dict['key'] = api_key
+
+            self.logger.debug(unicode(thing_dict))
+
+            # Open a connection and upload data to Thingspeak
+            self.logger.debug(u"{0}: Channel updating...".format(dev.name))
+
+            if self.devPrepareForThingspeak(dev, thing_dict):
+                self.uploadQueue.delete([row_id])
+                self.historyRecord(channel_id, [thing_dict])
+                self.retryAfter.pop(channel_id, None)
+                self.metrics.count(metrics.UPLOADS)
+                return True
+
+        else:
+            url     = "/channels/{0}/bulk_update.json".format(channel_id)
+            posted  = None   # The newest sample Thingspeak has accepted so far.
+            limited = False
+
+            for n, chunk in enumerate(chunks):
+
+                # The first chunk was cleared above.
+                if n and self.devRateLimited(dev, channel_id, len(chunk)):
+                    limited = True
+                    break
+
+                payload = {'write_api_key': api_key, 'updates': [bulk.bulk_entry(entry) for _, entry in chunk]}
+                response, response_dict = self.sendToThingspeak('post', url, {}, payload=payload, account=account)
+
+                # The write key may have changed since the channel cache was built.
+                if response == 401:
+                    account.channel_cache.refresh()
+                    api_key = account.channel_cache.write_key(channel_id)
+
+                    if api_key and api_key != payload['write_api_key']:
+                        payload['write_api_key'] = api_key
+                        response, response_dict = self.sendToThingspeak('post', url, {}, payload=payload,
+                                                                        account=account)
+
+                account.rate_limiter.record_response(channel_id, response)
+
+                if response not in (200, 202):
+                    break
+
+                self.uploadQueue.delete([row_id for row_id, _ in chunk])
+                self.historyRecord(channel_id, [entry for _, entry in chunk])
+                self.metrics.count(metrics.UPLOADS, len(chunk))
+                self.logger.debug(u"{0}: Bulk update posted {1} samples.".format(dev.name, len(chunk)))
+                posted = chunk[-1][1]
+
+            else:
+                self.devBulkPosted(dev, channel_id, posted)
+                self.retryAfter.pop(channel_id, None)
+                return True
+
+            # Chunks that went before the rest had to stop still count as an upload.
+            if posted is not None:
+                self.devBulkPosted(dev, channel_id, posted)
+
+            # The rest wait for the rate limiter, which has set the channel's retry time.
+            if limited:
+                if posted is None:
+                    self.stateWriter.submit(dev.updateStateOnServer, 'thingState', value=False, uiValue=u"waiting")
+                return False
+
+        # Leave the remaining samples queued and try again later.
+        self.logger.warning(u"{0}: Upload failed. {1} samples are queued and will be retried.".format(
+            dev.name, self.uploadQueue.pending(channel_id)))
+        self.retryAfter[channel_id] = t.time() + upload_queue.RETRY_INTERVAL
+        self.metrics.count(metrics.RETRIES)
+        self.stateWriter.submit(dev.updateStateOnServer, 'thingState', value=False, uiValue=u"waiting")
+        return False
+
+    # =============================================================================
+    def devBulkPosted(self, dev, channel_id, last_entry):
+        """
+        Update a device's states after a bulk update was accepted
+
+        Bulk updates don't echo the entry back, so the states report the most
+        recent sample posted.
+
+        -----
+
+        :param dev:
+        :param channel_id:
+        :param dict last_entry: the newest sample posted
+        """
+
+        states_list = [{'key': 'thing{0}'.format(_), 'value': last_entry.get('field{0}'.format(_), "0")}
+                       for _ in range(1, 9)]
+
+        self.lastUpload[dev.id] = t.time()
+
+        states_list.append({'key': 'channel_id', 'value': int(channel_id)})
+        states_list.append({'key': 'created_at', 'value': self.localTime.display(self.lastUpload[dev.id])})
+        states_list.append({'key': 'thingState', 'value': True, 'uiValue': u"OK"})
+        self.stateWriter.submit(dev.updateStatesOnServer, states_list)
+        self.stateWriter.submit(dev.updateStateImageOnServer, indigo.kStateImageSel.SensorOn)
+
+    # =============================================================================
+    def devUploadJob(self, dev):
+        """
+        Upload a channel's queued samples on an upload worker
+
+        The devUploadJob() method is run by the upload pool. Once the upload is
+        finished the device is put back on the schedule; this goes through the
+        state writer so that the device's new states are in place before the
+        scheduler looks at it again.
+
+        -----
+
+        :param dev:
+        """
+
+        try:
+            self.devDrainQueue(dev)
+
+        finally:
+            self.stateWriter.submit(self.scheduler.schedule, dev.id, t.time())
+
+    # =============================================================================
+    def devRateLimited(self, dev, channel_id, messages):
+        """
+        Reserve an upload with the account's rate limiter, or defer the channel
+
+        -----
+
+        :param dev:
+        :param channel_id:
+        :param int messages: number of entries the upload will carry
+        :return bool: True if the upload has to wait
+        """
+
+        wait = self.accounts.get(self.devPlan(dev).profile_id).rate_limiter.acquire(channel_id, messages)
+
+        if wait:
+            self.logger.debug(u"{0}: Rate limited. Upload deferred {1:.0f} seconds.".format(dev.name, wait))
+            self.metrics.count(metrics.DEFERRED)
+            self.retryAfter[channel_id] = t.time() + wait
+            return True
+
+        return False
+
+    # =============================================================================
+    def devEnqueueSample(self, dev, upload_now=False):
+        """
+        Write the device's current values to the upload queue
+
+        The devEnqueueSample() method takes a sample of the device's things,
+        stamps it with the current UTC time and stores it in the durable upload
+        queue. Nothing is sent from here; see devDrainQueue().
+
+        -----
+
+        :param dev:
+        :param bool upload_now: the sample is for a manual upload
+        """
+
+        plan = self.devPlan(dev)
+
+        with self.metrics.timer(metrics.EXTRACT):
+            fields = self.getThingValues(dev)
+
+        # In change-only mode a sample that hasn't moved is dropped before it costs a
+        # request (a manual upload always goes).
+        if plan.change_only and not upload_now and not self.devChanged(dev, fields):
+            self.logger.debug(u"{0}: No change beyond the deadband. Sample skipped.".format(dev.name))
+            self.lastSample[dev.id] = t.time()
+            return
+
+        # Location (and, for Single Update devices, Twitter) fields come from the plan.
+        thing_dict = dict(plan.static)
+        thing_dict.update(fields)
+        thing_dict['created_at'] = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S +0000')
+
+        self.uploadQueue.put(dev.id, plan.channel_id, thing_dict)
+        self.lastSample[dev.id] = t.time()
+        self.lastQueued[dev.id] = (t.time(), fields)
+
+    # =============================================================================
+    def devLastUpload(self, dev):
+        """
+        Return when the device last uploaded, from its created_at state
+
+        created_at holds local time ('2018-04-01 07:00:00'; older versions of
+        the plugin added a misleading '+00:00'). It is only read when the device
+        starts.
+
+        -----
+
+        :param dev:
+        :return float: epoch seconds (0 if unknown)
+        """
+
+        try:
+            return t.mktime(t.strptime(dev.states.get('created_at', '')[:19], clock.DISPLAY_FORMAT))
+        except (TypeError, ValueError, OverflowError):
+            return 0
+
+    # =============================================================================
+    def devPlan(self, dev, rebuild=False):
+        """
+        Return the device's extraction plan, building it if needed
+
+        The devPlan() method compiles the device's props (and the relevant
+        plugin prefs) into an extraction.ExtractionPlan. Plans are rebuilt when
+        the device starts and after the plugin prefs are saved; otherwise the
+        cached plan is reused on every cycle.
+
+        -----
+
+        :param dev:
+        :param bool rebuild: ignore any cached plan
+        :return extraction.ExtractionPlan:
+        """
+
+        plan = None if rebuild else self.plans.get(dev.id)
+
+        if plan is None:
+            plan = extraction.ExtractionPlan(dev, self.pluginPrefs, self.thingKind, self.evalExpr.compile_expr)
+
+            for warning in plan.warnings:
+                self.logger.warning(warning)
+
+            self.plans[dev.id] = plan
+
+        return plan
+
     # =============================================================================
     def devPrepareForThingspeak(self, dev, parms):
         """
@@ -561,9 +1475,29 @@ class Plugin(indigo.PluginBase):
         :param parms:
         """
 
-        url = "/update.json"
+        plan    = self.devPlan(dev)
+        account = self.accounts.get(plan.profile_id)
+        url     = "/update.json"
+
+        response, response_dict = self.sendToThingspeak('post', url, parms, account=account)
+
+        # The write key may have been regenerated since the channel cache was
+        # built. Refresh the cache and, if the key changed, try once more.
+        if response == 401:
+            account.channel_cache.refresh()
+            api_key = account.channel_cache.write_key(plan.channel_id)
+
+            if api_key and api_key != parms['key']:
+                parms['key'] = api_key
+                response, response_dict = self.sendToThingspeak('post', url, parms, account=account)
+
+        # Thingspeak answers an update that comes too soon with an entry id of 0
+        # rather than an error, so treat it the same as a 429.
+        if response == 200 and not response_dict:
+            self.logger.warning(u"{0}: Thingspeak ignored an update sent too soon.".format(dev.name))
+            response = 429
 
-        response, response_dict = self.sendToThingspeak('post', url, parms)
+        account.rate_limiter.record_response(plan.channel_id, response)
 
         # Process the results. Thingspeak will respond with a "0" if something went
         # wrong.
@@ -575,50 +1509,57 @@ class Plugin(indigo.PluginBase):
 
         if response == 200:
 
-            dev.updateStateOnServer('channel_id', value=int(response_dict.get('channel_id', "0")))
-            dev.updateStateOnServer('elevation', value=int(response_dict.get('elevation', "0")))
-            dev.updateStateOnServer('entry_id', value=int(response_dict.get('entry_id', "0")))
-            dev.updateStateOnServer('latitude', value=float(response_dict.get('latitude', "0")))
-            dev.updateStateOnServer('longitude', value=float(response_dict.get('longitude', "0")))
-            dev.updateStateOnServer('status', value=response_dict.get('status', "0"))
+            # All of the device's states go to the server in a single call.
+            states_list = [{'key': 'channel_id', 'value': int(response_dict.get('channel_id', "0"))},
+                           {'key': 'elevation', 'value': int(response_dict.get('elevation', "0"))},
+                           {'key': 'entry_id', 'value': int(response_dict.get('entry_id', "0"))},
+                           {'key': 'latitude', 'value': float(response_dict.get('latitude', "0"))},
+                           {'key': 'longitude', 'value': float(response_dict.get('longitude', "0"))},
+                           {'key': 'status', 'value': response_dict.get('status', "0")},
+                           ]
 
             # For thing values 1-8
             for _ in range(1, 9):
-                dev.updateStateOnServer('thing{0}'.format(_), value=response_dict.get('field{0}'.format(_), "0"))
+                states_list.append({'key': 'thing{0}'.format(_), 'value': response_dict.get('field{0}'.format(_), "0")})
 
-            # Convert UTC return to local time. There is an optional timezone parameter
-            # that can be used in the form of: time_zone="timezone=America%2FChicago&"
-            # For now, we will convert to UTC locally.
-            if response_dict['created_at']:
-                time = t.time()
+            # Scheduling uses the local clock, so a server clock that disagrees with it
+            # can't make uploads drift. created_at shows Thingspeak's time in local time.
+            # There is an optional timezone parameter that can be used in the form of:
+            # time_zone="timezone=America%2FChicago&". For now, we convert locally.
+            self.lastUpload[dev.id] = t.time()
 
-                # time_delta_to_utc formula thanks to Karl (kw123).
-                time_delta_to_utc = (int(t.mktime(dt.datetime.utcfromtimestamp(time + 10).timetuple()) - time) / 100) * 100
-                utc_obj = du_parse(response_dict['created_at'])
+            try:
+                created_at = self.localTime.display(clock.parse_utc(response_dict['created_at']))
+            except (KeyError, TypeError, ValueError):
+                created_at = u"Unknown"
 
-                local_time = str(utc_obj - dt.timedelta(seconds=time_delta_to_utc))
-                dev.updateStateOnServer('created_at', value=local_time)
-            else:
-                dev.updateStateOnServer('created_at', value=u"Unknown")
+            states_list.append({'key': 'created_at', 'value': created_at})
+
+            states_list.append({'key': 'thingState', 'value': True, 'uiValue': u"OK"})
+            self.stateWriter.submit(dev.updateStatesOnServer, states_list)
+            self.stateWriter.submit(dev.updateStateImageOnServer, indigo.kStateImageSel.SensorOn)
+
+            # Replacing props is expensive (and restarts nothing useful), so only do it
+            # when the channel id has actually changed.
+            channel_id = int(response_dict.get('channel_id', "0"))
 
-            new_props = dev.pluginProps
-            new_props['address'] = dev.states['channel_id']
-            dev.replacePluginPropsOnServer(new_props)
+            if unicode(dev.pluginProps.get('address', "")) != unicode(channel_id):
+                new_props = dev.pluginProps
+                new_props['address'] = channel_id
+                self.stateWriter.submit(dev.replacePluginPropsOnServer, new_props)
 
-            dev.updateStateOnServer('thingState', value=True, uiValue=u"OK")
-            dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
             return True
 
-    # TODO: Combine these eight generators into one using the filter attribute.
-    #       See Matplotlib Stock Bar Chart as an example.
     # =============================================================================
     def devStateGenerator(self, filter="", values_dict=None, type_id="", target_id=0):
         """
-        Generate a list of devices and variables for the Thingspeak device
+        Generate a list of states for the device or variable assigned to a thing
 
-        The following eight methods produce lists of states that are associated
-        with user-selected devices when configuring Thingspeak reporting
-        devices. Each list includes only states for the selected device.
+        The devStateGenerator() method produces the list of states that are
+        associated with the user-selected device when configuring Thingspeak
+        reporting devices; the thing number is passed as the filter. Each list
+        includes only states for the selected device (a variable only has its
+        value).
 
         -----
 
@@ -631,22 +1572,7 @@ class Plugin(indigo.PluginBase):
         if not values_dict:
             return []
 
-        thing = "thing{0}".format(filter)
-
-        if values_dict and thing in values_dict:
-            if values_dict[thing] != "":
-                try:
-                    if int(values_dict[thing]) in indigo.devices:
-                        dev = indigo.devices[int(values_dict[thing])]
-                        return [x for x in dev.states.keys() if ".ui" not in x]
-                    elif int(values_dict[thing]) in indigo.variables:
-                        return [('value', 'value')]
-                    else:
-                        return [('None', 'None')]
-                except ValueError:
-                    return [('None', 'None')]
-            else:
-                return [('None', 'None')]
+        return self.indexedDevices().states(values_dict.get("thing{0}".format(filter), ""))
 
     # =============================================================================
     def encodeValueDicts(self):
@@ -654,16 +1580,30 @@ class Plugin(indigo.PluginBase):
         Encode the data dicts for upload to Thingspeak
 
         The encodeValueDicts() method is called when a device makes a call
-        to upload data to Thingspeak.
+        to upload data to Thingspeak. It runs on the concurrent thread; a
+        manual upload sets self.uploadNow and wakes the thread rather than
+        running a pass of its own.
 
         -----
 
         """
 
-        api_key = None
-        thing_dict = {}
+        cycle_started = t.time()
 
-        for dev in indigo.devices.itervalues("self"):
+        # Take the manual upload request for this pass. One made while the pass runs
+        # is left for the next.
+        upload_now, self.uploadNow = self.uploadNow, False
+
+        # While a host's circuit is open, samples are still queued but nothing is sent to it.
+        available = dict((host, self.transport.available(host)) for host in self.accounts.hosts())
+
+        # A manual upload visits every device; otherwise only the devices that are due.
+        if upload_now:
+            devices = list(indigo.devices.itervalues("self"))
+        else:
+            devices = [indigo.devices[dev_id] for dev_id in self.scheduler.pop_due() if dev_id in indigo.devices]
+
+        for dev in devices:
 
             # A device has been created, but hasn't been saved yet.
             if not dev.configured:
@@ -674,120 +1614,193 @@ class Plugin(indigo.PluginBase):
             elif not dev.enabled:
                 continue
 
-            # Iterate over up to 8 values per device.
-            elif dev.enabled:
+            try:
+                if dev.deviceTypeId == HEALTH_DEVICE:
+                    self.scheduler.schedule(dev.id, self.healthUpdate(dev))
+                else:
+                    self.scheduler.schedule(dev.id, self.processDevice(dev, available, upload_now))
 
-                # For each device, see if it is time for an update
-                last_update = dev.states.get('created_at', '1970-01-01 00:00:00+00:00')
-                if last_update == '':
-                    last_update = '1970-01-01 00:00:00'
-                last_update = du_parse(last_update)
+            except Exception:
+                self.Fogbert.pluginErrorHandler(traceback.format_exc())
 
-                delta = dt.datetime.now().replace(tzinfo=pytz.utc) - last_update.replace(tzinfo=pytz.utc)
-                delta = int(delta.total_seconds())
+                # Don't let one bad device spin; look at it again after a short rest.
+                self.scheduler.schedule(dev.id, t.time() + upload_queue.RETRY_INTERVAL)
 
-                if self.uploadNow or delta > int(dev.pluginProps['devUploadInterval']):
-                    dev.updateStateOnServer('thingState', value=False, uiValue="processing")
+        self.metrics.observe(metrics.CYCLE, t.time() - cycle_started)
 
-                    channel_id     = dev.pluginProps['channelList']
-                    url            = "/channels.json"
-                    parms          = {'api_key': self.pluginPrefs.get('apiKey', '')}
+    # =============================================================================
+    def getThingValues(self, dev):
+        """
+        Collect the current values of a device's things
 
-                    response, response_dict = self.sendToThingspeak('get', url, parms)
+        The getThingValues() method reads the latest value of the Indigo device
+        state or variable assigned to each of the device's (up to) 8 things from
+        the value table and returns them as Thingspeak fields, following the
+        device's extraction plan. Things set to upload an aggregate report it
+        for the time since the previous sample, and a new aggregation window
+        starts.
 
-                    # Find the write api key for this channel (we go and get it in case it's changed.
-                    for thing in response_dict:
-                        if str(thing['id']) == str(channel_id):
-                            for key in thing['api_keys']:
-                                if key['write_flag']:
-                                    api_key = key['api_key']
+        -----
+
+        :param dev:
+        :return dict: {'field1': val, ...}
+        """
 
-                    if not api_key:
-                        return
+        plan       = self.devPlan(dev)
+        thing_dict = {}
+        aggregates = self.valueTable.collect(dev.id)
+        plain      = []  # (field key, source id, raw value) still to be coerced
 
-                    for v in range(1, 9):
-                        thing_str       = 'thing{0}'.format(v)
-                        thing_state_str = 'thing{0}State'.format(v)
+        # The value table was registered from plan.sources, so its rows line up with
+        # plan.things.
+        for (field, key, kind, source_id, state), row in zip(plan.things, self.valueTable.read(dev.id)):
+            var = row[3]
 
-                        # Create the dict and add the API key to it.
-                        thing_dict['key'] = api_key
+            # The device (or variable) has been removed.
+            if var is value_table.MISSING:
+                self.logger.debug(u"{0} - {1} no longer exists.".format(dev.name, source_id))
+                continue
 
-                        # If there is a device created, but no value assigned.
-                        if not dev.pluginProps[thing_str] or dev.pluginProps[thing_str] == "None":
-                            var = "Null value"
+            # Aggregates are already numeric. With no numeric values seen at all, fall
+            # back to the last value.
+            if aggregates.get(field) is not None:
+                thing_dict[key] = aggregates[field]
+                continue
 
-                        else:
-                            thing_1 = dev.pluginProps[thing_str]
-                            state_1 = dev.pluginProps[thing_state_str]
+            plain.append((key, source_id, var))
 
-                            self.logger.debug(u"{0:{1}^22}".format('', ' '))
-                            self.logger.debug(u"ID: {0}".format(thing_1))
-                            self.logger.debug(u"Item: {0}".format(state_1))
+        # Everything else is coerced in a single pass. A value with no number in it
+        # wouldn't chart, so the field is left out of the sample.
+        with self.metrics.timer(metrics.COERCE):
+            values = coercion.coerce_many([row[2] for row in plain])
 
-                            # If it's a device state, do this:
-                            if int(thing_1) in indigo.devices:
+        for (key, source_id, raw), var in zip(plain, values):
+            if var is None:
+                self.logger.debug(u"{0} - {1} is non-numeric ({2}) and won't be uploaded.".format(
+                    dev.name, source_id, raw))
+                continue
 
-                                try:
-                                    var = indigo.devices[int(thing_1)].states[state_1]
-                                    var = self.onlyNumerics(var)
-                                    self.logger.debug(u"Value: {0}".format(var))
+            thing_dict[key] = var
 
-                                except ValueError:
-                                    self.Fogbert.pluginErrorHandler(traceback.format_exc())
-                                    self.logger.warning(u"{0} - {1} is non-numeric or has been removed. "
-                                                        u"Will try to upload, but it won't "
-                                                        u"chart.".format(dev.name, dev.pluginProps[thing_str]))
-                                    var = u"undefined"
+        # Derived fields. Every expression sees the values as extracted above.
+        if plan.expressions:
+            values = dict((name, thing_dict[key]) for name, key in plan.names.items() if key in thing_dict)
 
-                                # Add device state value to dictionary.
-                                thing_dict['field' + str(v)] = var
+            for key, function in plan.expressions:
+                try:
+                    thing_dict[key] = function(values)
 
-                            # If it's a variable value, do this:
-                            elif int(thing_1) in indigo.variables:
-                                var = indigo.variables[int(thing_1)].value
+                # A thing it uses has no value this time (or the arithmetic fails, e.g.,
+                # division by zero); the field is left out of the sample.
+                except (KeyError, ArithmeticError, TypeError, ValueError) as sub_error:
+                    thing_dict.pop(key, None)
+                    self.logger.debug(u"{0} - {1} expression not evaluated ({2!r}).".format(dev.name, key, sub_error))
 
-                                try:
-                                    var = self.onlyNumerics(var)
-                                    self.logger.debug(u"Value: {0}".format(var))
+        self.logger.debug(u"{0}: {1}".format(dev.name, thing_dict))
+        return thing_dict
 
-                                except ValueError:
-                                    self.Fogbert.pluginErrorHandler(traceback.format_exc())
-                                    self.logger.warning(u"{0} - {1} is non-numeric or has been removed. "
-                                                        u"Will try to upload, but it won't "
-                                                        u"chart.".format(dev.name, dev.pluginProps[thing_str]))
+    # =============================================================================
+    def healthUpdate(self, dev):
+        """
+        Refresh a Plugin Health device from the metrics registry
 
-                                # Add variable value to dictionary.
-                                thing_dict['field' + str(v)] = var
+        The healthUpdate() method is called from the upload cycle when the
+        Plugin Health device is due. All of its states go to the server in a
+        single call.
 
-                        thing_dict['elevation']  = self.pluginPrefs['elevation']
-                        thing_dict['latitude']   = self.pluginPrefs['latitude']
-                        thing_dict['longitude']  = self.pluginPrefs['longitude']
-                        thing_dict['twitter']    = self.pluginPrefs['twitter']
-                        thing_dict['tweet']      = u"{0}".format(dev.pluginProps['tweet'])
+        -----
 
-                    self.logger.debug(unicode(thing_dict))
+        :param dev:
+        :return float: epoch seconds of the next update
+        """
 
-                    # Open a connection and upload data to Thingspeak
-                    try:
+        snapshot = self.metrics.snapshot()
+        counters = snapshot['counters']
+        stages   = snapshot['stages']
+        empty    = metrics.Histogram().summary()
+        http     = stages.get(metrics.HTTP, empty)
+
+        states_list = [{'key': 'uploads', 'value': counters.get(metrics.UPLOADS, 0)},
+                       {'key': 'retries', 'value': counters.get(metrics.RETRIES, 0)},
+                       {'key': 'errors', 'value': counters.get(metrics.ERRORS, 0)},
+                       {'key': 'deferred', 'value': counters.get(metrics.DEFERRED, 0)},
+                       {'key': 'rateLimited', 'value': counters.get(metrics.STATUS.format(429), 0)},
+                       {'key': 'queuePending', 'value': self.uploadQueue.pending()},
+                       {'key': 'httpRequests', 'value': http['count']},
+                       {'key': 'httpMean', 'value': round(http['mean'], 1)},
+                       {'key': 'httpP99', 'value': round(http['p99'], 1)},
+                       {'key': 'httpP95', 'value': round(http['p95'], 1),
+                        'uiValue': u"{0:.0f} ms".format(http['p95'])},
+                       ]
+
+        for key, stage in (('channelListMs', metrics.CHANNEL_LIST), ('extractMs', metrics.EXTRACT),
+                           ('coerceMs', metrics.COERCE), ('stateWriteMs', metrics.STATE_WRITE),
+                           ('cycleMs', metrics.CYCLE)):
+            states_list.append({'key': key, 'value': round(stages.get(stage, empty)['mean'], 2)})
+
+        self.stateWriter.submit(dev.updateStatesOnServer, states_list)
+        self.stateWriter.submit(dev.updateStateImageOnServer, indigo.kStateImageSel.SensorOn)
+
+        return t.time() + HEALTH_INTERVAL
 
-                        # The plugin uploads variable values before moving on to the next one. Will
-                        # continue until no more devices or the plugin throws an exception.
-                        self.logger.debug(u"{0}: Channel updating...".format(dev.name))
-                        self.devPrepareForThingspeak(dev, thing_dict)
-
-                    except Exception:
-                        self.Fogbert.pluginErrorHandler(traceback.format_exc())
-                        self.logger.debug("{0} - Curl Return Code: {1}".format(dt.datetime.time(dt.datetime.now()),
-                                                                               response))
-                        self.logger.debug("{0} - Curl Response Dict: {1}".format(dt.datetime.time(dt.datetime.now()),
-                                                                                 response_dict,))
+    # =============================================================================
+    def historyQuery(self, plugin_action):
+        """
+        Return a field's local history based on a plugin action item call
 
-                else:
-                    continue
+        The historyQuery() method answers scripts that run the hidden Query Local
+        History action with executeAction(). See ring_store.HistoryStore.query()
+        for how the tier is chosen.
 
-        self.uploadNow = False  # If we've come here manually
-        self.updating  = False  # If we've come here automatically
-        return
+        -----
+
+        :param plugin_action: props channelId, field (1-8), start and end (epoch seconds), step (seconds)
+        :return list: [[timestamp, mean, min, max, count], ...] oldest first
+        """
+
+        props = plugin_action.props
+        end   = float(props.get('end') or t.time())
+        start = float(props.get('start') or end - 86400)
+
+        return self.history.query(props['channelId'], int(props.get('field', 1)), start, end,
+                                  int(props.get('step') or 0))
+
+    # =============================================================================
+    def historyRecord(self, channel_id, entries):
+        """
+        Keep a local copy of uploaded samples
+
+        -----
+
+        :param channel_id:
+        :param list entries: samples accepted by Thingspeak (with 'created_at' and field values)
+        """
+
+        if not self.pluginPrefs.get('keepHistory', True):
+            return
+
+        try:
+            for entry in entries:
+                self.history.record(channel_id, clock.parse_utc(entry['created_at']), entry)
+
+        except Exception:
+            self.Fogbert.pluginErrorHandler(traceback.format_exc())
+            self.logger.warning(u"Unable to add the upload to the local history.")
+
+    # =============================================================================
+    def indexedDevices(self):
+        """
+        Return the device and variable index, building it the first time
+
+        -----
+
+        :return device_index.DeviceIndex:
+        """
+
+        if not self.deviceIndex.is_built():
+            self.deviceIndex.build(indigo.devices.itervalues(), indigo.variables.itervalues())
+
+        return self.deviceIndex
 
     # =============================================================================
     def listGenerator(self, filter="", values_dict=None, type_id="", target_id=0):
@@ -795,7 +1808,7 @@ class Plugin(indigo.PluginBase):
         Return a list of devices and variables
 
         The listGenerator() method returns the current list of devices and
-        variables from the list 'self.devicesAndVariablesList'.
+        variables from the device index.
 
         -----
 
@@ -805,51 +1818,124 @@ class Plugin(indigo.PluginBase):
         :param target_id:
         """
 
-        return self.devicesAndVariablesList
+        return self.indexedDevices().menu_items()
 
     # =============================================================================
-    def onlyNumerics(self, val):
+    def metricsEnabled(self):
         """
-        Ensure value is a number
+        Turn metrics collection on or off
 
-        This method evaluates values intended for upload. It ensures that the
-        values are numeric only (i.e., stripping °F) and converting binary
-        strings to integers. It also converts Indigo string values to floats
-        as necessary.
+        Metrics are collected when the plugin prefs ask for them or while a
+        Plugin Health device is running.
 
         -----
 
-        :param val:
+        :return bool:
         """
 
-        try:
-            # Does it float? Yes? Then it must be a witch.
-            return float(val)
+        self.metrics.enabled = bool(self.pluginPrefs.get('collectMetrics', False)) or bool(self.healthDevices)
+        return self.metrics.enabled
 
-        # If it doesn't float, let's see if it's a boolean or a string that contains a
-        # number.
-        except ValueError:
+    # =============================================================================
+    def metricsSummary(self):
+        """
+        Write the metrics summary to the Indigo events log
 
-            # Bool maybe?
-            if val.upper() in ("TRUE", "ON"):
-                return 1
+        The metricsSummary() method is called when a user selects 'Show
+        Metrics Summary' from the plugin menu. It logs the timings of each stage
+        of the upload cycle (with a histogram) and the counters.
 
-            elif val.upper() in ("FALSE", "OFF"):
-                return 0
+        -----
 
-            # Is it a string that contains a number?
-            else:
-                val = val.upper()
-                val1 = ''.join([_ for _ in val if _ in '1234567890.'])
+        """
 
-                if len(val1) != 0:
-                    return val1
+        if not self.metrics.enabled and not self.metrics.stages:
+            indigo.server.log(u"No metrics have been collected. Turn on metrics in the plugin configuration or "
+                              u"create a Plugin Health device.")
+            return
 
-                else:
-                    return False
+        for line in self.metrics.report():
+            indigo.server.log(line)
+
+    # =============================================================================
+    def processDevice(self, dev, available=None, upload_now=False):
+        """
+        Sample and upload a device's data as needed
+
+        The processDevice() method takes a sample for the device if one is due,
+        sends whatever is queued for its channel if that is due, and returns the
+        time at which the device next needs attention.
+
+        -----
+
+        :param dev:
+        :param dict available: {host: False if the host's circuit is open}
+        :param bool upload_now: a manual upload (everything is due now)
+        :return float: epoch seconds
+        """
+
+        # For each device, see if it is time for an update
+        plan            = self.devPlan(dev)
+        host            = self.accounts.get(plan.profile_id).host
+        host_available  = (available or {}).get(host, True)
+        now             = t.time()
+        upload_interval = plan.upload_interval
+        sample_interval = plan.sample_interval
+        upload_due_at   = self.lastUpload.get(dev.id, 0) + upload_interval
+        upload_due      = upload_now or now > upload_due_at
+        bulk_mode       = plan.bulk_mode
+        channel_id      = plan.channel_id
+        since_last      = now - self.lastSample.get(dev.id, 0)
+
+        # Bulk devices sample on their own interval. Single devices sample once per
+        # upload interval, even while an earlier sample is still waiting to be sent.
+        if bulk_mode:
+            sample_due = since_last >= sample_interval
+        else:
+            sample_due = upload_due and (upload_now or since_last >= upload_interval)
+
+        if sample_due:
+            self.devEnqueueSample(dev, upload_now)
+
+        # Bulk devices post when the upload interval has elapsed or a full batch is
+        # waiting. Single devices post as soon as anything is queued. Either way, a
+        # channel that just failed waits for its retry time.
+        pending = self.uploadQueue.pending(channel_id)
+
+        if bulk_mode:
+            send_due = pending and (upload_due or pending >= bulk.MAX_ENTRIES)
+        else:
+            send_due = pending
+
+        # The send itself runs on the upload pool so that a slow channel doesn't hold
+        # up the others. A channel that already has a job in flight is left alone.
+        if send_due and host_available and (upload_now or now >= self.retryAfter.get(channel_id, 0)):
+            self.uploadPool.submit(channel_id, self.devUploadJob, dev)
+
+        # Work out when this device next needs attention. Anything still queued is
+        # retried once the channel's (or host's) wait is over; a channel with a job
+        # in flight is rescheduled by the job when it finishes.
+        now       = t.time()
+        upload_at = upload_due_at + 1
+        retry_at  = self.retryAfter.get(channel_id, 0)
+        pending   = not self.uploadPool.is_busy(channel_id) and self.uploadQueue.pending(channel_id)
+
+        if not self.transport.available(host):
+            retry_at = max(retry_at, self.transport.breaker(host).retry_at)
+
+        if bulk_mode:
+            next_due = self.lastSample.get(dev.id, 0) + sample_interval
+            if pending:
+                next_due = min(next_due, max(upload_at, retry_at))
+        else:
+            next_due = max(upload_at, self.lastSample.get(dev.id, 0) + upload_interval)
+            if pending:
+                next_due = min(next_due, retry_at)
+
+        return max(next_due, now + 1)
 
     # =============================================================================
-    def sendToThingspeak(self, request_type, url, parms):
+    def sendToThingspeak(self, request_type, url, parms, payload=None, log_result=True, account=None):
         """
         Send the payload to Thingspeak
 
@@ -862,6 +1948,9 @@ class Plugin(indigo.PluginBase):
         :param request_type:
         :param url:
         :param parms:
+        :param payload: optional JSON request body (bulk updates)
+        :param bool log_result: log the response at debug level (off for large feed pages)
+        :param accounts.Account account: the account whose host is called (defaults to the default account)
         :return response.code, response_dict:
         """
 
@@ -871,25 +1960,17 @@ class Plugin(indigo.PluginBase):
 
         self.logger.debug(u"Warning! Debug output contains sensitive information.")
 
-        # Build upload URL.
-        if self.pluginPrefs['devicePort']:
-            ts_ip = self.pluginPrefs['deviceIP']
-        else:
-            ts_ip = "api.thingspeak.com"
-
-        url = "https://{0}{1}".format(ts_ip, url)
+        ts_ip = (account or self.accounts.get()).host
 
         try:
-            if request_type == "put":
-                response = requests.put(url, params=parms, timeout=10)
-            elif request_type == "get":
-                response = requests.get(url, params=parms, timeout=10)
-            elif request_type == "post":
-                response = requests.post(url, params=parms, timeout=10)
-            elif request_type == "delete":
-                response = requests.delete(url, params=parms, timeout=10)
+            # Requests are sent over the pooled keep-alive session for this host.
+            with self.metrics.timer(metrics.HTTP):
+                if payload is None:
+                    response = self.transport.request(request_type, ts_ip, url, parms)
+                else:
+                    response = self.transport.request(request_type, ts_ip, url, parms, json=payload)
 
-            self.logger.debug(url)
+            self.logger.debug(u"{0}://{1}{2}".format(transport.SCHEME, ts_ip, url))
 
             try:
                 response_dict = response.json()
@@ -897,10 +1978,13 @@ class Plugin(indigo.PluginBase):
                 response_dict = {}
 
             response_code = response.status_code
+            self.metrics.count(metrics.STATUS.format(response_code))
 
-            self.logger.debug(u"Result: {0}".format(response_dict))
+            if log_result:
+                self.logger.debug(u"Result: {0}".format(response_dict))
 
-            if response_code == 200:
+            # Bulk updates are answered with 202 Accepted.
+            if response_code in (200, 202):
                 return response_code, response_dict
 
             else:
@@ -916,25 +2000,100 @@ class Plugin(indigo.PluginBase):
                 self.logger.warning(response_error_msg_dict.get(response.status_code, u"Error unknown."))
                 return response_code, response_dict
 
+        # The host has been failing; don't wait on it. Queued samples stay queued.
+        except circuit_breaker.CircuitOpenError as sub_error:
+            self.logger.debug(u"Request deferred. {0}".format(sub_error))
+            self.metrics.count(metrics.DEFERRED)
+            return response_code, response_dict
+
         # Internet isn't there
         except requests.exceptions.ConnectionError:
+            self.metrics.count(metrics.ERRORS)
             self.Fogbert.pluginErrorHandler(traceback.format_exc())
             self.logger.warning(u"Unable to reach host. Will continue to attempt connection.")
-
-            # TODO: this has been throwing gremlins in Little Snitch
-            # Attempt ping every 30 seconds until Internet comes back
-            while response != 0:
-                response = os.system("/sbin/ping -c 1 google.com")
-                self.sleep(30)
-
             return response_code, response_dict
 
         # ThingSpeak doesn't respond
         except requests.exceptions.Timeout:
+            self.metrics.count(metrics.ERRORS)
             self.Fogbert.pluginErrorHandler(traceback.format_exc())
             self.logger.warning(u"Host server timeout. Will continue to retry.")
             return response_code, response_dict
 
+    # =============================================================================
+    def thingLookup(self, source_id, state):
+        """
+        Return the current value of a device state or variable
+
+        The thingLookup() method is used to seed the value table; after that
+        values arrive through deviceUpdated() and variableUpdated().
+
+        -----
+
+        :param int source_id: Indigo device or variable id
+        :param str state: device state name
+        :return: the value, or value_table.MISSING
+        """
+
+        if source_id in indigo.devices:
+            return indigo.devices[source_id].states.get(state, value_table.MISSING)
+
+        elif source_id in indigo.variables:
+            return indigo.variables[source_id].value
+
+        return value_table.MISSING
+
+    # =============================================================================
+    def thingKind(self, source_id):
+        """
+        Return whether an Indigo id belongs to a device or a variable
+
+        -----
+
+        :param int source_id:
+        :return str: extraction.DEVICE, extraction.VARIABLE or None
+        """
+
+        if source_id in indigo.devices:
+            return extraction.DEVICE
+
+        elif source_id in indigo.variables:
+            return extraction.VARIABLE
+
+        return None
+
+    # =============================================================================
+    def thingSelected(self, values_dict, type_id="", dev_id=0):
+        """
+        Callback for the thing menus
+
+        Choosing a device or variable for a thing only needs the matching state
+        menu to reload, which Indigo does on its own (dynamicReload).
+
+        -----
+
+        :param values_dict:
+        :param type_id:
+        :param dev_id:
+        """
+
+        return values_dict
+
+    # =============================================================================
+    def uploadWorkerCount(self):
+        """
+        Return the configured number of upload threads
+
+        -----
+
+        :return int:
+        """
+
+        try:
+            return max(1, int(self.pluginPrefs.get('uploadWorkers', workers.DEFAULT_WORKERS)))
+        except ValueError:
+            return workers.DEFAULT_WORKERS
+
     # =============================================================================
     def updateMenuConfigUi(self, values_dict, menu_id):
         """
@@ -954,11 +2113,11 @@ class Plugin(indigo.PluginBase):
         """
 
         if menu_id == 'channelUpdate':
-            url       = "/channels.json"
-            parms     = {'api_key': self.pluginPrefs.get('apiKey', '')}
             write_key = ""
 
-            response, response_dict = self.sendToThingspeak('get', url, parms)
+            account = self.accounts.get(values_dict.get('accountProfile'))
+
+            response, response_dict = self.getChannelList(account=account)
 
             for thing in response_dict:
                 if thing['id'] == int(values_dict['channelList']):
@@ -975,7 +2134,10 @@ class Plugin(indigo.PluginBase):
             url   = "/channels/{0}/feeds.json".format(int(values_dict['channelList']))
             parms = {'api_key': write_key}
 
-            response, response_dict = self.sendToThingspeak('get', url, parms)
+            response, response_dict = self.sendToThingspeak('get', url, parms, account=account)
+
+            if response == 200:
+                account.channel_cache.set_fields(values_dict['channelList'], response_dict['channel'])
 
             # For thing values 1-8
             for _ in range(1, 9):
@@ -989,17 +2151,19 @@ class Plugin(indigo.PluginBase):
         Update Thingspeak data based on a plugin action item call
 
         The updateThingspeakDataAction () method invokes an instantaneous
-        update of the Thingspeak data channels. If this is called before 15
-        seconds have elapsed since the last update, Thingspeak will ignore it.
-        Unsure if the 15 second limit starts over.
+        update of the Thingspeak data channels. Channels that were updated
+        too recently for the account's license are sent as soon as the
+        license allows.
 
         -----
 
         :param values_dict:
         """
 
+        # The concurrent thread does the upload; running a pass here as well would
+        # race it.
         self.uploadNow = True
-        self.encodeValueDicts()
+        self.scheduler.wake()
         return
 
     # =============================================================================
@@ -1008,15 +2172,59 @@ class Plugin(indigo.PluginBase):
         Update Thingspeak data based on a plugin menu item call
 
         The updateThingspeakDataMenu() method invokes an instantaneous update
-        of the Thingspeak data channels. If this is called before 15 seconds
-        have elapsed since the last update, Thingspeak will ignore it. Unsure
-        if the 15 second limit starts over.
+        of the Thingspeak data channels. Channels that were updated too
+        recently for the account's license are sent as soon as the license
+        allows.
 
         -----
 
         """
 
         self.uploadNow = True
-        self.encodeValueDicts()
+        self.scheduler.wake()
         return
+
     # =============================================================================
+    def validateAccountSettings(self, values_dict, error_msg_dict):
+        """
+        Check the API key and license settings of an account
+
+        Used by the plugin configuration dialog (the default account) and the
+        Account Profiles dialog.
+
+        -----
+
+        :param values_dict: apiKey, devicePort and licenseUnits
+        :param error_msg_dict: errors are added here
+        """
+
+        # Key must be 16 characters in length
+        if len(values_dict.get('apiKey', '')) not in (0, 16):
+            error_msg_dict['apiKey'] = u"The API Key must be 16 characters long."
+
+        # Test key against ThingSpeak service. This always asks Thingspeak (not the cached
+        # channel list), so a key that has been revoked or mistyped since is caught.
+        if values_dict.get('apiKey', '') and not values_dict.get('devicePort', False):
+            try:
+                parms    = {'api_key': values_dict['apiKey']}
+                response = self.transport.request('get', transport.REMOTE_HOST, "/channels.json", parms, timeout=1.50)
+
+                if response.status_code == 401:
+                    raise ValueError
+
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                self.Fogbert.pluginErrorHandler(traceback.format_exc())
+                self.logger.warning(u"Unable to confirm accuracy of API Key with the ThingSpeak service.")
+
+            except ValueError:
+                self.Fogbert.pluginErrorHandler(traceback.format_exc())
+                error_msg_dict['apiKey'] = u"ThingSpeak rejected your API Key as invalid. Please ensure that your " \
+                                           u"key is entered correctly."
+
+        # License units must be a positive integer.
+        try:
+            if int(values_dict.get('licenseUnits', 1)) < 1:
+                raise ValueError
+        except ValueError:
+            values_dict['licenseUnits'] = 1
+            error_msg_dict['licenseUnits'] = u"Please enter a whole number of license units (1 or more)."
@@ -0,0 +1,264 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: rate_limit.py
+:author: DaveL17
+
+Upload rate limiting for the Thingspeak Plugin
+
+Thingspeak limits how often each channel may be updated (the update interval)
+and how many messages an account may send (the license's message budget).
+Requests that break either limit are dropped -- sometimes silently -- so the
+RateLimiter keeps a token bucket for each channel and one for the account and
+is consulted before every upload. An upload that can't be sent yet is left in
+the upload queue, where it is coalesced with later samples into a single bulk
+update once the channel's bucket refills.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+import time as t
+
+# =============================================================================
+
+# (update interval in seconds, messages per year per license unit)
+LICENSE_TIERS = {
+    u'free': (15, 3000000),
+    u'paid': (1, 33000000),
+    }
+
+DEFAULT_TIER    = u'free'
+BUSY_DELAY      = 15    # Seconds to hold a channel after Thingspeak answers 429.
+PAYMENT_DELAY   = 3600  # Seconds to hold the account after Thingspeak answers 402.
+SECONDS_PER_DAY = 86400
+
+
+def license_limits(tier=DEFAULT_TIER, units=1):
+    """
+    Return (update interval, messages per day) for a license tier
+
+    -----
+
+    :param str tier: a key of LICENSE_TIERS
+    :param int units: number of license units purchased
+    :return tuple:
+    """
+
+    interval, per_year = LICENSE_TIERS.get(tier, LICENSE_TIERS[DEFAULT_TIER])
+    return interval, per_year * max(1, units) // 365
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket; tokens refill continuously up to capacity
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate     = float(rate)  # Tokens added per second.
+        self.capacity = float(capacity)
+        self.tokens   = float(capacity)
+        self.updated  = t.time()
+
+    # =============================================================================
+    def refill(self, now):
+        """
+        Add the tokens earned since the last call
+
+        -----
+
+        :param float now: epoch seconds
+        """
+
+        if now > self.updated:
+            self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    # =============================================================================
+    def wait_time(self, n, now):
+        """
+        Return the number of seconds until n tokens are available (0 if they are now)
+
+        -----
+
+        :param float n: tokens wanted
+        :param float now: epoch seconds
+        :return float:
+        """
+
+        self.refill(now)
+
+        # Never ask for more than the bucket can hold, or the wait would be forever.
+        n = min(n, self.capacity)
+
+        if self.tokens >= n:
+            return 0
+        return (n - self.tokens) / self.rate
+
+    # =============================================================================
+    def take(self, n):
+        """
+        Spend n tokens (call wait_time() first)
+
+        -----
+
+        :param float n:
+        """
+
+        self.tokens -= min(n, self.capacity)
+
+    # =============================================================================
+    def hold(self, seconds, now):
+        """
+        Make the bucket unavailable for at least the given number of seconds
+
+        -----
+
+        :param float seconds:
+        :param float now: epoch seconds
+        """
+
+        self.refill(now)
+        self.tokens = min(self.tokens, 1 - self.rate * seconds)
+
+
+class RateLimiter(object):
+    """
+    Per-channel update interval and per-account message budget
+
+    An interval or budget of 0 turns that limit off (e.g., for a local
+    Thingspeak server). A 429 holds the channel back whether or not there is
+    an interval; the hold is kept apart from the channel's bucket and simply
+    runs out.
+    """
+
+    def __init__(self, interval=0, per_day=0):
+        self.lock     = threading.Lock()
+        self.interval = 0
+        self.per_day  = 0
+        self.channels = {}  # Channel id -> TokenBucket, while there is an update interval.
+        self.holds    = {}  # Channel id -> epoch a 429 hold runs out.
+        self.account  = None
+        self.configure(interval, per_day)
+
+    # =============================================================================
+    def configure(self, interval, per_day):
+        """
+        Apply new limits
+
+        Limits are reapplied whenever the plugin prefs or account profiles
+        are saved, so nothing already spent is forgotten: channel buckets are
+        kept (and moved over to a new update interval) and the account bucket
+        keeps what it has spent. Turning the interval off drops the channel
+        buckets; 429 holds run their course.
+
+        -----
+
+        :param float interval: seconds between updates to one channel
+        :param int per_day: account messages per day
+        """
+
+        now = t.time()
+
+        with self.lock:
+            if not interval:
+                self.channels.clear()
+            elif interval != self.interval:
+                for bucket in self.channels.values():
+                    self._move(bucket, interval, now)
+
+            self.interval = interval
+            self.per_day  = per_day
+
+            if per_day:
+                spent        = self.account.capacity - self.account.tokens if self.account else 0
+                self.account = TokenBucket(float(per_day) / SECONDS_PER_DAY, per_day)
+                self.account.tokens -= min(spent, per_day)
+            else:
+                self.account = None
+
+    # =============================================================================
+    def acquire(self, channel_id, messages=1):
+        """
+        Reserve one request to channel_id carrying the given number of messages
+
+        Nothing is spent unless both the channel and the account can afford
+        the request.
+
+        -----
+
+        :param channel_id:
+        :param int messages: entries in the request (1 for update.json)
+        :return float: 0 if the request may go now, otherwise seconds to wait
+        """
+
+        now = t.time()
+
+        with self.lock:
+            held    = self.holds.get(str(channel_id), 0) - now
+            buckets = [(self._channel(channel_id), 1), (self.account, messages)]
+            buckets = [(bucket, n) for bucket, n in buckets if bucket is not None]
+            wait    = max([bucket.wait_time(n, now) for bucket, n in buckets] + [held, 0])
+
+            if held <= 0:
+                self.holds.pop(str(channel_id), None)
+
+            if wait:
+                return wait
+
+            for bucket, n in buckets:
+                bucket.take(n)
+
+            return 0
+
+    # =============================================================================
+    def record_response(self, channel_id, status_code):
+        """
+        Back off after Thingspeak says a limit has been reached
+
+        -----
+
+        :param channel_id:
+        :param int status_code: HTTP status of the upload
+        """
+
+        now = t.time()
+
+        with self.lock:
+            if status_code == 429:
+                until = now + max(BUSY_DELAY, self.interval)
+                self.holds[str(channel_id)] = max(until, self.holds.get(str(channel_id), 0))
+
+            elif status_code == 402 and self.account is not None:
+                self.account.hold(PAYMENT_DELAY, now)
+
+    # =============================================================================
+    def _move(self, bucket, interval, now):
+
+        # Carry a channel bucket over to a new update interval. The wait the bucket
+        # already has is never shortened, and grows by the difference when the
+        # interval gets longer. (Buckets only exist while there is an interval.)
+        bucket.refill(now)
+        wait = max(0, (1 - bucket.tokens) / bucket.rate)
+
+        if self.interval:
+            wait += max(0, interval - self.interval)
+
+        bucket.rate   = 1.0 / interval
+        bucket.tokens = 1 - wait * bucket.rate
+
+    # =============================================================================
+    def _channel(self, channel_id):
+
+        if not self.interval:
+            return None
+
+        bucket = self.channels.get(str(channel_id))
+
+        if bucket is None:
+            bucket = TokenBucket(1.0 / self.interval, 1)
+            self.channels[str(channel_id)] = bucket
+
+        return bucket
@@ -0,0 +1,402 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: ring_store.py
+:author: DaveL17
+
+Local time-series history for the Thingspeak Plugin
+
+The HistoryStore class keeps a copy of every value the plugin uploads in
+fixed-size ring buffers on disk. Each channel has one memory-mapped file
+holding, for each of its eight fields, three rings (tiers):
+
+    raw     (timestamp, value) for each upload
+    5 min   (bucket start, mean, minimum, maximum, count) per 5 minutes
+    1 hour  the same per hour
+
+The rollup tiers are maintained as values arrive: each tier keeps the bucket
+it is filling in the file header and writes it to its ring when a value for a
+later bucket comes in. The file never grows, so disk and memory use depend on
+the ring sizes in TIERS and not on how long the plugin has been running; when
+a ring is full the oldest record is overwritten.
+
+query() returns a downsampled series for a time range from the tier that
+best fits the requested resolution and still reaches back far enough.
+Records within a ring are kept in time order, so a value older than the
+newest one already in a tier is left out of that tier.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import collections
+import mmap
+import os
+import struct
+import threading
+
+# =============================================================================
+
+FIELDS   = 8     # Fields per channel.
+MAX_OPEN = 64    # Channel files kept mapped at once (each holds a file descriptor).
+
+# (seconds per record, records kept). 0 seconds is the raw tier.
+TIERS = ((0,    8640),   # Raw: a day and a half at one upload every 15 seconds.
+         (300,  8640),   # 5 minutes: 30 days.
+         (3600, 8784),   # 1 hour: a year (and a leap day).
+         )
+
+MAGIC  = b'TSRING\x00\x01'
+LAYOUT = struct.Struct('<{0}I'.format(len(TIERS) * 2))  # The TIERS the file was built with.
+STATE  = struct.Struct('<IIddddd')  # head, count, open bucket: start, count, sum, min, max
+RAW    = struct.Struct('<dd')       # timestamp, value
+ROLLUP = struct.Struct('<ddddd')    # bucket start, mean, min, max, count
+
+
+def _merge(bucket, record):
+
+    # bucket and record are [timestamp, mean, min, max, count].
+    total = bucket[4] + record[4]
+    bucket[1] = (bucket[1] * bucket[4] + record[1] * record[4]) / total
+    bucket[2] = min(bucket[2], record[2])
+    bucket[3] = max(bucket[3], record[3])
+    bucket[4] = total
+
+
+class RingFile(object):
+    """
+    The memory-mapped rings of one channel
+    """
+
+    def __init__(self, path):
+        self.path  = path
+        self.rings = []  # By field, then tier: (state offset, data offset, record struct, width, capacity)
+
+        # The header, then the state of every ring, then the rings themselves.
+        states = len(MAGIC) + LAYOUT.size
+        offset = states + FIELDS * len(TIERS) * STATE.size
+
+        for n in range(FIELDS * len(TIERS)):
+            width, capacity = TIERS[n % len(TIERS)]
+            record          = RAW if width == 0 else ROLLUP
+
+            self.rings.append((states + n * STATE.size, offset, record, width, capacity))
+            offset += record.size * capacity
+
+        self.size = offset
+        layout    = LAYOUT.pack(*[n for tier in TIERS for n in tier])
+
+        # A file built with other ring sizes (or not a ring file at all) is started over.
+        exists = os.path.exists(path) and os.path.getsize(path) == self.size
+
+        self.file = open(path, 'r+b' if exists else 'w+b')
+
+        if exists and self.file.read(len(MAGIC) + LAYOUT.size) != MAGIC + layout:
+            exists = False
+
+        if not exists:
+            self.file.truncate(0)
+            self.file.truncate(self.size)
+            self.file.seek(0)
+            self.file.write(MAGIC + layout)
+            self.file.flush()
+
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+
+    # =============================================================================
+    def _ring(self, field, tier):
+
+        return self.rings[field * len(TIERS) + tier]
+
+    # =============================================================================
+    def _push(self, ring, state, values):
+
+        state_offset, data_offset, record, width, capacity = ring
+        head, count = state[0], state[1]
+
+        record.pack_into(self.map, data_offset + head * record.size, *values)
+
+        state[0] = (head + 1) % capacity
+        state[1] = min(count + 1, capacity)
+
+    # =============================================================================
+    def _record(self, ring, state, n):
+
+        # The n-th oldest record of a ring.
+        state_offset, data_offset, record, width, capacity = ring
+        index = (state[0] - state[1] + n) % capacity
+
+        return record.unpack_from(self.map, data_offset + index * record.size)
+
+    # =============================================================================
+    def append(self, field, timestamp, value):
+        """
+        Add a value to a field's raw tier and roll it up into the others
+
+        -----
+
+        :param int field: 0 for field1 through 7 for field8
+        :param float timestamp: epoch seconds
+        :param float value:
+        """
+
+        for tier in range(len(TIERS)):
+            ring  = self._ring(field, tier)
+            state = list(STATE.unpack_from(self.map, ring[0]))
+            width = ring[3]
+
+            if width == 0:
+                if state[1] and self._record(ring, state, state[1] - 1)[0] > timestamp:
+                    continue
+
+                self._push(ring, state, (timestamp, value))
+
+            else:
+                bucket = timestamp - timestamp % width
+
+                if state[3] and bucket < state[2]:
+                    continue
+
+                if state[3] and bucket == state[2]:
+                    state[3] += 1
+                    state[4] += value
+                    state[5]  = min(state[5], value)
+                    state[6]  = max(state[6], value)
+
+                else:
+                    # The open bucket is complete; write it out and start the next one.
+                    if state[3]:
+                        self._push(ring, state, (state[2], state[4] / state[3], state[5], state[6], state[3]))
+
+                    state[2:] = [bucket, 1, value, value, value]
+
+            STATE.pack_into(self.map, ring[0], *state)
+
+    # =============================================================================
+    def records(self, field, tier, start, end):
+        """
+        Return a tier's records between start and end as [timestamp, mean, min, max, count]
+
+        -----
+
+        :param int field:
+        :param int tier: index into TIERS
+        :param float start: epoch seconds
+        :param float end: epoch seconds
+        :return list:
+        """
+
+        ring  = self._ring(field, tier)
+        state = list(STATE.unpack_from(self.map, ring[0]))
+        width = ring[3]
+
+        # Binary search for the first record at or after start.
+        low, high = 0, state[1]
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self._record(ring, state, middle)[0] < start:
+                low = middle + 1
+            else:
+                high = middle
+
+        records = []
+
+        for n in range(low, state[1]):
+            record = self._record(ring, state, n)
+
+            if record[0] > end:
+                break
+
+            records.append([record[0], record[1], record[1], record[1], 1] if width == 0 else list(record))
+
+        # The bucket still being filled.
+        if width and state[3] and start <= state[2] <= end:
+            records.append([state[2], state[4] / state[3], state[5], state[6], state[3]])
+
+        return records
+
+    # =============================================================================
+    def covers(self, field, tier, start):
+        """
+        Return True if a tier still holds everything recorded from start on
+
+        A ring that hasn't filled up yet has never dropped a record.
+
+        -----
+
+        :param int field:
+        :param int tier: index into TIERS
+        :param float start: epoch seconds
+        :return bool:
+        """
+
+        ring  = self._ring(field, tier)
+        state = list(STATE.unpack_from(self.map, ring[0]))
+
+        return state[1] < ring[4] or self._record(ring, state, 0)[0] <= start
+
+    # =============================================================================
+    def close(self, flush=True):
+
+        # The map is shared with the file, so nothing is lost without a flush; flushing
+        # just doesn't leave it to the OS to decide when the pages reach the disk.
+        if flush:
+            self.map.flush()
+
+        self.map.close()
+        self.file.close()
+
+
+class HistoryStore(object):
+    """
+    Ring files for every channel, opened as needed
+    """
+
+    def __init__(self, folder, max_open=MAX_OPEN):
+        self.folder   = folder
+        self.max_open = max_open
+        self.files    = collections.OrderedDict()  # Channel id -> RingFile, least recently used first
+        self.lock     = threading.Lock()
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    # =============================================================================
+    def _path(self, channel_id):
+
+        return os.path.join(self.folder, 'channel_{0}.ring'.format(channel_id))
+
+    # =============================================================================
+    def _file(self, channel_id, create=True):
+
+        channel_id = str(channel_id)
+        ring_file  = self.files.pop(channel_id, None)
+
+        if ring_file is None:
+            if not create and not os.path.exists(self._path(channel_id)):
+                return None
+
+            ring_file = RingFile(self._path(channel_id))
+
+            while len(self.files) >= self.max_open:
+                self.files.popitem(last=False)[1].close(flush=False)
+
+        self.files[channel_id] = ring_file
+
+        return ring_file
+
+    # =============================================================================
+    def record(self, channel_id, timestamp, fields):
+        """
+        Store the numeric fields of an uploaded sample
+
+        -----
+
+        :param channel_id:
+        :param float timestamp: epoch seconds
+        :param dict fields: {'field1': value, ...}; values that aren't numbers are skipped
+        """
+
+        values = []
+
+        for n in range(FIELDS):
+            try:
+                values.append((n, float(fields['field{0}'.format(n + 1)])))
+            except (KeyError, TypeError, ValueError):
+                pass
+
+        if not values:
+            return
+
+        with self.lock:
+            ring_file = self._file(channel_id)
+
+            for n, value in values:
+                ring_file.append(n, timestamp, value)
+
+    # =============================================================================
+    def query(self, channel_id, field, start, end, step=0):
+        """
+        Return a field's history between start and end
+
+        The records come from the coarsest tier no wider than step that still
+        reaches back to start, or else from the finest wider tier that does.
+        They are combined into buckets of step seconds when step is wider
+        than the tier's.
+
+        -----
+
+        :param channel_id:
+        :param int field: 1 through 8
+        :param float start: epoch seconds
+        :param float end: epoch seconds
+        :param int step: seconds per point (0 for the finest available)
+        :return list: [[timestamp, mean, min, max, count], ...] oldest first
+        """
+
+        with self.lock:
+            ring_file = self._file(channel_id, create=False)
+
+            if ring_file is None:
+                return []
+
+            field -= 1
+
+            # Coarsest first among the tiers no wider than step (fewest records to read),
+            # then the wider ones finest first.
+            order = sorted([n for n, (width, _) in enumerate(TIERS) if width <= step], key=lambda n: -TIERS[n][0]) + \
+                sorted([n for n, (width, _) in enumerate(TIERS) if width > step], key=lambda n: TIERS[n][0])
+
+            tier = next((n for n in order if ring_file.covers(field, n, start)), order[-1])
+
+            records = ring_file.records(field, tier, start, end)
+
+        if step <= TIERS[tier][0]:
+            return records
+
+        points = []
+
+        for record in records:
+            bucket = record[0] - record[0] % step
+
+            if points and points[-1][0] == bucket:
+                _merge(points[-1], record)
+            else:
+                points.append([bucket] + record[1:])
+
+        return points
+
+    # =============================================================================
+    def remove(self, channel_id):
+        """
+        Delete a channel's history
+
+        -----
+
+        :param channel_id:
+        """
+
+        with self.lock:
+            ring_file = self.files.pop(str(channel_id), None)
+
+            if ring_file is not None:
+                ring_file.close()
+
+            if os.path.exists(self._path(channel_id)):
+                os.remove(self._path(channel_id))
+
+    # =============================================================================
+    def close(self):
+        """
+        Flush and close every ring file
+
+        -----
+
+        """
+
+        with self.lock:
+            while self.files:
+                self.files.popitem()[1].close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: scheduler.py
+:author: DaveL17
+
+Upload scheduler for the Thingspeak Plugin
+
+The Scheduler class keeps a min-heap of (due time, device id) pairs so that
+the plugin's concurrent thread can sleep until the next device actually needs
+attention instead of waking every few seconds to inspect every device.
+Entries are replaced rather than removed from the heap; superseded entries
+are discarded lazily when they reach the top.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import heapq
+import itertools
+import threading
+import time as t
+
+# =============================================================================
+
+MAX_SLEEP = 300  # Upper bound on a single wait, as a safety net.
+
+
+class Scheduler(object):
+    """
+    Min-heap of device due times with a wake-up event
+    """
+
+    def __init__(self):
+        self.heap    = []
+        self.due     = {}  # Current due time by device id; anything else in the heap is stale.
+        self.counter = itertools.count()
+        self.lock    = threading.Lock()
+        self.event   = threading.Event()
+        self.woken   = False  # wake() was called since the last wait()
+
+    # =============================================================================
+    def schedule(self, dev_id, due):
+        """
+        Set (or replace) the due time for a device
+
+        The waiting thread is woken if the device is now due before anything
+        else in the schedule.
+
+        -----
+
+        :param int dev_id:
+        :param float due: epoch seconds
+        """
+
+        with self.lock:
+            head = self._head()
+            self.due[dev_id] = due
+            heapq.heappush(self.heap, (due, next(self.counter), dev_id))
+
+        if head is None or due < head:
+            self.event.set()
+
+    # =============================================================================
+    def remove(self, dev_id):
+        """
+        Drop a device from the schedule
+
+        -----
+
+        :param int dev_id:
+        """
+
+        with self.lock:
+            self.due.pop(dev_id, None)
+
+    # =============================================================================
+    def pop_due(self, now=None):
+        """
+        Remove and return the ids of all devices that are due
+
+        The caller is responsible for rescheduling each device it processes.
+
+        -----
+
+        :param float now: epoch seconds (defaults to the current time)
+        :return list:
+        """
+
+        if now is None:
+            now = t.time()
+
+        due_ids = []
+
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due, _, dev_id = heapq.heappop(self.heap)
+
+                if self.due.get(dev_id) == due:
+                    del self.due[dev_id]
+                    due_ids.append(dev_id)
+
+        return due_ids
+
+    # =============================================================================
+    def next_due(self):
+        """
+        Return the earliest due time in the schedule (or None)
+
+        -----
+
+        :return float:
+        """
+
+        with self.lock:
+            return self._head()
+
+    # =============================================================================
+    def wait(self, max_sleep=MAX_SLEEP):
+        """
+        Block until the next device is due, the schedule changes or wake() is called
+
+        -----
+
+        :param float max_sleep: longest time to wait
+        """
+
+        # Clear first; anything scheduled from here on either sets the event or is
+        # already reflected in the head we compute. A wake() that came in before
+        # the clear (e.g., while the caller was busy) still returns straight away.
+        self.event.clear()
+
+        if self.woken:
+            self.woken = False
+            return
+
+        head    = self.next_due()
+        timeout = max_sleep if head is None else min(max_sleep, max(0, head - t.time()))
+
+        if timeout > 0:
+            self.event.wait(timeout)
+
+    # =============================================================================
+    def wake(self):
+        """
+        Interrupt wait() (e.g., for a manual upload or when the plugin is stopping)
+
+        -----
+
+        """
+
+        self.woken = True
+        self.event.set()
+
+    # =============================================================================
+    def _head(self):
+
+        # Discard superseded entries so the top of the heap is always current.
+        while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+        return self.heap[0][0] if self.heap else None
@@ -0,0 +1,216 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: single_flight.py
+:author: DaveL17
+
+Coalesced, cached lookups for the Thingspeak Plugin
+
+The SingleFlight class makes concurrent callers asking for the same key share
+one call: the first caller runs the fetch and everyone else who arrives while
+it's running waits for (and gets) the same result or exception.
+
+The StaleCache class builds on it to serve results stale-while-revalidate. A
+result younger than the freshness window is returned as is; an older one is
+still returned right away, while a single background fetch brings it up to
+date for the next caller. Only a caller with nothing cached has to wait.
+The plugin uses it for the /channels.json listing so that config dialogs
+open from cache instead of each list generator calling Thingspeak.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+import time as t
+
+# =============================================================================
+
+DEFAULT_FRESH = 60  # Seconds a result is served without revalidating it.
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+
+class SingleFlight(object):
+    """
+    Share one in-flight call per key among concurrent callers
+    """
+
+    def __init__(self):
+        self.lock  = threading.Lock()
+        self.calls = {}
+
+    # =============================================================================
+    def do(self, key, fetch):
+        """
+        Return fetch(), or the result of the call for key that is already running
+
+        -----
+
+        :param key: hashable
+        :param fetch: callable
+        :return: whatever fetch returns (exceptions are raised to every caller)
+        """
+
+        with self.lock:
+            call   = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = fetch()
+            return call.result
+
+        except Exception as error:
+            call.error = error
+            raise
+
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+
+    # =============================================================================
+    def in_flight(self, key):
+        """
+        Return True if a call for key is running
+
+        -----
+
+        :param key:
+        :return bool:
+        """
+
+        return key in self.calls
+
+
+class StaleCache(object):
+    """
+    Stale-while-revalidate cache of fetch results keyed by request
+
+    accept(result) decides whether a result is worth keeping (e.g., only
+    successful responses); results it rejects are returned to the caller but
+    not cached.
+    """
+
+    def __init__(self, plugin, fresh=DEFAULT_FRESH, accept=None):
+        self.logger     = plugin.logger
+        self.fresh      = fresh
+        self.accept     = accept or (lambda result: True)
+        self.flight     = SingleFlight()
+        self.lock       = threading.Lock()
+        self.entries    = {}  # key -> (fetched at, result)
+        self.generation = 0   # Bumped by invalidate() so that fetches already running aren't kept.
+
+    # =============================================================================
+    def get(self, key, fetch):
+        """
+        Return the cached result for key, fetching it if there isn't one
+
+        A result older than the freshness window is returned anyway and
+        revalidated in the background.
+
+        -----
+
+        :param key: hashable
+        :param fetch: callable that produces the result
+        :return:
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return self.refresh(key, fetch)
+
+        if t.time() - entry[0] > self.fresh:
+            self.revalidate(key, fetch)
+
+        return entry[1]
+
+    # =============================================================================
+    def refresh(self, key, fetch):
+        """
+        Fetch key now (sharing a fetch that is already running) and cache the result
+
+        -----
+
+        :param key: hashable
+        :param fetch: callable that produces the result
+        :return:
+        """
+
+        generation = self.generation
+
+        def fetch_and_store():
+            result = fetch()
+
+            if self.accept(result):
+                with self.lock:
+                    if generation == self.generation:
+                        self.entries[key] = (t.time(), result)
+
+            return result
+
+        # Fetches are shared within a generation only, so one started before invalidate()
+        # isn't handed to callers that came after it.
+        return self.flight.do((key, generation), fetch_and_store)
+
+    # =============================================================================
+    def revalidate(self, key, fetch):
+        """
+        Refresh key on a background thread unless a fetch is already running
+
+        -----
+
+        :param key: hashable
+        :param fetch: callable that produces the result
+        """
+
+        if self.flight.in_flight((key, self.generation)):
+            return
+
+        thread = threading.Thread(target=self._revalidate, args=(key, fetch), name="ThingspeakRevalidate")
+        thread.daemon = True
+        thread.start()
+
+    # =============================================================================
+    def invalidate(self):
+        """
+        Forget every cached result
+
+        The next caller for each key waits for a fresh fetch; it doesn't join
+        a fetch that was already running when this was called, and those
+        fetches aren't cached.
+
+        -----
+
+        """
+
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    # =============================================================================
+    def _revalidate(self, key, fetch):
+
+        try:
+            self.refresh(key, fetch)
+        except Exception as sub_error:
+            self.logger.debug(u"Background refresh failed. {0}".format(sub_error))
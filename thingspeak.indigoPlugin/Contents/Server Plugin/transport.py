@@ -0,0 +1,225 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: transport.py
+:author: DaveL17
+
+Pooled HTTP transport for the Thingspeak Plugin
+
+The Transport class owns one long-lived requests.Session per Thingspeak host
+(the public api.thingspeak.com service and, optionally, a local Thingspeak
+server). Each session carries its own sized connection pool so that repeated
+calls to the same host reuse an open keep-alive TCP/TLS connection instead of
+performing a fresh handshake for every request.
+
+Each host also has a CircuitBreaker. Requests to a host whose circuit is open
+raise CircuitOpenError immediately rather than waiting on the network.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+import time as t
+
+# Third-party modules
+import requests
+from requests.adapters import HTTPAdapter
+
+# My modules
+import circuit_breaker
+
+# =============================================================================
+
+REMOTE_HOST      = "api.thingspeak.com"
+SCHEME           = "https"
+DEFAULT_TIMEOUT  = 10  # Seconds to wait for connect/read before giving up.
+POOL_CONNECTIONS = 1   # Each session only ever talks to a single host.
+POOL_MAXSIZE     = 8   # Concurrent keep-alive connections retained per host.
+PROBE_TIMEOUT    = 5   # Seconds to wait on the half-open probe request.
+
+
+class Transport(object):
+    """
+    Keep-alive HTTP sessions keyed by host
+
+    Sessions are created lazily the first time a host is used and are kept
+    until close() is called (on plugin shutdown) or the host is dropped
+    because the plugin prefs changed.
+    """
+
+    def __init__(self, plugin, pool_maxsize=POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, on_breaker_change=None):
+        self.plugin            = plugin
+        self.logger            = plugin.logger
+        self.pool_maxsize      = pool_maxsize
+        self.timeout           = timeout
+        self.on_breaker_change = on_breaker_change
+        self.sessions          = {}
+        self.breakers          = {}
+        self.lock              = threading.Lock()
+
+    # =============================================================================
+    def breaker(self, host):
+        """
+        Return the circuit breaker for host, creating it if needed
+
+        -----
+
+        :param str host: host name or ip:port
+        :return circuit_breaker.CircuitBreaker:
+        """
+
+        with self.lock:
+            breaker = self.breakers.get(host)
+
+            if breaker is None:
+                breaker = circuit_breaker.CircuitBreaker(host, on_change=self.on_breaker_change)
+                self.breakers[host] = breaker
+
+            return breaker
+
+    # =============================================================================
+    def available(self, host):
+        """
+        Return False if requests to host would currently fail fast
+
+        -----
+
+        :param str host: host name or ip:port
+        :return bool:
+        """
+
+        breaker = self.breaker(host)
+        return breaker.state == circuit_breaker.CLOSED or t.time() >= breaker.retry_at
+
+    # =============================================================================
+    def session(self, host):
+        """
+        Return the pooled session for host, creating it if needed
+
+        -----
+
+        :param str host: host name or ip:port
+        :return requests.Session:
+        """
+
+        with self.lock:
+            session = self.sessions.get(host)
+
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=self.pool_maxsize)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.sessions[host] = session
+                self.logger.debug(u"Opened connection pool for {0} (max {1}).".format(host, self.pool_maxsize))
+
+            return session
+
+    # =============================================================================
+    def request(self, request_type, host, url, parms=None, timeout=None, **kwargs):
+        """
+        Issue a request against host over its pooled session
+
+        -----
+
+        :param str request_type: 'get', 'put', 'post' or 'delete'
+        :param str host: host name or ip:port
+        :param str url: path portion of the URL (e.g., '/channels.json')
+        :param dict parms: query parameters
+        :param float timeout: override of the default timeout policy
+        :return requests.Response:
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        breaker = self.breaker(host)
+        session = self.session(host)
+
+        # Raises CircuitOpenError while the host is considered down.
+        if breaker.before_request() == circuit_breaker.HALF_OPEN:
+            self.probe(host, session, breaker)
+
+        try:
+            response = session.request(request_type.upper(), "{0}://{1}{2}".format(SCHEME, host, url), params=parms,
+                                       timeout=timeout, **kwargs)
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        return response
+
+    # =============================================================================
+    def probe(self, host, session, breaker):
+        """
+        Send a cheap request to see whether a half-open host is back
+
+        Any HTTP response at all means the host is reachable, so the circuit
+        is closed and the caller's request goes ahead. Anything else reopens
+        the circuit, including an error the probe wasn't expecting; a probe
+        that left the circuit half-open would shut the host out for good.
+
+        -----
+
+        :param str host: host name or ip:port
+        :param requests.Session session:
+        :param circuit_breaker.CircuitBreaker breaker:
+        :raises CircuitOpenError: if the host still can't be reached
+        """
+
+        answered = False
+
+        try:
+            session.head("{0}://{1}/".format(SCHEME, host), timeout=PROBE_TIMEOUT)
+            answered = True
+
+        except requests.exceptions.RequestException:
+            raise circuit_breaker.CircuitOpenError(u"Probe of {0} failed.".format(host))
+
+        finally:
+            if not answered:
+                breaker.record_failure()
+
+        breaker.record_success()
+        self.logger.info(u"Connection to {0} restored.".format(host))
+
+    # =============================================================================
+    def drop(self, host):
+        """
+        Close and forget the pooled session for host
+
+        -----
+
+        :param str host: host name or ip:port
+        """
+
+        with self.lock:
+            session = self.sessions.pop(host, None)
+
+        if session is not None:
+            session.close()
+
+    # =============================================================================
+    def close(self):
+        """
+        Close every pooled session
+
+        -----
+
+        """
+
+        with self.lock:
+            sessions      = list(self.sessions.values())
+            self.sessions = {}
+            self.breakers = {}
+
+        for session in sessions:
+            session.close()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: upload_queue.py
+:author: DaveL17
+
+Durable upload queue for the Thingspeak Plugin
+
+Every sample the plugin intends to upload is written to the UploadQueue
+before any attempt is made to send it. Samples are only removed once
+Thingspeak has accepted them, so a sample survives network outages and plugin
+restarts and is replayed later with its original created_at timestamp.
+
+The queue is a SQLite database in write-ahead-log mode with synchronous set
+to NORMAL, which keeps each insert cheap and batches the fsync calls into
+WAL checkpoints.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import json
+import os
+import sqlite3
+import threading
+
+# =============================================================================
+
+DRAIN_LIMIT    = 3840  # Most samples replayed for one channel per pass (four full bulk requests).
+RETRY_INTERVAL = 30    # Seconds to wait before retrying a channel whose upload failed.
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS samples (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                dev_id     INTEGER NOT NULL,
+                channel_id TEXT    NOT NULL,
+                created_at TEXT    NOT NULL,
+                payload    TEXT    NOT NULL
+            )"""
+
+INDEX = "CREATE INDEX IF NOT EXISTS samples_channel ON samples (channel_id, id)"
+
+
+class UploadQueue(object):
+    """
+    SQLite-backed FIFO of samples keyed by channel
+
+    Each sample is a dict of Thingspeak update parameters which must include
+    a 'created_at' key. Write keys are never stored; they are looked up when
+    the sample is sent.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.conn.execute(INDEX)
+        self.conn.commit()
+
+    # =============================================================================
+    def put(self, dev_id, channel_id, entry):
+        """
+        Append a sample to the queue
+
+        -----
+
+        :param int dev_id: Indigo id of the plugin device that took the sample
+        :param channel_id:
+        :param dict entry: Thingspeak update parameters including 'created_at'
+        """
+
+        with self.lock:
+            self.conn.execute("INSERT INTO samples (dev_id, channel_id, created_at, payload) VALUES (?, ?, ?, ?)",
+                              (dev_id, str(channel_id), entry['created_at'], json.dumps(entry)))
+            self.conn.commit()
+
+    # =============================================================================
+    def peek(self, channel_id, limit=None):
+        """
+        Return the oldest queued samples for channel_id without removing them
+
+        -----
+
+        :param channel_id:
+        :param int limit: maximum number of samples to return
+        :return list: [(row_id, entry), ...] oldest first
+        """
+
+        sql  = "SELECT id, payload FROM samples WHERE channel_id = ? ORDER BY id"
+        args = (str(channel_id),)
+
+        if limit:
+            sql  += " LIMIT ?"
+            args += (int(limit),)
+
+        with self.lock:
+            rows = self.conn.execute(sql, args).fetchall()
+
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    # =============================================================================
+    def pending(self, channel_id=None):
+        """
+        Return the number of queued samples for channel_id (or all channels)
+
+        -----
+
+        :param channel_id:
+        :return int:
+        """
+
+        with self.lock:
+            if channel_id is None:
+                return self.conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+            return self.conn.execute("SELECT COUNT(*) FROM samples WHERE channel_id = ?",
+                                     (str(channel_id),)).fetchone()[0]
+
+    # =============================================================================
+    def delete(self, row_ids):
+        """
+        Remove samples that Thingspeak has accepted
+
+        -----
+
+        :param list row_ids:
+        """
+
+        if not row_ids:
+            return
+
+        with self.lock:
+            self.conn.executemany("DELETE FROM samples WHERE id = ?", [(_,) for _ in row_ids])
+            self.conn.commit()
+
+    # =============================================================================
+    def purge_device(self, dev_id):
+        """
+        Remove all samples taken by a device (i.e., when the device is deleted)
+
+        -----
+
+        :param int dev_id:
+        """
+
+        with self.lock:
+            self.conn.execute("DELETE FROM samples WHERE dev_id = ?", (dev_id,))
+            self.conn.commit()
+
+    # =============================================================================
+    def close(self):
+        """
+        Checkpoint the write-ahead log and close the database
+
+        -----
+
+        """
+
+        with self.lock:
+            try:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                self.conn.close()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: value_table.py
+:author: DaveL17
+
+Ingested thing values for the Thingspeak Plugin
+
+The ValueTable class holds the latest value of every Indigo device state and
+variable that is assigned to a thing on one of the plugin's devices. The
+plugin subscribes to Indigo's device and variable changes and feeds them into
+the table as they happen, so that taking a sample is a handful of dict reads
+instead of a lookup in the Indigo object store for every field. Only the
+(source id, state) pairs that some plugin device references are kept.
+
+Things that upload an aggregate rather than the latest value also get an
+aggregate.Accumulator, which every change to the source is folded into.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+import time as t
+
+# My modules
+import aggregate
+
+# =============================================================================
+
+MISSING = object()  # The source (or its state) doesn't exist.
+
+
+class ValueTable(object):
+    """
+    Latest values of the device states and variables referenced by things
+
+    lookup(source_id, state) is called to seed a value when a device is
+    registered; it returns the current value or MISSING. coerce(value)
+    returns a value as a float for the accumulators, or None if it isn't
+    numeric.
+    """
+
+    def __init__(self, lookup, coerce=float):
+        self.lookup       = lookup
+        self.coerce       = coerce
+        self.lock         = threading.Lock()
+        self.things       = {}  # Plugin device id -> [(field number, source id, state), ...]
+        self.watched      = {}  # Source id -> {state: number of things referencing it}
+        self.values       = {}  # (source id, state) -> latest value
+        self.accumulators = {}  # (source id, state) -> [(plugin device id, field number, Accumulator), ...]
+
+    # =============================================================================
+    def register(self, dev_id, things, aggregates=None):
+        """
+        Start (or restart) tracking the sources used by a plugin device
+
+        -----
+
+        :param int dev_id: plugin device id
+        :param list things: [(field number, source id, state), ...]
+        :param dict aggregates: {field number: aggregate mode} for fields that don't upload the last value
+        """
+
+        self.unregister(dev_id)
+
+        aggregates = aggregates or {}
+        now        = t.time()
+
+        # Seed outside the lock; lookups go to the Indigo server.
+        seeds = dict(((source_id, state), self.lookup(source_id, state)) for _, source_id, state in things)
+
+        with self.lock:
+            self.things[dev_id] = list(things)
+
+            for field, source_id, state in things:
+                key           = (source_id, state)
+                states        = self.watched.setdefault(source_id, {})
+                states[state] = states.get(state, 0) + 1
+                self.values[key] = seeds[key]
+
+                if aggregates.get(field, aggregate.LAST) != aggregate.LAST:
+                    accumulator = aggregate.Accumulator(aggregates[field], now, self._number(seeds[key]))
+                    self.accumulators.setdefault(key, []).append((dev_id, field, accumulator))
+
+    # =============================================================================
+    def unregister(self, dev_id):
+        """
+        Stop tracking the sources used by a plugin device
+
+        -----
+
+        :param int dev_id: plugin device id
+        """
+
+        with self.lock:
+            for _, source_id, state in self.things.pop(dev_id, []):
+                states = self.watched.get(source_id, {})
+                states[state] = states.get(state, 1) - 1
+
+                key = (source_id, state)
+                accumulators = [entry for entry in self.accumulators.get(key, []) if entry[0] != dev_id]
+
+                if accumulators:
+                    self.accumulators[key] = accumulators
+                else:
+                    self.accumulators.pop(key, None)
+
+                if states[state] <= 0:
+                    states.pop(state, None)
+                    self.values.pop(key, None)
+
+                if not states:
+                    self.watched.pop(source_id, None)
+
+    # =============================================================================
+    def device_updated(self, dev):
+        """
+        Take the new values of any watched states of an Indigo device
+
+        -----
+
+        :param dev: the updated indigo.Device
+        """
+
+        states = self.watched.get(dev.id)
+
+        if not states:
+            return
+
+        with self.lock:
+            for state in list(states):
+                self._set((dev.id, state), dev.states.get(state, MISSING))
+
+    # =============================================================================
+    def variable_updated(self, var):
+        """
+        Take the new value of a watched Indigo variable
+
+        -----
+
+        :param var: the updated indigo.Variable
+        """
+
+        states = self.watched.get(var.id)
+
+        if not states:
+            return
+
+        with self.lock:
+            for state in list(states):
+                self._set((var.id, state), var.value)
+
+    # =============================================================================
+    def source_deleted(self, source_id):
+        """
+        Mark every watched value of a deleted device or variable as missing
+
+        -----
+
+        :param int source_id:
+        """
+
+        with self.lock:
+            for state in self.watched.get(source_id, {}):
+                self.values[(source_id, state)] = MISSING
+
+    # =============================================================================
+    def read(self, dev_id):
+        """
+        Return the latest raw values for a plugin device's things
+
+        -----
+
+        :param int dev_id: plugin device id
+        :return list: [(field number, source id, state, value), ...]
+        """
+
+        with self.lock:
+            return [(field, source_id, state, self.values.get((source_id, state), MISSING))
+                    for field, source_id, state in self.things.get(dev_id, [])]
+
+    # =============================================================================
+    def collect(self, dev_id, now=None):
+        """
+        Return a plugin device's aggregates and start a new window for each
+
+        -----
+
+        :param int dev_id: plugin device id
+        :param float now: epoch seconds (defaults to the current time)
+        :return dict: {field number: aggregate (None if nothing numeric was seen)}
+        """
+
+        if now is None:
+            now = t.time()
+
+        results = {}
+
+        with self.lock:
+            for field, source_id, state in self.things.get(dev_id, []):
+                for owner, owner_field, accumulator in self.accumulators.get((source_id, state), []):
+                    if owner == dev_id and owner_field == field:
+                        results[field] = accumulator.result(now)
+                        accumulator.reset(now)
+
+        return results
+
+    # =============================================================================
+    def _number(self, value):
+
+        if value is MISSING or value is None:
+            return None
+
+        try:
+            return self.coerce(value)
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    # =============================================================================
+    def _set(self, key, value):
+
+        # Only actual changes are folded into the accumulators.
+        if self.values.get(key, MISSING) == value:
+            return
+
+        self.values[key] = value
+        number = self._number(value)
+
+        if number is not None:
+            now = t.time()
+
+            for _, _, accumulator in self.accumulators.get(key, []):
+                accumulator.add(number, now)
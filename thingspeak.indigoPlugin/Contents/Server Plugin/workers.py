@@ -0,0 +1,246 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: workers.py
+:author: DaveL17
+
+Upload workers for the Thingspeak Plugin
+
+The ChannelWorkerPool class runs uploads on a small, bounded set of threads
+so that one slow channel doesn't hold up every other channel. Work is
+partitioned by channel id: every job for a given channel goes to the same
+worker, so uploads for a channel are still sent in order. A semaphore caps
+the number of jobs that may be queued or running at once; submit() blocks
+when the cap is reached, which pushes back on the scheduler.
+
+The StateWriter class funnels Indigo state and prop writes made by the
+workers onto a single thread so that they are applied in order and the
+Indigo server only ever sees one writer.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import threading
+import traceback
+import zlib
+
+try:
+    import Queue as queue  # Python 2
+except ImportError:
+    import queue
+
+# My modules
+import metrics
+
+# =============================================================================
+
+DEFAULT_WORKERS       = 4   # Upload threads.
+DEFAULT_MAX_IN_FLIGHT = 16  # Jobs allowed to be queued or running at once.
+
+
+class ChannelWorkerPool(object):
+    """
+    Fixed set of worker threads, each owning a partition of the channels
+    """
+
+    def __init__(self, plugin, workers=DEFAULT_WORKERS, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.plugin  = plugin
+        self.slots   = threading.BoundedSemaphore(max(1, max_in_flight))
+        self.busy    = set()  # Channels with a job queued or running.
+        self.lock    = threading.Lock()
+        self.queues  = []
+        self.threads = []
+
+        for n in range(max(1, workers)):
+            work_queue = queue.Queue()
+            thread     = threading.Thread(target=self._run, args=(work_queue,), name="ThingspeakUpload{0}".format(n))
+            thread.daemon = True
+            self.queues.append(work_queue)
+            self.threads.append(thread)
+            thread.start()
+
+    # =============================================================================
+    def submit(self, channel_id, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) on the worker that owns channel_id
+
+        Only one job per channel is accepted at a time; a channel that is
+        already busy is skipped (its queued samples will be picked up by the
+        job that is already pending).
+
+        -----
+
+        :param channel_id:
+        :param func: callable to run on the worker
+        :return bool: True if the job was queued
+        """
+
+        channel_id = str(channel_id)
+
+        with self.lock:
+            if channel_id in self.busy:
+                return False
+            self.busy.add(channel_id)
+
+        # Blocks while the pool is at its in-flight limit.
+        self.slots.acquire()
+
+        index = zlib.crc32(channel_id.encode('utf-8')) % len(self.queues)
+        self.queues[index].put((channel_id, func, args, kwargs))
+        return True
+
+    # =============================================================================
+    def is_busy(self, channel_id):
+        """
+        Return True if a job for channel_id is queued or running
+
+        -----
+
+        :param channel_id:
+        :return bool:
+        """
+
+        with self.lock:
+            return str(channel_id) in self.busy
+
+    # =============================================================================
+    def resized(self, workers, max_in_flight):
+        """
+        Return a new pool of a different size that carries on from this one
+
+        The new pool shares this pool's busy set, so a channel whose job is
+        still queued or running here isn't accepted there until the job is
+        done (two drains of one channel would post the same samples). Stop
+        this pool afterwards; its queued jobs still run.
+
+        -----
+
+        :param int workers:
+        :param int max_in_flight:
+        :return ChannelWorkerPool:
+        """
+
+        pool = ChannelWorkerPool(self.plugin, workers, max_in_flight)
+
+        with self.lock:
+            pool.lock = self.lock
+            pool.busy = self.busy
+
+        return pool
+
+    # =============================================================================
+    def stop(self, timeout=5):
+        """
+        Stop the workers once they have finished their queued jobs
+
+        -----
+
+        :param float timeout: seconds to wait for each worker
+        """
+
+        for work_queue in self.queues:
+            work_queue.put(None)
+
+        for thread in self.threads:
+            thread.join(timeout)
+
+    # =============================================================================
+    def _run(self, work_queue):
+
+        while True:
+            job = work_queue.get()
+
+            if job is None:
+                return
+
+            channel_id, func, args, kwargs = job
+
+            try:
+                func(*args, **kwargs)
+
+            except Exception:
+                self.plugin.Fogbert.pluginErrorHandler(traceback.format_exc())
+                self.plugin.logger.warning(u"Upload job for channel {0} failed.".format(channel_id))
+
+            finally:
+                with self.lock:
+                    self.busy.discard(channel_id)
+                self.slots.release()
+
+
+class StateWriter(object):
+    """
+    Single thread that applies Indigo writes in the order they were submitted
+    """
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.queue  = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="ThingspeakStateWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # =============================================================================
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue an Indigo write, e.g. submit(dev.updateStateOnServer, 'thingState', value=True)
+
+        -----
+
+        :param func: callable to run on the writer thread
+        """
+
+        self.queue.put((func, args, kwargs))
+
+    # =============================================================================
+    def flush(self):
+        """
+        Block until every write submitted so far has been applied
+
+        -----
+
+        """
+
+        self.queue.join()
+
+    # =============================================================================
+    def stop(self, timeout=5):
+        """
+        Apply any remaining writes and stop the writer thread
+
+        -----
+
+        :param float timeout: seconds to wait for the writer
+        """
+
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    # =============================================================================
+    def _run(self):
+
+        while True:
+            job = self.queue.get()
+
+            try:
+                if job is None:
+                    return
+
+                func, args, kwargs = job
+
+                # Indigo's write calls (updateStatesOnServer() and friends) are timed; the
+                # rest (e.g., rescheduling a device) just ride along to keep their order.
+                if getattr(func, '__name__', '').endswith('OnServer'):
+                    with self.plugin.metrics.timer(metrics.STATE_WRITE):
+                        func(*args, **kwargs)
+                else:
+                    func(*args, **kwargs)
+
+            except Exception:
+                self.plugin.Fogbert.pluginErrorHandler(traceback.format_exc())
+                self.plugin.logger.warning(u"Unable to update Indigo device.")
+
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: benchmark.py
+:author: DaveL17
+
+Upload cycle benchmark for the Thingspeak Plugin
+
+Runs the plugin (through tools/harness.py) against the stub Thingspeak
+server with synthetic fleets of plugin devices, each uploading eight fields
+from its own source device, and reports for each fleet:
+
+    cycles_per_sec        upload cycles (every device uploaded once) per second
+    latency_ms            p50 / p95 / p99 of the upload requests, in ms
+    http_calls_per_cycle  requests the stub received per cycle
+    ipc_calls_per_cycle   calls that would have gone to the Indigo server per cycle
+    cpu_seconds           CPU time used by the measured cycles
+    peak_rss_kb           peak resident memory of the run
+
+Each fleet runs in its own process so that memory and CPU figures don't
+bleed into each other; the stub runs in that process too, so CPU time
+includes serving the requests. By default each cycle is an Upload Now pass
+through encodeValueDicts(); with --scheduled, the plugin's own
+runConcurrentThread() drives the uploads for --duration seconds instead.
+Results are written as JSON so that runs can be compared between versions:
+
+    python tools/benchmark.py --fleets 1,50,500 --latency 0.02 --out new.json
+    python tools/benchmark.py --compare old.json new.json
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import argparse
+import json
+import logging
+import os
+import platform
+import plistlib
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time as t
+from timeit import default_timer as timer
+
+# =============================================================================
+
+HERE          = os.path.dirname(os.path.abspath(__file__))
+INFO_PLIST    = os.path.join(os.path.dirname(HERE), 'thingspeak.indigoPlugin', 'Contents', 'Info.plist')
+FLEETS        = (1, 50, 500, 5000)
+FIELDS        = 8
+LOWER_BETTER  = ('latency_ms.p50', 'latency_ms.p95', 'latency_ms.p99', 'http_calls_per_cycle',
+                 'ipc_calls_per_cycle', 'cpu_seconds', 'peak_rss_kb')
+HIGHER_BETTER = ('cycles_per_sec',)
+
+
+def percentile(values, pct):
+    """
+    Return the pct percentile of values (nearest rank)
+
+    -----
+
+    :param list values:
+    :param float pct: 0 to 100
+    :return float:
+    """
+
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank    = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+
+    return ordered[rank]
+
+
+def plugin_version():
+    """
+    Return the PluginVersion from Info.plist
+
+    -----
+
+    :return str:
+    """
+
+    try:
+        with open(INFO_PLIST, 'rb') as plist:
+            info = plistlib.load(plist) if hasattr(plistlib, 'load') else plistlib.readPlist(plist)
+        return info.get('PluginVersion', u"unknown")
+    except (IOError, OSError, ValueError):
+        return u"unknown"
+
+
+def peak_rss_kb():
+    """
+    Return the peak resident set size of this process in KB
+
+    -----
+
+    :return int:
+    """
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports KB, macOS reports bytes.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def cpu_seconds():
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_fleet(devices, cycles, latency, workers, scheduled=False, duration=60, log_level=logging.CRITICAL):
+    """
+    Benchmark one fleet in this process
+
+    -----
+
+    :param int devices: number of plugin devices
+    :param int cycles: measured cycles (manual mode)
+    :param float latency: seconds the stub adds to every response
+    :param int workers: upload threads
+    :param bool scheduled: let runConcurrentThread drive the uploads
+    :param float duration: seconds to run in scheduled mode
+    :param int log_level: plugin log level
+    :return dict:
+    """
+
+    from harness import Harness
+    from thingspeak_stub import StubThingspeak
+
+    stub  = StubThingspeak(latency=latency)
+    prefs = {'uploadWorkers': str(workers), 'uploadMaxInFlight': str(max(16, workers * 4))}
+
+    with Harness(stub=stub, prefs=prefs, log_level=log_level) as h:
+        sources = []
+
+        for n in range(devices):
+            states  = dict(('value{0}'.format(f), float(f)) for f in range(1, FIELDS + 1))
+            source  = h.add_source(u"Source {0}".format(n), states)
+            channel = stub.add_channel(u"Channel {0}".format(n), [u"Field {0}".format(f) for f in range(1, FIELDS + 1)])
+            h.add_channel_device(channel, [(source, 'value{0}'.format(f)) for f in range(1, FIELDS + 1)])
+            sources.append(source)
+
+        setup_started = timer()
+        h.start(run=False)
+
+        # Wrap the transport so that every upload request is timed.
+        latencies = []
+        request   = h.plugin.transport.request
+
+        def timed_request(request_type, host, url, *args, **kwargs):
+            started = timer()
+            try:
+                return request(request_type, host, url, *args, **kwargs)
+            finally:
+                if 'update' in url:
+                    latencies.append(timer() - started)
+
+        h.plugin.transport.request = timed_request
+
+        # Warm up: the first cycle also fetches the channel list and builds the plans.
+        h.upload_all()
+        setup_seconds = timer() - setup_started
+
+        del latencies[:]
+        stub.reset_requests()
+        h.indigo.CALLS.clear()
+        uploads_before = stub.count('update')
+        cpu_started    = cpu_seconds()
+        started        = timer()
+
+        if scheduled:
+            # Every device is due now; after that the plugin keeps its own schedule.
+            for dev in h.indigo.devices.iter('self'):
+                h.plugin.scheduler.schedule(dev.id, t.time())
+
+            thread = threading.Thread(target=h.plugin.runConcurrentThread, name="ThingspeakBenchmark")
+            thread.daemon = True
+            thread.start()
+
+            deadline = started + duration
+
+            while timer() < deadline:
+                for n, source in enumerate(sources):
+                    h.indigo.set_state(source.id, 'value1', float(n) + timer())
+                t.sleep(1)
+
+            h.plugin.stopConcurrentThread()
+            thread.join(10)
+            h.wait_idle()
+            measured = float(stub.count('update') - uploads_before) / max(1, devices)
+
+        else:
+            for cycle in range(cycles):
+                for n, source in enumerate(sources):
+                    h.indigo.set_state(source.id, 'value1', float(cycle * devices + n))
+                h.upload_all()
+            measured = float(cycles)
+
+        wall = timer() - started
+        cpu  = cpu_seconds() - cpu_started
+
+        result = {'devices':              devices,
+                  'fields':               FIELDS,
+                  'mode':                 'scheduled' if scheduled else 'manual',
+                  'cycles':               round(measured, 2),
+                  'wall_seconds':         round(wall, 3),
+                  'setup_seconds':        round(setup_seconds, 3),
+                  'cycles_per_sec':       round(measured / wall, 4) if wall else None,
+                  'latency_ms':           dict((name, round(percentile(latencies, pct) * 1000, 2) if latencies else None)
+                                               for name, pct in (('p50', 50), ('p95', 95), ('p99', 99))),
+                  'http_calls_per_cycle': round(len(stub.requests) / measured, 2) if measured else None,
+                  'ipc_calls_per_cycle':  round(h.indigo.ipc_calls() / measured, 2) if measured else None,
+                  'cpu_seconds':          round(cpu, 3),
+                  'peak_rss_kb':          peak_rss_kb(),
+                  }
+
+    return result
+
+
+def run_all(args):
+    """
+    Run each fleet in a child process and collect the results
+
+    -----
+
+    :param args: parsed command line
+    :return dict:
+    """
+
+    results = []
+
+    for devices in args.fleets:
+        handle, result_file = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+
+        command = [sys.executable, os.path.abspath(__file__), '--child', str(devices), '--result-file', result_file,
+                   '--cycles', str(args.cycles), '--latency', str(args.latency), '--workers', str(args.workers),
+                   '--duration', str(args.duration)]
+
+        if args.scheduled:
+            command.append('--scheduled')
+
+        if args.verbose:
+            command.append('--verbose')
+
+        sys.stderr.write(u"{0} devices...\n".format(devices))
+
+        try:
+            subprocess.check_call(command, cwd=HERE)
+
+            with open(result_file) as result:
+                results.append(json.load(result))
+
+        except (subprocess.CalledProcessError, ValueError) as sub_error:
+            results.append({'devices': devices, 'error': u"{0}".format(sub_error)})
+
+        finally:
+            os.remove(result_file)
+
+    return {'plugin_version': plugin_version(),
+            'python':         platform.python_version(),
+            'platform':       platform.platform(),
+            'timestamp':      t.strftime('%Y-%m-%dT%H:%M:%SZ', t.gmtime()),
+            'settings':       {'fleets':    args.fleets,
+                               'cycles':    args.cycles,
+                               'latency':   args.latency,
+                               'workers':   args.workers,
+                               'scheduled': args.scheduled,
+                               'duration':  args.duration,
+                               },
+            'results':        results,
+            }
+
+
+def metric(result, name):
+
+    value = result
+
+    for part in name.split('.'):
+        value = (value or {}).get(part)
+
+    return value
+
+
+def compare(old_file, new_file):
+    """
+    Print the change in each metric between two result files
+
+    -----
+
+    :param str old_file:
+    :param str new_file:
+    """
+
+    with open(old_file) as old_json:
+        old = json.load(old_json)
+
+    with open(new_file) as new_json:
+        new = json.load(new_json)
+
+    print(u"{0} ({1}) -> {2} ({3})".format(old_file, old.get('plugin_version'), new_file, new.get('plugin_version')))
+
+    old_results = dict((result['devices'], result) for result in old['results'])
+
+    for result in new['results']:
+        before = old_results.get(result['devices'])
+
+        if before is None:
+            continue
+
+        print(u"\n{0} devices".format(result['devices']))
+
+        for name in HIGHER_BETTER + LOWER_BETTER:
+            a, b = metric(before, name), metric(result, name)
+
+            if a is None or b is None:
+                continue
+
+            change = (float(b) - a) / a * 100 if a else 0.0
+            better = change > 0 if name in HIGHER_BETTER else change < 0
+            print(u"  {0:<22}{1:>12}{2:>12}{3:>+9.1f}%  {4}".format(name, a, b, change,
+                                                                  u"" if abs(change) < 5 else
+                                                                  (u"better" if better else u"WORSE")))
+
+
+def report(run):
+
+    print(u"Thingspeak Plugin {0}, Python {1}".format(run['plugin_version'], run['python']))
+    print(u"{0:>8}{1:>11}{2:>9}{3:>9}{4:>9}{5:>8}{6:>8}{7:>9}{8:>11}".format(
+        u"devices", u"cycles/s", u"p50 ms", u"p95 ms", u"p99 ms", u"http", u"ipc", u"cpu s", u"rss KB"))
+
+    for result in run['results']:
+        if 'error' in result:
+            print(u"{0:>8}  {1}".format(result['devices'], result['error']))
+            continue
+
+        latency = result['latency_ms']
+        print(u"{0:>8}{1:>11}{2:>9}{3:>9}{4:>9}{5:>8}{6:>8}{7:>9}{8:>11}".format(
+            result['devices'], result['cycles_per_sec'], latency['p50'], latency['p95'], latency['p99'],
+            result['http_calls_per_cycle'], result['ipc_calls_per_cycle'], result['cpu_seconds'],
+            result['peak_rss_kb']))
+
+
+# =============================================================================
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=u"Benchmark the Thingspeak Plugin upload cycle.")
+    parser.add_argument('--fleets', type=lambda value: [int(n) for n in value.split(',')], default=list(FLEETS),
+                        help=u"comma separated fleet sizes (default 1,50,500,5000)")
+    parser.add_argument('--cycles', type=int, default=3, help=u"measured cycles per fleet")
+    parser.add_argument('--latency', type=float, default=0.01, help=u"seconds the stub adds to every response")
+    parser.add_argument('--workers', type=int, default=4, help=u"upload threads")
+    parser.add_argument('--scheduled', action='store_true', help=u"let runConcurrentThread drive the uploads")
+    parser.add_argument('--duration', type=float, default=60, help=u"seconds to run in scheduled mode")
+    parser.add_argument('--verbose', action='store_true', help=u"show the plugin's debug log")
+    parser.add_argument('--out', help=u"write the results to this JSON file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help=u"compare two result files")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+
+    elif args.child is not None:
+        fleet_result = run_fleet(args.child, args.cycles, args.latency, args.workers, args.scheduled, args.duration,
+                                 logging.DEBUG if args.verbose else logging.CRITICAL)
+
+        with open(args.result_file, 'w') as result_json:
+            json.dump(fleet_result, result_json)
+
+    else:
+        benchmark = run_all(args)
+        report(benchmark)
+
+        if args.out:
+            with open(args.out, 'w') as out:
+                json.dump(benchmark, out, indent=2, sort_keys=True)
@@ -0,0 +1,341 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: indigo.py
+:author: DaveL17
+
+Fake indigo module for running the Thingspeak Plugin headless
+
+This is just enough of Indigo's plugin API for the plugin to load, start its
+devices and upload on a machine without an Indigo server (e.g., Linux). Put
+this directory at the front of sys.path before importing plugin.py; the
+harness in tools/harness.py does that for you.
+
+Devices and variables are plain objects kept in indigo.devices and
+indigo.variables. Change their values with set_state() and set_variable() so
+that the plugin gets the deviceUpdated / variableUpdated calls the Indigo
+server would make. Every call that would be a round trip to the Indigo
+server is counted in CALLS, which is what the performance work measures.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import copy
+import logging
+import shutil
+import tempfile
+import threading
+import time as t
+
+# =============================================================================
+
+CALLS = {}  # Method name -> number of calls that would go to the Indigo server.
+
+_lock       = threading.Lock()
+_plugin     = [None]  # The running PluginBase instance.
+_subscribed = {'devices': False, 'variables': False}
+
+
+def _count(name):
+
+    with _lock:
+        CALLS[name] = CALLS.get(name, 0) + 1
+
+
+def ipc_calls():
+    """
+    Return the total number of calls that would have gone to the Indigo server
+
+    -----
+
+    :return int:
+    """
+
+    return sum(CALLS.values())
+
+
+def reset():
+    """
+    Forget every device, variable, logged line and counted call
+
+    -----
+
+    """
+
+    devices.clear()
+    variables.clear()
+    CALLS.clear()
+    del server.log_lines[:]
+    _plugin[0] = None
+    _subscribed['devices']   = False
+    _subscribed['variables'] = False
+
+
+class Dict(dict):
+    """
+    Stand-in for indigo.Dict
+    """
+
+
+class List(list):
+    """
+    Stand-in for indigo.List
+    """
+
+
+class kStateImageSel(object):
+    Auto          = u"Auto"
+    NoImage       = u"NoImage"
+    SensorOff     = u"SensorOff"
+    SensorOn      = u"SensorOn"
+    SensorTripped = u"SensorTripped"
+
+
+class _Server(object):
+
+    version    = u"7.4.0"
+    apiVersion = u"2.0"
+
+    def __init__(self):
+        self.install_folder = None
+        self.log_lines      = []
+
+    def log(self, message, type=None, isError=False, level=logging.INFO):
+        self.log_lines.append(message)
+        logging.getLogger("Indigo").log(logging.ERROR if isError else level, message)
+
+    def getInstallFolderPath(self):
+        # A scratch folder stands in for /Library/Application Support/Perceptive Automation/Indigo 7.x.
+        if self.install_folder is None:
+            self.install_folder = tempfile.mkdtemp(prefix="indigo-")
+        return self.install_folder
+
+    def remove_install_folder(self):
+        if self.install_folder is not None:
+            shutil.rmtree(self.install_folder, ignore_errors=True)
+            self.install_folder = None
+
+
+server = _Server()
+
+
+class Device(object):
+    """
+    Stand-in for indigo.Device
+    """
+
+    def __init__(self, id, name, states=None, pluginProps=None, deviceTypeId=u"", pluginId=u"", address=u"",
+                 enabled=True, configured=True):
+        self.id           = id
+        self.name         = name
+        self.states       = Dict(states or {})
+        self.pluginProps  = Dict(pluginProps or {})
+        self.deviceTypeId = deviceTypeId
+        self.pluginId     = pluginId
+        self.address      = address
+        self.enabled      = enabled
+        self.configured   = configured
+
+    def updateStateOnServer(self, key, value=None, uiValue=None, decimalPlaces=None, clearErrorState=True):
+        _count('updateStateOnServer')
+        self.states[key] = value
+
+    def updateStatesOnServer(self, key_value_list, clearErrorState=True):
+        _count('updateStatesOnServer')
+        for item in key_value_list:
+            self.states[item['key']] = item['value']
+
+    def updateStateImageOnServer(self, image):
+        _count('updateStateImageOnServer')
+
+    def replacePluginPropsOnServer(self, props):
+        _count('replacePluginPropsOnServer')
+        self.pluginProps = Dict(props)
+
+    def stateListOrDisplayStateIdChanged(self):
+        _count('stateListOrDisplayStateIdChanged')
+
+    def refreshFromServer(self):
+        _count('refreshFromServer')
+
+
+class Variable(object):
+    """
+    Stand-in for indigo.Variable
+    """
+
+    def __init__(self, id, name, value=u""):
+        self.id    = id
+        self.name  = name
+        self.value = value
+
+
+class _Collection(dict):
+    """
+    Stand-in for indigo.devices / indigo.variables, keyed by id (names work too)
+    """
+
+    def __init__(self, kind):
+        dict.__init__(self)
+        self.kind = kind
+
+    def __getitem__(self, key):
+        _count('{0}[]'.format(self.kind))
+
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+
+        for item in dict.values(self):
+            if item.name == key:
+                return item
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(list(dict.values(self)))
+
+    def iter(self, filter=u""):
+        _count('{0}.iter'.format(self.kind))
+
+        for item in list(dict.values(self)):
+            if filter == u"self" and getattr(item, 'pluginId', None) != getattr(_plugin[0], 'pluginId', None):
+                continue
+            yield item
+
+    itervalues = iter
+
+    def add(self, item):
+        self[item.id] = item
+        return item
+
+    def subscribeToChanges(self):
+        _subscribed[self.kind] = True
+
+
+devices   = _Collection('devices')
+variables = _Collection('variables')
+
+
+def set_state(dev_id, key, value):
+    """
+    Change a device state the way the Indigo server would
+
+    -----
+
+    :param int dev_id:
+    :param str key:
+    :param value:
+    """
+
+    dev      = dict.__getitem__(devices, dev_id)
+    orig_dev = copy.copy(dev)
+    orig_dev.states = Dict(dev.states)
+    dev.states[key] = value
+
+    if _plugin[0] is not None and (_subscribed['devices'] or dev.pluginId == _plugin[0].pluginId):
+        _plugin[0].deviceUpdated(orig_dev, dev)
+
+
+def set_variable(var_id, value):
+    """
+    Change a variable value the way the Indigo server would
+
+    -----
+
+    :param int var_id:
+    :param value:
+    """
+
+    var      = dict.__getitem__(variables, var_id)
+    orig_var = copy.copy(var)
+    var.value = value
+
+    if _plugin[0] is not None and _subscribed['variables']:
+        _plugin[0].variableUpdated(orig_var, var)
+
+
+class _DeviceCommands(object):
+
+    def enable(self, dev, value=True):
+        _count('device.enable')
+        dev = dev if isinstance(dev, Device) else devices[dev]
+        dev.enabled = value
+
+
+device = _DeviceCommands()
+
+
+class PluginBase(object):
+    """
+    Stand-in for indigo.PluginBase
+    """
+
+    class StopThread(Exception):
+        pass
+
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId          = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion     = pluginVersion
+        self.pluginPrefs       = Dict(pluginPrefs)
+        self.stopThread        = False
+        self.debug             = False
+
+        self.logger = logging.getLogger("Plugin")
+
+        # One plugin at a time; drop the handlers of the previous one.
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+        self.logger.setLevel(logging.DEBUG)
+        self.indigo_log_handler  = logging.StreamHandler()
+        self.plugin_file_handler = logging.NullHandler() if hasattr(logging, 'NullHandler') else logging.StreamHandler()
+        self.logger.addHandler(self.indigo_log_handler)
+
+        _plugin[0] = self
+
+    def __del__(self):
+        pass
+
+    def debugLog(self, message):
+        self.logger.debug(message)
+
+    def errorLog(self, message):
+        self.logger.error(message)
+
+    def savePluginPrefs(self):
+        pass
+
+    def sleep(self, seconds):
+        if self.stopThread:
+            raise self.StopThread
+        t.sleep(seconds)
+
+    def stopConcurrentThread(self):
+        self.stopThread = True
+
+    def stopPlugin(self, message="", isError=True):
+        self.stopThread = True
+
+    def versStrToTuple(self, version):
+        return tuple(int(part) for part in version.split('.'))
+
+    def deviceCreated(self, dev):
+        pass
+
+    def deviceDeleted(self, dev):
+        pass
+
+    def deviceUpdated(self, orig_dev, new_dev):
+        pass
+
+    def variableCreated(self, var):
+        pass
+
+    def variableDeleted(self, var):
+        pass
+
+    def variableUpdated(self, orig_var, new_var):
+        pass
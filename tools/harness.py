@@ -0,0 +1,308 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: harness.py
+:author: DaveL17
+
+Offline harness for the Thingspeak Plugin
+
+The Harness class runs the real plugin.py against the fake indigo module in
+tools/fake_indigo and a StubThingspeak server, so that uploads, the channel
+menu tools and failure handling can be exercised (and timed) without an
+Indigo server or a Thingspeak account:
+
+    with Harness() as h:
+        sensor  = h.add_source(u"Sensor", {'temperature': 21.5})
+        channel = h.stub.add_channel(u"Office", [u"Temperature"])
+        h.add_channel_device(channel, [(sensor, 'temperature')])
+        h.start()
+        h.upload_all()
+        print(h.stub.count('/update'))
+
+The plugin is pointed at the stub as a local Thingspeak server (over plain
+HTTP). Run this file to do a short end-to-end check; test_integration.py
+holds the tests built on it.
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import logging
+import os
+import sys
+import threading
+import time as t
+
+# My modules
+from thingspeak_stub import StubThingspeak
+
+# =============================================================================
+
+HERE        = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR  = os.path.join(os.path.dirname(HERE), 'thingspeak.indigoPlugin', 'Contents', 'Server Plugin')
+FAKE_INDIGO = os.path.join(HERE, 'fake_indigo')
+PLUGIN_ID   = u"com.fogbert.indigoplugin.thingspeak"
+
+
+def load_plugin():
+    """
+    Import plugin.py against the fake indigo module
+
+    -----
+
+    :return module: the plugin module
+    """
+
+    for path in (PLUGIN_DIR, FAKE_INDIGO):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    import indigo
+    import transport
+
+    # The stub speaks plain HTTP.
+    transport.SCHEME = "http"
+
+    import plugin
+    return plugin
+
+
+class Harness(object):
+    """
+    The plugin, a stub Thingspeak server and a fake Indigo database
+    """
+
+    def __init__(self, stub=None, prefs=None, log_level=logging.WARNING):
+        self.module = load_plugin()
+
+        import indigo
+        self.indigo = indigo
+        indigo.reset()
+
+        # The plugin module reads the install folder once, at import; give each harness
+        # its own so that upload queues and history don't carry over from the last one.
+        self.module.install_path = indigo.server.getInstallFolderPath()
+
+        self.stub    = stub or StubThingspeak()
+        self.prefs   = dict(self.module.kDefaultPluginPrefs)
+        self.plugin  = None
+        self.thread  = None
+        self.next_id = 1
+
+        if self.stub.server is None:
+            self.stub.start()
+
+        self.prefs.update({'apiKey':         self.stub.api_key,
+                           'devicePort':     True,
+                           'deviceIP':       self.stub.host,
+                           'showDebugLevel': log_level,
+                           })
+        self.prefs.update(prefs or {})
+
+        logging.getLogger("Plugin").setLevel(log_level)
+        logging.getLogger("Indigo").setLevel(log_level)
+
+    # =============================================================================
+    def __enter__(self):
+        return self
+
+    # =============================================================================
+    def __exit__(self, *exc):
+        self.stop()
+
+    # =============================================================================
+    def _id(self):
+
+        self.next_id += 1
+        return self.next_id
+
+    # =============================================================================
+    def add_variable(self, name, value=u""):
+        """
+        Add an Indigo variable
+
+        -----
+
+        :param str name:
+        :param value:
+        :return indigo.Variable:
+        """
+
+        return self.indigo.variables.add(self.indigo.Variable(self._id(), name, value))
+
+    # =============================================================================
+    def add_source(self, name, states):
+        """
+        Add an (other plugin's) Indigo device whose states can be uploaded
+
+        -----
+
+        :param str name:
+        :param dict states:
+        :return indigo.Device:
+        """
+
+        return self.indigo.devices.add(self.indigo.Device(self._id(), name, states=states))
+
+    # =============================================================================
+    def add_channel_device(self, channel, things, name=None, **props):
+        """
+        Add a Thingspeak device for a stub channel
+
+        -----
+
+        :param dict channel: a channel from StubThingspeak.add_channel()
+        :param list things: [(indigo.Device, state) or (indigo.Variable, 'value'), ...] for field1, field2, ...
+        :param str name:
+        :param props: other device props (devUploadInterval, uploadMode, changeOnly, ...)
+        :return indigo.Device:
+        """
+
+        plugin_props = {'channelList': str(channel['id']), 'devUploadInterval': '15', 'tweet': u""}
+
+        for n in range(1, 9):
+            plugin_props['thing{0}'.format(n)]      = "None"
+            plugin_props['thing{0}State'.format(n)] = "None"
+
+        for n, (source, state) in enumerate(things, 1):
+            plugin_props['thing{0}'.format(n)]      = str(source.id)
+            plugin_props['thing{0}State'.format(n)] = state
+
+        plugin_props.update(props)
+
+        dev = self.indigo.Device(self._id(), name or channel['name'], states={'created_at': u""},
+                                 pluginProps=plugin_props, deviceTypeId='thingspeak', pluginId=PLUGIN_ID)
+
+        self.indigo.devices.add(dev)
+
+        if self.plugin is not None:
+            self.plugin.deviceStartComm(dev)
+
+        return dev
+
+    # =============================================================================
+    def start(self, run=False):
+        """
+        Create and start the plugin, then start its devices
+
+        -----
+
+        :param bool run: also run the plugin's concurrent thread
+        :return Plugin:
+        """
+
+        self.plugin = self.module.Plugin(PLUGIN_ID, u"Thingspeak", u"1.3.00", self.prefs)
+        self.plugin.startup()
+
+        for dev in list(self.indigo.devices.iter('self')):
+            self.plugin.deviceStartComm(dev)
+
+        if run:
+            self.thread = threading.Thread(target=self.plugin.runConcurrentThread, name="ThingspeakHarness")
+            self.thread.daemon = True
+            self.thread.start()
+
+        return self.plugin
+
+    # =============================================================================
+    def upload_all(self, wait=True):
+        """
+        Upload every device now (as the Upload Data Now menu item does)
+
+        The pass runs on the calling thread, the way the plugin's concurrent
+        thread runs it once the menu item wakes it. Don't use this after
+        start(run=True); call plugin.updateThingspeakDataMenu() instead.
+
+        -----
+
+        :param bool wait: wait for the uploads to finish
+        """
+
+        self.plugin.uploadNow = True
+        self.plugin.encodeValueDicts()
+
+        if wait:
+            self.wait_idle()
+
+    # =============================================================================
+    def upload_due(self, wait=True):
+        """
+        Run one scheduler pass: upload the devices that are due
+
+        -----
+
+        :param bool wait: wait for the uploads to finish
+        """
+
+        self.plugin.encodeValueDicts()
+
+        if wait:
+            self.wait_idle()
+
+    # =============================================================================
+    def wait_idle(self, timeout=30):
+        """
+        Wait for the upload workers to finish and their state writes to land
+
+        -----
+
+        :param float timeout: seconds
+        :return bool: False if the workers were still busy at the timeout
+        """
+
+        deadline = t.time() + timeout
+
+        while self.plugin.uploadPool.busy and t.time() < deadline:
+            t.sleep(0.01)
+
+        self.plugin.stateWriter.flush()
+
+        return not self.plugin.uploadPool.busy
+
+    # =============================================================================
+    def stop(self):
+        """
+        Shut down the plugin and the stub and forget the fake Indigo database
+
+        -----
+
+        """
+
+        if self.plugin is not None:
+            self.plugin.stopConcurrentThread()
+
+            if self.thread is not None:
+                self.thread.join(5)
+
+            self.plugin.shutdown()
+            self.plugin = None
+
+        self.stub.stop()
+        self.indigo.server.remove_install_folder()
+        self.indigo.reset()
+
+
+# =============================================================================
+if __name__ == '__main__':
+
+    with Harness() as h:
+        temperature = h.add_source(u"Office Sensor", {'temperature': 21.5, 'onOffState': True})
+        setpoint    = h.add_variable(u"setpoint", u"72.5 °F")
+
+        for n in range(3):
+            channel = h.stub.add_channel(u"Channel {0}".format(n), [u"Temperature", u"Occupied", u"Setpoint"])
+            h.add_channel_device(channel, [(temperature, 'temperature'), (temperature, 'onOffState'),
+                                           (setpoint, 'value')])
+
+        started = t.time()
+        h.start()
+        h.upload_all()
+        elapsed = t.time() - started
+
+        print(u"Uploaded {0} channels in {1:.2f} seconds.".format(h.stub.count('/update'), elapsed))
+        print(u"Thingspeak requests: {0}".format(len(h.stub.requests)))
+        print(u"Indigo server calls: {0}".format(h.indigo.ipc_calls()))
+
+        for channel_id in sorted(h.stub.feeds):
+            print(u"  {0}: {1}".format(channel_id, h.stub.feeds[channel_id][-1]))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_aggregate.py
+:author: DaveL17
+
+Unit tests for aggregate.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import aggregate
+
+# =============================================================================
+
+
+class AccumulatorTest(unittest.TestCase):
+
+    def window(self, mode, values, start=None):
+
+        # values arrive at 0, 10, 20, ... seconds.
+        acc = aggregate.Accumulator(mode, 0, start)
+
+        for n, value in enumerate(values):
+            acc.add(value, n * 10)
+
+        return acc
+
+    # =============================================================================
+    def test_simple_modes(self):
+
+        values = [3.0, 1.0, 4.0, 1.0, 5.0]
+
+        self.assertEqual(self.window(aggregate.LAST, values).result(50), 5.0)
+        self.assertEqual(self.window(aggregate.MEAN, values).result(50), 2.8)
+        self.assertEqual(self.window(aggregate.MIN, values).result(50), 1.0)
+        self.assertEqual(self.window(aggregate.MAX, values).result(50), 5.0)
+        self.assertEqual(self.window(aggregate.SUM, values).result(50), 14.0)
+        self.assertEqual(self.window(aggregate.COUNT, values).result(50), 5)
+
+    # =============================================================================
+    def test_time_weighted_mean(self):
+
+        # 10 held for 5 seconds, then 20 for 5 seconds.
+        acc = aggregate.Accumulator(aggregate.TW_MEAN, 0, 10.0)
+        acc.add(20.0, 5)
+
+        self.assertEqual(acc.result(10), 15.0)
+
+    # =============================================================================
+    def test_nothing_known(self):
+
+        acc = aggregate.Accumulator(aggregate.MEAN, 0)
+
+        self.assertEqual(acc.result(10), None)
+        self.assertEqual(aggregate.Accumulator(aggregate.COUNT, 0).result(10), 0)
+
+    # =============================================================================
+    def test_reset_carries_value_forward(self):
+
+        acc = self.window(aggregate.MEAN, [2.0, 4.0])
+        acc.reset(20)
+
+        # A quiet window reports the value still in effect.
+        self.assertEqual(acc.result(30), 4.0)
+
+        acc.add(8.0, 30)
+        self.assertEqual(acc.result(40), 6.0)
+
+    # =============================================================================
+    def test_quiet_window_min_max(self):
+
+        acc = self.window(aggregate.MIN, [5.0, 2.0])
+        acc.reset(20)
+
+        self.assertEqual(acc.result(30), 2.0)
+
+    # =============================================================================
+    def test_unknown_mode_is_last(self):
+
+        self.assertEqual(self.window(u'median', [1.0, 9.0]).result(20), 9.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
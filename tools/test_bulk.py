@@ -0,0 +1,76 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_bulk.py
+:author: DaveL17
+
+Unit tests for bulk.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import bulk
+
+# =============================================================================
+
+
+def rows(count, size=1):
+
+    return [(n, {'created_at': u"2026-10-18 10:00:00 +0000", 'field1': u"x" * size, 'key': u"secret"})
+            for n in range(count)]
+
+
+class BulkTest(unittest.TestCase):
+
+    def test_bulk_entry_drops_other_keys(self):
+
+        entry = bulk.bulk_entry({'created_at': u"now", 'field1': 1.0, 'key': u"secret", 'twitter': u""})
+
+        self.assertEqual(entry, {'created_at': u"now", 'field1': 1.0})
+
+    # =============================================================================
+    def test_split_by_entries(self):
+
+        chunks = bulk.split(rows(2000))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [960, 960, 80])
+        self.assertEqual([row_id for chunk in chunks for row_id, _ in chunk], list(range(2000)))
+
+    # =============================================================================
+    def test_split_by_bytes(self):
+
+        chunks = bulk.split(rows(100, size=2000), max_bytes=20000)
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 100)
+
+        for chunk in chunks:
+            body = json.dumps({'write_api_key': u"W" * 16, 'updates': [bulk.bulk_entry(entry) for _, entry in chunk]})
+            self.assertTrue(len(body) <= 20000)
+
+    # =============================================================================
+    def test_oversized_entry_goes_alone(self):
+
+        chunks = bulk.split(rows(3, size=500), max_bytes=100)
+
+        self.assertEqual([len(chunk) for chunk in chunks], [1, 1, 1])
+
+    # =============================================================================
+    def test_nothing_to_split(self):
+
+        self.assertEqual(bulk.split([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
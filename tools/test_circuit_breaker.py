@@ -0,0 +1,176 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_circuit_breaker.py
+:author: DaveL17
+
+Unit tests for circuit_breaker.py and the transport's half-open probe
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# Third-party modules
+import requests
+
+# My modules
+import circuit_breaker
+import transport
+
+# =============================================================================
+
+
+class FakePlugin(object):
+
+    logger = logging.getLogger("Plugin.test")
+
+
+class FakeSession(object):
+    """
+    Session whose head() raises the given exception (or answers when there isn't one)
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def head(self, url, timeout=None):
+        if self.error is not None:
+            raise self.error
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = []
+        self.breaker = circuit_breaker.CircuitBreaker(u"host", on_change=lambda b: self.changes.append(b.state))
+
+    # =============================================================================
+    def trip(self):
+
+        for _ in range(self.breaker.threshold):
+            self.breaker.record_failure()
+
+    # =============================================================================
+    def test_opens_after_threshold(self):
+
+        for _ in range(self.breaker.threshold - 1):
+            self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.before_request(), circuit_breaker.CLOSED)
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertRaises(circuit_breaker.CircuitOpenError, self.breaker.before_request)
+        self.assertEqual(self.changes, [circuit_breaker.OPEN])
+
+    # =============================================================================
+    def test_success_resets_count(self):
+
+        for _ in range(self.breaker.threshold - 1):
+            self.breaker.record_failure()
+
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    # =============================================================================
+    def test_one_probe_after_backoff(self):
+
+        self.trip()
+        self.breaker.retry_at = 0
+
+        self.assertEqual(self.breaker.before_request(), circuit_breaker.HALF_OPEN)
+        self.assertRaises(circuit_breaker.CircuitOpenError, self.breaker.before_request)
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        self.assertEqual(self.changes, [circuit_breaker.OPEN, circuit_breaker.HALF_OPEN, circuit_breaker.CLOSED])
+
+    # =============================================================================
+    def test_failed_probe_reopens_with_longer_delay(self):
+
+        self.trip()
+        self.breaker.retry_at = 0
+        self.breaker.before_request()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertEqual(self.breaker.opened, 2)
+
+    # =============================================================================
+    def test_backoff_is_bounded(self):
+
+        self.breaker.opened = 40
+
+        for _ in range(20):
+            delay = self.breaker.backoff()
+            self.assertTrue(self.breaker.max_delay / 2.0 <= delay <= self.breaker.max_delay)
+
+    # =============================================================================
+    def test_failing_on_change_doesnt_strand_probe(self):
+
+        def on_change(breaker):
+            if breaker.state == circuit_breaker.HALF_OPEN:
+                raise RuntimeError
+
+        self.breaker.on_change = on_change
+        self.trip()
+        self.breaker.retry_at = 0
+
+        self.assertRaises(RuntimeError, self.breaker.before_request)
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = transport.Transport(FakePlugin())
+        self.breaker   = self.transport.breaker(u"host")
+
+        for _ in range(self.breaker.threshold):
+            self.breaker.record_failure()
+
+        self.breaker.retry_at = 0
+        self.breaker.before_request()
+
+    # =============================================================================
+    def probe(self, error):
+
+        self.transport.probe(u"host", FakeSession(error), self.breaker)
+
+    # =============================================================================
+    def test_answer_closes_circuit(self):
+
+        self.probe(None)
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    # =============================================================================
+    def test_request_errors_reopen_circuit(self):
+
+        for error in (requests.exceptions.ConnectionError(), requests.exceptions.Timeout(),
+                      requests.exceptions.TooManyRedirects(), requests.exceptions.InvalidURL(),
+                      requests.exceptions.RequestException()):
+            self.assertRaises(circuit_breaker.CircuitOpenError, self.probe, error)
+            self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+            self.breaker.retry_at = 0
+            self.assertEqual(self.breaker.before_request(), circuit_breaker.HALF_OPEN)
+
+    # =============================================================================
+    def test_unexpected_error_reopens_circuit(self):
+
+        self.assertRaises(ValueError, self.probe, ValueError())
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
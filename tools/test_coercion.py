@@ -0,0 +1,98 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_coercion.py
+:author: DaveL17
+
+Unit tests for coercion.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import coercion
+
+# =============================================================================
+
+
+class CoerceTest(unittest.TestCase):
+
+    def check(self, cases):
+
+        for value, expected in cases:
+            self.assertEqual(coercion.coerce(value), expected, u"{0!r} -> {1!r}".format(value, expected))
+
+    # =============================================================================
+    def test_thousands_comma(self):
+
+        self.check([(u"1,234", 1234.0),
+                    (u"1,234 W", 1234.0),
+                    (u"12,345", 12345.0),
+                    (u"999,999", 999999.0),
+                    (u"-1,234", -1234.0),
+                    (u"1,234,567", 1234567.0),
+                    (u"1,000,000 lux", 1000000.0),
+                    (u"1,234e2", 123400.0),
+                    ])
+
+    # =============================================================================
+    def test_decimal_comma(self):
+
+        self.check([(u"-3,5", -3.5),
+                    (u"1,23", 1.23),
+                    (u"12,3456", 12.3456),
+                    (u"0,125", 0.125),
+                    (u"21,5 °C", 21.5),
+                    ])
+
+    # =============================================================================
+    def test_mixed_separators(self):
+
+        self.check([(u"1,234.5", 1234.5),
+                    (u"1.234,5", 1234.5),
+                    (u"1.234.567,89", 1234567.89),
+                    ])
+
+    # =============================================================================
+    def test_separators_that_dont_group(self):
+
+        self.check([(u"10.0.1", 10.0),
+                    (u"1,23,4", 1.23),
+                    ])
+
+    # =============================================================================
+    def test_numbers_and_words(self):
+
+        self.check([(True, 1.0),
+                    (False, 0.0),
+                    (7, 7.0),
+                    (u"72.5 °F", 72.5),
+                    (u"1.2e3 lux", 1200.0),
+                    (u"on", 1.0),
+                    (u"OFF", 0.0),
+                    (u"true", 1.0),
+                    (u"no number", None),
+                    (u"", None),
+                    (u"nan", None),
+                    (u"inf", None),
+                    (u"1e400", None),
+                    ])
+
+    # =============================================================================
+    def test_coerce_many_matches_coerce(self):
+
+        values = [True, 3, u"1,234 W", u"-3,5", u"off", u"none here", 2.5]
+        self.assertEqual(coercion.coerce_many(values), [coercion.coerce(value) for value in values])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_deadband.py
+:author: DaveL17
+
+Unit tests for deadband.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import deadband
+
+# =============================================================================
+
+
+class MovedTest(unittest.TestCase):
+
+    def test_any_change_without_band(self):
+
+        self.assertTrue(deadband.moved(1.0, 1.01))
+        self.assertFalse(deadband.moved(1.0, 1.0))
+
+    # =============================================================================
+    def test_absolute_band(self):
+
+        self.assertFalse(deadband.moved(20.0, 20.5, absolute=0.5))
+        self.assertTrue(deadband.moved(20.0, 20.6, absolute=0.5))
+        self.assertFalse(deadband.moved(20.0, 19.5, absolute=0.5))
+
+    # =============================================================================
+    def test_percent_band(self):
+
+        self.assertFalse(deadband.moved(200.0, 202.0, percent=1))
+        self.assertTrue(deadband.moved(200.0, 203.0, percent=1))
+        self.assertTrue(deadband.moved(-200.0, -197.0, percent=1))
+
+    # =============================================================================
+    def test_percent_band_from_zero(self):
+
+        # Any move away from 0 is beyond a percent band.
+        self.assertTrue(deadband.moved(0.0, 0.001, percent=50))
+
+    # =============================================================================
+    def test_both_bands_must_be_exceeded(self):
+
+        self.assertFalse(deadband.moved(100.0, 101.5, absolute=2, percent=1))
+        self.assertFalse(deadband.moved(100.0, 101.5, absolute=1, percent=2))
+        self.assertTrue(deadband.moved(100.0, 103.0, absolute=2, percent=2))
+
+    # =============================================================================
+    def test_values_that_arent_numbers(self):
+
+        self.assertTrue(deadband.moved(u"on", u"off"))
+        self.assertFalse(deadband.moved(u"on", u"on"))
+        self.assertTrue(deadband.moved(None, 1.0))
+
+
+class AnyMovedTest(unittest.TestCase):
+
+    def test_uses_each_fields_band(self):
+
+        bands = {'field1': (1.0, 0.0), 'field2': (0.0, 0.0)}
+
+        self.assertFalse(deadband.any_moved({'field1': 10, 'field2': 5}, {'field1': 10.5, 'field2': 5}, bands))
+        self.assertTrue(deadband.any_moved({'field1': 10, 'field2': 5}, {'field1': 10.5, 'field2': 6}, bands))
+
+    # =============================================================================
+    def test_field_added_or_removed(self):
+
+        self.assertTrue(deadband.any_moved({'field1': 1}, {'field1': 1, 'field2': 2}, {}))
+        self.assertTrue(deadband.any_moved({'field1': 1, 'field2': 2}, {'field1': 1}, {}))
+        self.assertFalse(deadband.any_moved({}, {}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_integration.py
+:author: DaveL17
+
+Offline integration tests for the Thingspeak Plugin
+
+Each test runs the real plugin against the fake Indigo module and a
+StubThingspeak server (see harness.py) and checks what reached the stub.
+Run them from the repository root with:
+
+    python -m unittest discover -s tools -p "test_*.py"
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time as t
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# My modules
+from harness import Harness
+from thingspeak_stub import DROP, timestamp
+
+# =============================================================================
+
+CREATED_AT = u"2026-10-18 10:00:{0:02d} +0000"
+
+
+class IntegrationTest(unittest.TestCase):
+    """
+    A harness with one sensor and one stub channel per test
+    """
+
+    def setUp(self):
+        self.h       = Harness(log_level=logging.CRITICAL)
+        self.sensor  = self.h.add_source(u"Sensor", {'value': 1.0})
+        self.channel = self.h.stub.add_channel(u"Office", [u"Value"])
+
+    # =============================================================================
+    def tearDown(self):
+        self.h.stop()
+
+    # =============================================================================
+    def device(self, **props):
+
+        return self.h.add_channel_device(self.channel, [(self.sensor, 'value')], **props)
+
+    # =============================================================================
+    def feed(self):
+
+        return self.h.stub.feeds.get(self.channel['id'], [])
+
+    # =============================================================================
+    def pending(self):
+
+        return self.plugin.uploadQueue.pending(str(self.channel['id']))
+
+    # =============================================================================
+    def queue(self, dev, count):
+
+        # Samples left behind, e.g., by an outage before the plugin restarted.
+        for n in range(count):
+            self.plugin.uploadQueue.put(dev.id, str(self.channel['id']),
+                                        {'field1': float(n), 'created_at': CREATED_AT.format(n % 60)})
+
+    # =============================================================================
+    def sample(self, value):
+
+        self.h.indigo.set_state(self.sensor.id, 'value', value)
+        self.h.upload_all()
+
+    # =============================================================================
+    def start(self):
+
+        self.plugin = self.h.start()
+        self.host   = self.plugin.accounts.get().host
+        return self.plugin
+
+
+class OutageTest(IntegrationTest):
+
+    def test_outage_opens_circuit_and_replays_backlog(self):
+
+        dev = self.device()
+        self.start()
+        breaker = self.plugin.transport.breaker(self.host)
+
+        # The connection drops until the circuit opens; the samples stay queued.
+        self.h.stub.inject(DROP, count=breaker.threshold)
+
+        for n in range(breaker.threshold):
+            self.sample(float(n))
+            self.plugin.retryAfter.clear()
+
+        self.assertEqual(breaker.state, u"open")
+        self.assertEqual(dev.states['circuitState'], u"open")
+        self.assertEqual(self.pending(), breaker.threshold)
+        self.assertEqual(self.feed(), [])
+
+        # While the circuit is open, new samples are queued but nothing is sent.
+        requests = len(self.h.stub.requests)
+        self.sample(10.0)
+        self.assertEqual(len(self.h.stub.requests), requests)
+        self.assertEqual(self.pending(), breaker.threshold + 1)
+
+        # Once the back-off has passed the host is probed and the backlog is replayed
+        # in one bulk update with the samples' original timestamps.
+        queued = [entry['created_at'][:19] for _, entry in self.plugin.uploadQueue.peek(str(self.channel['id']))]
+        breaker.retry_at = 0
+        self.plugin.retryAfter.clear()
+        self.sample(11.0)
+
+        self.assertEqual(breaker.state, u"closed")
+        self.assertEqual(dev.states['circuitState'], u"closed")
+        self.assertEqual(self.h.stub.count(method='HEAD'), 1)
+        self.assertEqual(self.h.stub.count(r'/bulk_update\.json$'), 1)
+        self.assertEqual(self.pending(), 0)
+        self.assertEqual([float(entry['field1']) for entry in self.feed()], [0.0, 1.0, 2.0, 10.0, 11.0])
+        self.assertEqual([entry['created_at'][:19] for entry in self.feed()[:-1]], queued)
+
+
+class LimitTest(IntegrationTest):
+
+    def test_429_defers_channel(self):
+
+        dev = self.device(uploadMode='bulk', devSampleInterval='60')
+        self.start()
+        self.queue(dev, 5)
+
+        self.h.stub.inject(429, path=r'/bulk_update\.json$')
+        self.h.upload_all()
+
+        # Nothing is lost and the channel waits before trying again.
+        self.assertEqual(self.pending(), 6)
+        self.assertEqual(self.feed(), [])
+        retry_in = self.plugin.retryAfter[str(self.channel['id'])] - t.time()
+        self.assertTrue(retry_in > 0)
+
+        limiter = self.plugin.accounts.get().rate_limiter
+        self.assertTrue(limiter.acquire(str(self.channel['id'])) > 0)
+
+        # A scheduler pass before the retry time leaves the channel alone.
+        posts = self.h.stub.count(r'/bulk_update\.json$')
+        self.h.upload_due()
+        self.assertEqual(self.h.stub.count(r'/bulk_update\.json$'), posts)
+
+        # After the wait everything goes out together.
+        self.plugin.retryAfter.clear()
+        limiter.holds.clear()
+        self.h.upload_all()
+        self.assertEqual(self.pending(), 0)
+        self.assertEqual(len(self.feed()), 6)
+
+    # =============================================================================
+    def test_402_holds_account(self):
+
+        other = self.h.stub.add_channel(u"Garage", [u"Value"])
+        self.device()
+        self.h.add_channel_device(other, [(self.sensor, 'value')])
+        self.start()
+
+        limiter = self.plugin.accounts.get().rate_limiter
+        limiter.configure(0, 1000)
+
+        # The message budget is spent: the account waits, not just the channel.
+        self.h.stub.inject(402, path=r'^/update')
+        self.sample(1.0)
+
+        self.assertTrue(limiter.acquire(str(self.channel['id'])) > 3000)
+        self.assertTrue(limiter.acquire(str(other['id'])) > 3000)
+        self.assertEqual(self.plugin.uploadQueue.pending(), 1)
+
+        # Further samples queue up without a request being made.
+        self.plugin.retryAfter.clear()
+        updates = self.h.stub.count(r'^/update')
+        self.sample(2.0)
+        self.assertEqual(self.h.stub.count(r'^/update'), updates)
+
+    # =============================================================================
+    def test_update_too_soon(self):
+
+        self.h.stub.update_interval = 15
+        self.device()
+        self.start()
+
+        self.sample(1.0)
+        self.assertEqual(len(self.feed()), 1)
+
+        # Thingspeak answers an update inside the interval with 0; the sample is kept.
+        self.sample(2.0)
+        self.assertEqual(len(self.feed()), 1)
+        self.assertEqual(self.pending(), 1)
+
+
+class BulkUpdateTest(IntegrationTest):
+
+    def test_bulk_update_keeps_timestamps(self):
+
+        dev = self.device(uploadMode='bulk', devSampleInterval='60')
+        self.start()
+        self.queue(dev, 4)
+        self.h.upload_all()
+
+        self.assertEqual(self.h.stub.count(r'/bulk_update\.json$'), 1)
+        self.assertEqual(self.h.stub.count(r'^/update'), 0)
+        self.assertEqual(self.pending(), 0)
+        self.assertEqual([entry['created_at'][:19] for entry in self.feed()[:4]],
+                         [CREATED_AT.format(n)[:19] for n in range(4)])
+        self.assertEqual(dev.states['thingState'], True)
+        self.assertEqual(float(dev.states['thing1']), 1.0)
+
+    # =============================================================================
+    def test_bulk_update_splits_large_backlog(self):
+
+        dev = self.device(uploadMode='bulk', devSampleInterval='60')
+        self.start()
+        self.queue(dev, 1500)
+        self.h.upload_all()
+
+        self.assertEqual(self.h.stub.count(r'/bulk_update\.json$'), 2)
+        self.assertEqual(self.pending(), 0)
+        self.assertEqual(len(self.feed()), 1501)
+
+
+class AccountSettingsTest(IntegrationTest):
+
+    def setUp(self):
+        super(AccountSettingsTest, self).setUp()
+
+        # Validation only checks keys against the Thingspeak service; point that at the stub.
+        import transport
+        self.addCleanup(setattr, transport, 'REMOTE_HOST', transport.REMOTE_HOST)
+        transport.REMOTE_HOST = self.h.stub.host
+
+    # =============================================================================
+    def validate(self, api_key):
+
+        errors = {}
+        self.plugin.validateAccountSettings({'apiKey': api_key, 'devicePort': False, 'licenseUnits': 1}, errors)
+        return errors
+
+    # =============================================================================
+    def test_revoked_key_is_rejected(self):
+
+        self.start()
+        api_key = self.h.stub.api_key
+        self.plugin.channelLists.get(*self.plugin.channelListRequest())
+
+        self.assertEqual(self.validate(api_key), {})
+
+        # The cached channel list still answers for the old key; Thingspeak doesn't.
+        self.h.stub.api_key = u"NEWKEY0000000000"
+        self.assertTrue('apiKey' in self.validate(api_key))
+
+    # =============================================================================
+    def test_empty_key_isnt_checked(self):
+
+        self.start()
+        lists = self.h.stub.count(r'^/channels\.json$')
+
+        self.assertEqual(self.validate(u""), {})
+        self.assertEqual(self.h.stub.count(r'^/channels\.json$'), lists)
+
+
+class FeedExportTest(IntegrationTest):
+
+    def setUp(self):
+        super(FeedExportTest, self).setUp()
+        self.folder = tempfile.mkdtemp(prefix="export-")
+        self.base   = int(t.time()) - 3 * 86400
+        self.channel['created_at'] = timestamp(self.base)
+
+    # =============================================================================
+    def tearDown(self):
+        super(FeedExportTest, self).tearDown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # =============================================================================
+    def add(self, *offsets):
+
+        self.h.stub.add_entries(self.channel['id'], [(self.base + offset, {'field1': offset}) for offset in offsets])
+
+    # =============================================================================
+    def export(self):
+
+        self.plugin.channelExportStart({'channelList': str(self.channel['id']), 'exportFormat': 'csv',
+                                        'exportFolder': self.folder})
+        exporter = self.plugin.exports[str(self.channel['id'])]
+
+        while str(self.channel['id']) in self.plugin.exports:
+            t.sleep(0.01)
+
+        with open(os.path.join(self.folder, 'channel_{0}.csv'.format(self.channel['id']))) as f:
+            rows = [line.split(',')[:2] for line in f.read().splitlines()[1:]]
+
+        return exporter, [int(entry_id) for _, entry_id in rows]
+
+    # =============================================================================
+    def test_export_orders_by_created_at(self):
+
+        # Entry 3 is a replayed sample, older than the entries before it.
+        self.add(3600, 7200, 60)
+        self.start()
+
+        exporter, entry_ids = self.export()
+
+        self.assertEqual(entry_ids, [3, 1, 2])
+        self.assertEqual(exporter.missing, 0)
+
+    # =============================================================================
+    def test_resume_reports_replayed_entries(self):
+
+        self.add(3600, 7200)
+        self.start()
+        self.export()
+
+        # Entry 3 is replayed with a timestamp the first export has already passed;
+        # a resumed export can't see it, only count it.
+        self.add(60, 10800)
+        exporter, entry_ids = self.export()
+
+        self.assertEqual(entry_ids, [1, 2, 4])
+        self.assertEqual(exporter.missing, 1)
+
+        # A new file picks it up.
+        os.remove(os.path.join(self.folder, 'channel_{0}.csv'.format(self.channel['id'])))
+        exporter, entry_ids = self.export()
+
+        self.assertEqual(entry_ids, [3, 1, 2, 4])
+        self.assertEqual(exporter.missing, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_rate_limit.py
+:author: DaveL17
+
+Unit tests for rate_limit.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import os
+import sys
+import time as t
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import rate_limit
+
+# =============================================================================
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_interval_spaces_channel_updates(self):
+
+        limiter = rate_limit.RateLimiter(15, 0)
+
+        self.assertEqual(limiter.acquire('c'), 0)
+        self.assertAlmostEqual(limiter.acquire('c'), 15, places=0)
+        self.assertEqual(limiter.acquire('other'), 0)
+
+    # =============================================================================
+    def test_no_interval_means_no_limit(self):
+
+        limiter = rate_limit.RateLimiter(0, 0)
+
+        for _ in range(5):
+            self.assertEqual(limiter.acquire('c'), 0)
+
+        self.assertEqual(limiter.channels, {})
+
+    # =============================================================================
+    def test_turning_interval_off_drops_buckets(self):
+
+        limiter = rate_limit.RateLimiter(15, 0)
+        limiter.acquire('c')
+        limiter.configure(0, 0)
+
+        self.assertEqual(limiter.acquire('c'), 0)
+        self.assertEqual(limiter.acquire('c'), 0)
+
+    # =============================================================================
+    def test_429_without_interval_holds_then_expires(self):
+
+        limiter = rate_limit.RateLimiter(0, 0)
+        limiter.record_response('c', 429)
+
+        self.assertAlmostEqual(limiter.acquire('c'), rate_limit.BUSY_DELAY, places=0)
+
+        # Once the hold has run out the channel is unlimited again.
+        limiter.holds['c'] -= rate_limit.BUSY_DELAY + 1
+
+        for _ in range(3):
+            self.assertEqual(limiter.acquire('c'), 0)
+
+        self.assertEqual(limiter.channels, {})
+        self.assertEqual(limiter.holds, {})
+
+    # =============================================================================
+    def test_429_hold_survives_turning_interval_off(self):
+
+        limiter = rate_limit.RateLimiter(15, 0)
+        limiter.record_response('c', 429)
+        limiter.configure(0, 0)
+
+        self.assertTrue(limiter.acquire('c') > rate_limit.BUSY_DELAY - 1)
+
+    # =============================================================================
+    def test_429_hold_is_never_shortened(self):
+
+        limiter = rate_limit.RateLimiter(0, 0)
+        limiter.holds['c'] = t.time() + 100
+        limiter.record_response('c', 429)
+
+        self.assertTrue(limiter.acquire('c') > 99)
+
+    # =============================================================================
+    def test_interval_change_keeps_wait(self):
+
+        limiter = rate_limit.RateLimiter(15, 0)
+        limiter.acquire('c')
+
+        # A shorter interval doesn't shorten the wait; a longer one adds the difference.
+        limiter.configure(1, 0)
+        self.assertAlmostEqual(limiter.acquire('c'), 15, places=0)
+
+        limiter.configure(30, 0)
+        self.assertAlmostEqual(limiter.acquire('c'), 44, places=0)
+
+    # =============================================================================
+    def test_interval_from_off(self):
+
+        limiter = rate_limit.RateLimiter(0, 0)
+        limiter.acquire('c')
+        limiter.configure(15, 0)
+
+        self.assertEqual(limiter.acquire('c'), 0)
+        self.assertAlmostEqual(limiter.acquire('c'), 15, places=0)
+
+    # =============================================================================
+    def test_budget_is_shared_and_kept(self):
+
+        limiter = rate_limit.RateLimiter(0, 10)
+
+        self.assertEqual(limiter.acquire('a', 6), 0)
+        self.assertTrue(limiter.acquire('b', 6) > 0)
+
+        # Saving the prefs again doesn't refill the budget.
+        limiter.configure(0, 10)
+        self.assertTrue(limiter.acquire('b', 6) > 0)
+        self.assertEqual(limiter.acquire('b', 4), 0)
+
+    # =============================================================================
+    def test_402_holds_account(self):
+
+        limiter = rate_limit.RateLimiter(0, 1000)
+        limiter.record_response('a', 402)
+
+        self.assertTrue(limiter.acquire('a') > rate_limit.PAYMENT_DELAY - 1)
+        self.assertTrue(limiter.acquire('b') > rate_limit.PAYMENT_DELAY - 1)
+
+    # =============================================================================
+    def test_license_limits(self):
+
+        self.assertEqual(rate_limit.license_limits(u'free', 1), (15, 3000000 // 365))
+        self.assertEqual(rate_limit.license_limits(u'paid', 2), (1, 66000000 // 365))
+        self.assertEqual(rate_limit.license_limits(u'unknown', 0), (15, 3000000 // 365))
+
+
+if __name__ == '__main__':
+    unittest.main()
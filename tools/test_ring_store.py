@@ -0,0 +1,147 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_ring_store.py
+:author: DaveL17
+
+Unit tests for ring_store.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import ring_store
+
+# =============================================================================
+
+BASE = 1760000400  # A whole hour, so buckets line up with the samples.
+
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="history-")
+        self.store  = ring_store.HistoryStore(self.folder)
+
+    # =============================================================================
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # =============================================================================
+    def test_raw_values(self):
+
+        for n in range(10):
+            self.store.record('c', BASE + n * 15, {'field1': n, 'field2': u"72.5"})
+
+        records = self.store.query('c', 1, BASE, BASE + 1000)
+
+        self.assertEqual([record[1] for record in records], [float(n) for n in range(10)])
+        self.assertEqual(self.store.query('c', 2, BASE, BASE + 1000)[0][1], 72.5)
+        self.assertEqual(self.store.query('c', 3, BASE, BASE + 1000), [])
+
+    # =============================================================================
+    def test_values_that_arent_numbers_are_skipped(self):
+
+        self.store.record('c', BASE, {'field1': u"on", 'field2': None})
+
+        self.assertEqual(self.store.query('c', 1, BASE, BASE + 10), [])
+        self.assertEqual(self.store.query('unknown', 1, BASE, BASE + 10), [])
+
+    # =============================================================================
+    def test_rollups(self):
+
+        # One value a minute for an hour: 0, 1, 2, ...
+        for n in range(60):
+            self.store.record('c', BASE + n * 60, {'field1': n})
+
+        points = self.store.query('c', 1, BASE, BASE + 3600, step=300)
+
+        self.assertEqual(len(points), 12)
+        self.assertEqual(points[0], [BASE, 2.0, 0.0, 4.0, 5])
+        self.assertEqual(points[-1], [BASE + 3300, 57.0, 55.0, 59.0, 5])
+
+        # Wider steps combine the tier's records.
+        points = self.store.query('c', 1, BASE, BASE + 3600, step=900)
+        self.assertEqual(points[0], [BASE, 7.0, 0.0, 14.0, 15])
+
+    # =============================================================================
+    def test_history_survives_reopen(self):
+
+        self.store.record('c', BASE, {'field1': 1.5})
+        self.store.close()
+        self.store = ring_store.HistoryStore(self.folder)
+
+        self.assertEqual(self.store.query('c', 1, BASE, BASE)[0][1], 1.5)
+
+    # =============================================================================
+    def test_remove(self):
+
+        self.store.record('c', BASE, {'field1': 1.5})
+        self.store.remove('c')
+
+        self.assertEqual(self.store.query('c', 1, BASE, BASE), [])
+
+
+class WrapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tiers  = ring_store.TIERS
+        self.folder = tempfile.mkdtemp(prefix="history-")
+
+        ring_store.TIERS = ((0, 4), (300, 4), (3600, 4))
+        self.store = ring_store.HistoryStore(self.folder)
+
+    # =============================================================================
+    def tearDown(self):
+        self.store.close()
+        ring_store.TIERS = self.tiers
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # =============================================================================
+    def test_full_ring_keeps_newest(self):
+
+        for n in range(10):
+            self.store.record('c', BASE + n, {'field1': n})
+
+        records = self.store.query('c', 1, BASE + 6, BASE + 100)
+
+        self.assertEqual([record[1] for record in records], [6.0, 7.0, 8.0, 9.0])
+
+    # =============================================================================
+    def test_falls_back_to_tier_that_reaches_back(self):
+
+        # Raw holds the last 4 minutes; the 5 minute tier still has the start.
+        for n in range(20):
+            self.store.record('c', BASE + n * 60, {'field1': n})
+
+        records = self.store.query('c', 1, BASE, BASE + 3600)
+
+        self.assertEqual(records[0][0], BASE)
+        self.assertEqual(records[0][4], 5)
+
+    # =============================================================================
+    def test_file_with_other_layout_starts_over(self):
+
+        self.store.record('c', BASE, {'field1': 1.0})
+        self.store.close()
+
+        ring_store.TIERS = ((0, 8), (300, 4), (3600, 4))
+        self.store = ring_store.HistoryStore(self.folder)
+
+        self.assertEqual(self.store.query('c', 1, BASE, BASE), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
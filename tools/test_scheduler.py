@@ -0,0 +1,101 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_scheduler.py
+:author: DaveL17
+
+Unit tests for scheduler.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import os
+import sys
+import threading
+import time as t
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import scheduler
+
+# =============================================================================
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = scheduler.Scheduler()
+
+    # =============================================================================
+    def test_pop_due_in_time_order(self):
+
+        self.scheduler.schedule(1, 30)
+        self.scheduler.schedule(2, 10)
+        self.scheduler.schedule(3, 20)
+
+        self.assertEqual(self.scheduler.pop_due(25), [2, 3])
+        self.assertEqual(self.scheduler.next_due(), 30)
+        self.assertEqual(self.scheduler.pop_due(25), [])
+
+    # =============================================================================
+    def test_reschedule_replaces_due_time(self):
+
+        self.scheduler.schedule(1, 10)
+        self.scheduler.schedule(1, 50)
+
+        self.assertEqual(self.scheduler.pop_due(20), [])
+        self.assertEqual(self.scheduler.next_due(), 50)
+        self.assertEqual(self.scheduler.pop_due(50), [1])
+
+    # =============================================================================
+    def test_removed_device_isnt_due(self):
+
+        self.scheduler.schedule(1, 10)
+        self.scheduler.remove(1)
+
+        self.assertEqual(self.scheduler.pop_due(20), [])
+        self.assertEqual(self.scheduler.next_due(), None)
+
+    # =============================================================================
+    def test_wait_returns_when_due(self):
+
+        self.scheduler.schedule(1, t.time() + 0.05)
+        started = t.time()
+        self.scheduler.wait(max_sleep=5)
+
+        self.assertTrue(t.time() - started < 2)
+
+    # =============================================================================
+    def test_earlier_schedule_interrupts_wait(self):
+
+        self.scheduler.schedule(1, t.time() + 60)
+        timer   = threading.Timer(0.05, self.scheduler.schedule, (2, t.time()))
+        started = t.time()
+        timer.start()
+        self.scheduler.wait(max_sleep=5)
+
+        self.assertTrue(t.time() - started < 2)
+
+    # =============================================================================
+    def test_wake_before_wait_isnt_lost(self):
+
+        self.scheduler.schedule(1, t.time() + 60)
+        self.scheduler.wake()
+        started = t.time()
+        self.scheduler.wait(max_sleep=5)
+
+        self.assertTrue(t.time() - started < 1)
+
+        # It only counts once.
+        started = t.time()
+        self.scheduler.wait(max_sleep=0.2)
+        self.assertTrue(t.time() - started >= 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_single_flight.py
+:author: DaveL17
+
+Unit tests for single_flight.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import logging
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import single_flight
+
+# =============================================================================
+
+
+class FakePlugin(object):
+
+    logger = logging.getLogger("Plugin.test")
+
+
+class SlowFetch(object):
+    """
+    Fetch that blocks until released and counts its calls
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.calls   = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.calls
+        self.started.set()
+        self.release.wait(5)
+        return result
+
+
+def in_thread(func, *args):
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func(*args)))
+    thread.start()
+    return thread, result
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+
+        flight = single_flight.SingleFlight()
+        fetch  = SlowFetch()
+
+        first, first_result = in_thread(flight.do, 'k', fetch)
+        fetch.started.wait(5)
+        second, second_result = in_thread(flight.do, 'k', fetch)
+
+        self.assertTrue(flight.in_flight('k'))
+        fetch.release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(first_result + second_result, [1, 1])
+        self.assertFalse(flight.in_flight('k'))
+
+    # =============================================================================
+    def test_errors_reach_every_caller(self):
+
+        flight = single_flight.SingleFlight()
+
+        def fail():
+            raise ValueError
+
+        self.assertRaises(ValueError, flight.do, 'k', fail)
+        self.assertFalse(flight.in_flight('k'))
+
+
+class StaleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = single_flight.StaleCache(FakePlugin(), fresh=60)
+        self.calls = []
+
+    # =============================================================================
+    def fetch(self):
+
+        self.calls.append(1)
+        return len(self.calls)
+
+    # =============================================================================
+    def test_fresh_result_is_served_from_cache(self):
+
+        self.assertEqual(self.cache.get('k', self.fetch), 1)
+        self.assertEqual(self.cache.get('k', self.fetch), 1)
+        self.assertEqual(len(self.calls), 1)
+
+    # =============================================================================
+    def test_stale_result_is_served_then_refreshed(self):
+
+        self.cache.get('k', self.fetch)
+        self.cache.fresh = -1
+
+        self.assertEqual(self.cache.get('k', self.fetch), 1)
+
+        for thread in threading.enumerate():
+            if thread.name == "ThingspeakRevalidate":
+                thread.join(5)
+
+        self.assertEqual(self.cache.entries['k'][1], 2)
+
+    # =============================================================================
+    def test_rejected_results_arent_cached(self):
+
+        cache = single_flight.StaleCache(FakePlugin(), accept=lambda result: result > 1)
+
+        self.assertEqual(cache.get('k', self.fetch), 1)
+        self.assertEqual(cache.get('k', self.fetch), 2)
+        self.assertEqual(cache.get('k', self.fetch), 2)
+
+    # =============================================================================
+    def test_invalidate_doesnt_join_older_fetch(self):
+
+        fetch = SlowFetch()
+
+        old, old_result = in_thread(self.cache.refresh, 'k', fetch)
+        fetch.started.wait(5)
+
+        # E.g., a channel was just created: the listing already being fetched doesn't have it.
+        self.cache.invalidate()
+        fetch.release.set()
+
+        self.assertEqual(self.cache.get('k', fetch), 2)
+        old.join(5)
+
+        self.assertEqual(old_result, [1])
+        self.assertEqual(self.cache.entries['k'][1], 2)
+        self.assertEqual(fetch.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
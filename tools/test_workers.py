@@ -0,0 +1,104 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: test_workers.py
+:author: DaveL17
+
+Unit tests for workers.py
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'thingspeak.indigoPlugin', 'Contents', 'Server Plugin'))
+
+# My modules
+import workers
+
+# =============================================================================
+
+
+class ChannelWorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = workers.ChannelWorkerPool(None, 2, 4)
+
+    # =============================================================================
+    def tearDown(self):
+        self.pool.stop()
+
+    # =============================================================================
+    def test_channel_jobs_run_in_order(self):
+
+        done = []
+
+        for n in range(20):
+            # A busy channel takes no second job, so wait for each one.
+            while not self.pool.submit('c', done.append, n):
+                pass
+
+        self.pool.stop()
+        self.assertEqual(done, list(range(20)))
+
+    # =============================================================================
+    def test_busy_channel_is_skipped(self):
+
+        release = threading.Event()
+
+        self.assertTrue(self.pool.submit('c', release.wait))
+        self.assertFalse(self.pool.submit('c', release.wait))
+        self.assertTrue(self.pool.is_busy('c'))
+
+        release.set()
+        self.pool.stop()
+        self.assertFalse(self.pool.is_busy('c'))
+
+    # =============================================================================
+    def test_resized_pool_waits_for_old_jobs(self):
+
+        release = threading.Event()
+        ran     = []
+
+        self.pool.submit('c', release.wait)
+
+        old       = self.pool
+        self.pool = old.resized(3, 8)
+        old.stop(timeout=0)
+
+        # The channel is still draining on the old pool.
+        self.assertTrue(self.pool.is_busy('c'))
+        self.assertFalse(self.pool.submit('c', ran.append, 1))
+        self.assertTrue(self.pool.submit('other', ran.append, 2))
+
+        release.set()
+        old.stop()
+
+        self.assertTrue(self.pool.submit('c', ran.append, 3))
+        self.pool.stop()
+        self.assertEqual(sorted(ran), [2, 3])
+
+
+class StateWriterTest(unittest.TestCase):
+
+    def test_writes_apply_in_order(self):
+
+        writer = workers.StateWriter(None)
+        done   = []
+
+        for n in range(50):
+            writer.submit(done.append, n)
+
+        writer.flush()
+        writer.stop()
+        self.assertEqual(done, list(range(50)))
+
+
+if __name__ == '__main__':
+    unittest.main()
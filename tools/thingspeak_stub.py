@@ -0,0 +1,670 @@
+#!/usr/bin/env python2.6
+# -*- coding: utf-8 -*-
+
+"""
+:filename: thingspeak_stub.py
+:author: DaveL17
+
+Stand-in Thingspeak server for offline testing of the Thingspeak Plugin
+
+StubThingspeak is a small threaded HTTP server that answers the parts of the
+Thingspeak API the plugin uses:
+
+    GET    /channels.json                    list the account's channels
+    POST   /channels.json                    create a channel
+    PUT    /channels/<id>.json               update a channel
+    DELETE /channels/<id>.json|.xml          delete a channel
+    GET    /channels/<id>/feeds.json         read a channel's feed (results, start, end)
+    DELETE /channels/<id>/feeds.json|.xml    clear a channel's feed
+    GET    /update.json, POST /update.json   write one entry
+    POST   /channels/<id>/bulk_update.json   write several entries
+    HEAD   /                                 circuit breaker probe
+
+It keeps channels and feeds in memory and enforces the same kind of limits
+Thingspeak does: a minimum interval between updates to a channel (an update
+that comes too soon is answered with 0, as Thingspeak does; a bulk update
+gets a 429) and a daily message budget (402 once it's spent). Latency and
+failures can be injected, either scripted (inject()) or at random
+(fault_rate). Every request is recorded in `requests`.
+
+Run it on its own to point a plugin at it (use the plugin's local server
+setting):
+
+    python tools/thingspeak_stub.py --port 3000 --channels 3 --latency 0.2
+"""
+
+# ================================== IMPORTS ==================================
+
+# Built-in modules
+import argparse
+import calendar
+import json
+import random
+import re
+import ssl
+import threading
+import time as t
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+# =============================================================================
+
+API_KEY       = u"STUBACCOUNTKEY00"  # The account API key the stub accepts.
+TIMEOUT       = u'timeout'           # Fault: hold the request for timeout_delay seconds before answering.
+DROP          = u'drop'              # Fault: close the connection without answering.
+TIMEOUT_DELAY = 30                   # Longer than any request timeout the plugin uses.
+MAX_RESULTS   = 8000                 # Most entries one feed request returns.
+TIME_FORMAT   = '%Y-%m-%d %H:%M:%S'  # Format of the feed request's start and end parameters.
+
+ROUTES = [('GET',    re.compile(r'^/channels\.json$'),                      '_list_channels'),
+          ('POST',   re.compile(r'^/channels\.json$'),                      '_create_channel'),
+          ('PUT',    re.compile(r'^/channels/(\d+)\.json$'),                '_update_channel'),
+          ('DELETE', re.compile(r'^/channels/(\d+)\.(?:json|xml)$'),        '_delete_channel'),
+          ('GET',    re.compile(r'^/channels/(\d+)/feeds\.json$'),          '_read_feed'),
+          ('DELETE', re.compile(r'^/channels/(\d+)/feeds\.(?:json|xml)$'),  '_clear_feed'),
+          ('GET',    re.compile(r'^/update(?:\.json)?$'),                   '_update'),
+          ('POST',   re.compile(r'^/update(?:\.json)?$'),                   '_update'),
+          ('POST',   re.compile(r'^/channels/(\d+)/bulk_update\.json$'),    '_bulk_update'),
+          ]
+
+CHANNEL_PARMS = ('name', 'description', 'metadata', 'url', 'elevation', 'latitude', 'longitude') + \
+                tuple('field{0}'.format(_) for _ in range(1, 9))
+
+
+def timestamp(epoch=None):
+    """
+    Return a Thingspeak style UTC timestamp
+
+    -----
+
+    :param float epoch:
+    :return str:
+    """
+
+    return t.strftime('%Y-%m-%dT%H:%M:%SZ', t.gmtime(t.time() if epoch is None else epoch))
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body go out in separate writes; don't let Nagle hold the body.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.stub.handle(self, 'GET')
+
+    def do_POST(self):
+        self.server.stub.handle(self, 'POST')
+
+    def do_PUT(self):
+        self.server.stub.handle(self, 'PUT')
+
+    def do_DELETE(self):
+        self.server.stub.handle(self, 'DELETE')
+
+    def do_HEAD(self):
+        self.server.stub.handle(self, 'HEAD')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up on a held (or dropped) request aren't an error.
+        pass
+
+
+class StubThingspeak(object):
+    """
+    In-memory Thingspeak API server
+
+    update_interval and messages_per_day default to no limit; use
+    rate_limit.license_limits() to get the numbers for a real license.
+    """
+
+    def __init__(self, port=0, api_key=API_KEY, latency=0.0, update_interval=0, messages_per_day=0, certfile=None):
+        self.port             = port
+        self.api_key          = api_key
+        self.latency          = latency  # Seconds, or a (min, max) tuple for a random delay.
+        self.update_interval  = update_interval
+        self.messages_per_day = messages_per_day
+        self.certfile         = certfile
+        self.timeout_delay    = TIMEOUT_DELAY
+        self.fault_rate       = 0.0  # Chance that any request fails with one of fault_statuses.
+        self.fault_statuses   = (429, 500, 503)
+        self.lock             = threading.Lock()
+        self.stopping         = threading.Event()
+        self.channels         = {}  # Channel id -> channel dict as Thingspeak returns it.
+        self.feeds            = {}  # Channel id -> [entry, ...]
+        self.last_update      = {}  # Channel id -> epoch of the last accepted update.
+        self.messages_today   = 0
+        self.day              = t.gmtime()[:3]
+        self.faults           = []  # [[fault, remaining count, path pattern], ...]
+        self.requests         = []  # [(method, path, query dict, body), ...]
+        self.server           = None
+        self.next_id          = 100
+
+    # =============================================================================
+    @property
+    def host(self):
+        """
+        host:port to use as the plugin's local Thingspeak server
+
+        -----
+
+        :return str:
+        """
+
+        return u"127.0.0.1:{0}".format(self.server.server_address[1])
+
+    # =============================================================================
+    def start(self):
+        """
+        Start serving on a background thread
+
+        -----
+
+        :return StubThingspeak: self
+        """
+
+        self.stopping.clear()
+        self.server      = _Server(('127.0.0.1', self.port), _Handler)
+        self.server.stub = self
+
+        if self.certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.load_cert_chain(self.certfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+
+        thread = threading.Thread(target=self.server.serve_forever, name="ThingspeakStub")
+        thread.daemon = True
+        thread.start()
+
+        return self
+
+    # =============================================================================
+    def stop(self):
+        """
+        Stop serving (requests held by a timeout fault are released)
+
+        -----
+
+        """
+
+        self.stopping.set()
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    # =============================================================================
+    def add_channel(self, name=None, fields=None, **parms):
+        """
+        Create a channel directly (without an API request)
+
+        -----
+
+        :param str name:
+        :param list fields: labels for field1, field2, ...
+        :return dict: the channel
+        """
+
+        parms = dict(parms)
+        parms['name'] = name
+
+        for n, label in enumerate(fields or [], 1):
+            parms['field{0}'.format(n)] = label
+
+        with self.lock:
+            return self._new_channel(parms)
+
+    # =============================================================================
+    def add_entries(self, channel_id, rows):
+        """
+        Add entries to a channel's feed directly (e.g., history with old timestamps)
+
+        -----
+
+        :param int channel_id:
+        :param rows: iterable of (epoch, {'field1': value, ...}), oldest first
+        :return int: the last entry id
+        """
+
+        with self.lock:
+            channel = self.channels[int(channel_id)]
+
+            for epoch, values in rows:
+                self._add_entry(channel, values, created_at=timestamp(epoch))
+
+            return channel['last_entry_id']
+
+    # =============================================================================
+    def inject(self, fault, count=1, path=None):
+        """
+        Make the next `count` requests (to paths matching `path`) fail
+
+        -----
+
+        :param fault: an HTTP status code, TIMEOUT or DROP
+        :param int count:
+        :param str path: regular expression matched against the request path
+        """
+
+        with self.lock:
+            self.faults.append([fault, count, re.compile(path) if path else None])
+
+    # =============================================================================
+    def reset_requests(self):
+        """
+        Forget the recorded requests
+
+        -----
+
+        """
+
+        with self.lock:
+            del self.requests[:]
+
+    # =============================================================================
+    def count(self, path=None, method=None):
+        """
+        Return the number of recorded requests matching a path pattern and method
+
+        -----
+
+        :param str path: regular expression matched against the request path
+        :param str method:
+        :return int:
+        """
+
+        pattern = re.compile(path) if path else None
+
+        return len([1 for m, p, _, _ in list(self.requests)
+                    if (method is None or m == method) and (pattern is None or pattern.search(p))])
+
+    # =============================================================================
+    def write_key(self, channel_id):
+        """
+        Return the write key of a channel
+
+        -----
+
+        :param int channel_id:
+        :return str:
+        """
+
+        return self.channels[int(channel_id)]['api_keys'][0]['api_key']
+
+    # =============================================================================
+    def handle(self, handler, method):
+
+        url   = urlparse(handler.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query, keep_blank_values=True).items())
+        size  = int(handler.headers.get('Content-Length') or 0)
+        body  = handler.rfile.read(size) if size else b''
+
+        if body and 'json' not in (handler.headers.get('Content-Type') or ''):
+            query.update((k, v[0]) for k, v in parse_qs(body.decode('utf-8'), keep_blank_values=True).items())
+
+        with self.lock:
+            self.requests.append((method, url.path, query, body))
+            fault = self._take_fault(url.path)
+
+        self._delay()
+
+        if fault == DROP:
+            handler.close_connection = True
+            return
+
+        if fault == TIMEOUT:
+            self.stopping.wait(self.timeout_delay)
+
+        if fault is not None and fault != TIMEOUT:
+            return self._send(handler, fault, {'status': str(fault), 'error': {'error_code': 'stub_fault'}})
+
+        if method == 'HEAD':
+            return self._send(handler, 200, None)
+
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(url.path)
+
+            if route_method == method and match:
+                try:
+                    body_json = json.loads(body.decode('utf-8')) if body and 'json' in \
+                        (handler.headers.get('Content-Type') or '') else {}
+                except ValueError:
+                    return self._send(handler, 400, {'status': '400'})
+
+                with self.lock:
+                    status, response = getattr(self, name)(query, body_json, *match.groups())
+
+                return self._send(handler, status, response)
+
+        return self._send(handler, 404, {'status': '404'})
+
+    # =============================================================================
+    def _delay(self):
+
+        latency = self.latency
+
+        if isinstance(latency, (tuple, list)):
+            latency = random.uniform(*latency)
+
+        if latency:
+            self.stopping.wait(latency)
+
+    # =============================================================================
+    def _take_fault(self, path):
+
+        for fault in self.faults:
+            if fault[2] is None or fault[2].search(path):
+                fault[1] -= 1
+
+                if fault[1] <= 0:
+                    self.faults.remove(fault)
+
+                return fault[0]
+
+        if self.fault_rate and random.random() < self.fault_rate:
+            return random.choice(self.fault_statuses)
+
+        return None
+
+    # =============================================================================
+    def _send(self, handler, status, response):
+
+        if path_is_xml(handler.path) and status == 200:
+            payload, content_type = b'<?xml version="1.0" encoding="UTF-8"?><response/>', 'application/xml'
+        elif response is None:
+            payload, content_type = b'', 'application/json'
+        else:
+            payload, content_type = json.dumps(response).encode('utf-8'), 'application/json'
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+
+        if handler.command != 'HEAD':
+            handler.wfile.write(payload)
+
+    # =============================================================================
+    def _new_channel(self, parms):
+
+        channel_id    = self.next_id
+        self.next_id += 1
+
+        channel = {'id':          channel_id,
+                   'name':        parms.get('name') or u"Channel {0}".format(channel_id),
+                   'description': parms.get('description', u""),
+                   'metadata':    parms.get('metadata', u""),
+                   'url':         parms.get('url'),
+                   'latitude':    parms.get('latitude', u"0.0"),
+                   'longitude':   parms.get('longitude', u"0.0"),
+                   'elevation':   parms.get('elevation', u""),
+                   'public_flag': parms.get('public_flag') in (True, 'true'),
+                   'created_at':  timestamp(),
+                   'ranking':     50,
+                   'last_entry_id': None,
+                   'tags':        [{'id': n, 'name': tag.strip()}
+                                   for n, tag in enumerate(parms.get('tags', u"").split(','), 1) if tag.strip()],
+                   'api_keys':    [{'api_key': u"W{0:015d}".format(channel_id), 'write_flag': True},
+                                   {'api_key': u"R{0:015d}".format(channel_id), 'write_flag': False}],
+                   }
+
+        for n in range(1, 9):
+            if parms.get('field{0}'.format(n)):
+                channel['field{0}'.format(n)] = parms['field{0}'.format(n)]
+
+        self.channels[channel_id] = channel
+        self.feeds[channel_id]    = []
+
+        return channel
+
+    # =============================================================================
+    def _channel_for_key(self, key):
+
+        for channel in self.channels.values():
+            if channel['api_keys'][0]['api_key'] == key:
+                return channel
+
+        return None
+
+    # =============================================================================
+    def _spend(self, messages):
+
+        # The budget resets at midnight UTC.
+        today = t.gmtime()[:3]
+
+        if today != self.day:
+            self.day            = today
+            self.messages_today = 0
+
+        if self.messages_per_day and self.messages_today + messages > self.messages_per_day:
+            return False
+
+        self.messages_today += messages
+        return True
+
+    # =============================================================================
+    def _too_soon(self, channel_id, now):
+
+        return self.update_interval and now - self.last_update.get(channel_id, 0) < self.update_interval
+
+    # =============================================================================
+    def _add_entry(self, channel, values, created_at=None):
+
+        entry_id = len(self.feeds[channel['id']]) + 1
+        entry    = {'channel_id': channel['id'], 'entry_id': entry_id, 'created_at': created_at or timestamp()}
+
+        for n in range(1, 9):
+            value = values.get('field{0}'.format(n))
+            entry['field{0}'.format(n)] = None if value is None else u"{0}".format(value)
+
+        for key in ('latitude', 'longitude', 'elevation', 'status'):
+            if key in values:
+                entry[key] = values[key]
+
+        self.feeds[channel['id']].append(entry)
+        channel['last_entry_id'] = entry_id
+
+        return entry
+
+    # =============================================================================
+    def _list_channels(self, query, body):
+
+        if query.get('api_key') != self.api_key:
+            return 401, {'status': '401', 'error': {'error_code': 'error_auth_required'}}
+
+        return 200, [self.channels[channel_id] for channel_id in sorted(self.channels)]
+
+    # =============================================================================
+    def _create_channel(self, query, body):
+
+        if query.get('api_key') != self.api_key:
+            return 401, {'status': '401'}
+
+        return 200, self._new_channel(query)
+
+    # =============================================================================
+    def _update_channel(self, query, body, channel_id):
+
+        channel = self.channels.get(int(channel_id))
+
+        if query.get('api_key') != self.api_key:
+            return 401, {'status': '401'}
+
+        if channel is None:
+            return 404, {'status': '404'}
+
+        for key in CHANNEL_PARMS:
+            if key in query:
+                channel[key] = query[key]
+
+        if 'tags' in query:
+            channel['tags'] = [{'id': n, 'name': tag.strip()}
+                               for n, tag in enumerate(query['tags'].split(','), 1) if tag.strip()]
+
+        if 'public_flag' in query:
+            channel['public_flag'] = query['public_flag'] == 'true'
+
+        return 200, channel
+
+    # =============================================================================
+    def _delete_channel(self, query, body, channel_id):
+
+        if query.get('api_key') != self.api_key:
+            return 401, {'status': '401'}
+
+        channel = self.channels.pop(int(channel_id), None)
+        self.feeds.pop(int(channel_id), None)
+
+        return (200, channel) if channel else (404, {'status': '404'})
+
+    # =============================================================================
+    def _read_feed(self, query, body, channel_id):
+
+        channel = self.channels.get(int(channel_id))
+
+        if channel is None:
+            return 404, {'status': '404'}
+
+        if query.get('api_key') not in (self.api_key,) + tuple(key['api_key'] for key in channel['api_keys']) \
+                and not channel['public_flag']:
+            return 401, {'status': '401'}
+
+        feeds = self.feeds[channel['id']]
+        info  = dict((k, v) for k, v in channel.items() if k not in ('api_keys', 'tags'))
+
+        # Like Thingspeak: the newest `results` entries (at most 8000) between start and end.
+        if query.get('start') or query.get('end'):
+            start = timestamp(calendar.timegm(t.strptime(query.get('start') or '1970-01-01 00:00:00', TIME_FORMAT)))
+            end   = timestamp(calendar.timegm(t.strptime(query.get('end') or '2100-01-01 00:00:00', TIME_FORMAT)))
+            feeds = [entry for entry in feeds if start <= entry['created_at'] <= end]
+
+        count = min(int(query.get('results', 100)), MAX_RESULTS)
+
+        return 200, {'channel': info, 'feeds': feeds[-count:] if count else []}
+
+    # =============================================================================
+    def _clear_feed(self, query, body, channel_id):
+
+        if query.get('api_key') != self.api_key:
+            return 401, {'status': '401'}
+
+        if int(channel_id) not in self.channels:
+            return 404, {'status': '404'}
+
+        self.feeds[int(channel_id)] = []
+        self.channels[int(channel_id)]['last_entry_id'] = None
+
+        return 200, {}
+
+    # =============================================================================
+    def _update(self, query, body):
+
+        channel = self._channel_for_key(query.get('api_key') or query.get('key'))
+        now     = t.time()
+
+        if channel is None:
+            return 401, {'status': '401', 'error': {'error_code': 'error_auth_required'}}
+
+        # Thingspeak answers an update that comes too soon with 0 rather than an error.
+        if self._too_soon(channel['id'], now):
+            return 200, 0
+
+        if not self._spend(1):
+            return 402, {'status': '402'}
+
+        self.last_update[channel['id']] = now
+
+        return 200, self._add_entry(channel, query)
+
+    # =============================================================================
+    def _bulk_update(self, query, body, channel_id):
+
+        channel = self.channels.get(int(channel_id))
+        now     = t.time()
+
+        if channel is None:
+            return 404, {'status': '404'}
+
+        if body.get('write_api_key') != channel['api_keys'][0]['api_key']:
+            return 401, {'status': '401'}
+
+        if self._too_soon(channel['id'], now):
+            return 429, {'status': '429'}
+
+        updates = body.get('updates') or []
+
+        if not self._spend(len(updates)):
+            return 402, {'status': '402'}
+
+        self.last_update[channel['id']] = now
+
+        for update in updates:
+            self._add_entry(channel, update, update.get('created_at'))
+
+        return 202, {'success': True}
+
+
+def path_is_xml(path):
+    """
+    Return True for the .xml endpoints (answered with XML rather than JSON)
+
+    -----
+
+    :param str path:
+    :return bool:
+    """
+
+    return urlparse(path).path.endswith('.xml')
+
+
+# =============================================================================
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=u"Stand-in Thingspeak API server.")
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--api-key', default=API_KEY)
+    parser.add_argument('--channels', type=int, default=1, help=u"channels to create at startup")
+    parser.add_argument('--latency', type=float, default=0.0, help=u"seconds added to every response")
+    parser.add_argument('--update-interval', type=int, default=0, help=u"minimum seconds between channel updates")
+    parser.add_argument('--messages-per-day', type=int, default=0, help=u"daily message budget (0 for no limit)")
+    parser.add_argument('--fault-rate', type=float, default=0.0, help=u"chance that a request fails (0 to 1)")
+    parser.add_argument('--certfile', help=u"PEM certificate and key to serve HTTPS")
+    args = parser.parse_args()
+
+    stub = StubThingspeak(port=args.port, api_key=args.api_key, latency=args.latency,
+                          update_interval=args.update_interval, messages_per_day=args.messages_per_day,
+                          certfile=args.certfile)
+    stub.fault_rate = args.fault_rate
+
+    for _ in range(args.channels):
+        stub.add_channel(fields=[u"Field {0}".format(n) for n in range(1, 9)])
+
+    stub.start()
+    print(u"Thingspeak stub listening on {0} (API key {1}).".format(stub.host, stub.api_key))
+
+    for channel in stub.channels.values():
+        print(u"  Channel {0}: write key {1}".format(channel['id'], channel['api_keys'][0]['api_key']))
+
+    try:
+        while True:
+            t.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()